@@ -1,25 +1,40 @@
 # agents/citation_agent/agent.py
 from typing import List, Dict, Any, Optional
 import logging
-import requests
 from datetime import datetime
 import json
+import os
 import re
 from crossref.restful import Works
 from models.citation import format_citation
+from utils.metrics import upstream_call
+from utils.rate_limit import get_rate_limiter
+from utils.http import http_get
+from utils.single_flight import SingleFlight
+from backend.paper_metadata import get_metadata_hydrator
+from utils.config import Config
 
 class CitationAgent:
     """
     The CitationAgent handles generating properly formatted citations 
     by querying CrossRef if we detect a DOI or 'title:'.
     """
+    # Identical lookups arriving together share one CrossRef request
+    _lookup_flight = SingleFlight('citation_lookup')
+
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.works_api = Works()
-        self.semantic_scholar_api = "https://api.semanticscholar.org/graph/v1"
-        self.arxiv_api = "http://export.arxiv.org/api/query"
+        self.semantic_scholar_api = Config.SEMANTIC_SCHOLAR_API_URL
+        self.arxiv_api = Config.ARXIV_API_URL
+        # Longest we wait for a shared upstream rate-limit slot before giving up on a lookup
+        self.rate_limit_wait = float(os.getenv('CITATION_RATE_LIMIT_WAIT', '2'))
 
     def process_query(self, query: str) -> Dict[str, Any]:
+        """Citation for the DOI or title in the query; identical queries in flight share one lookup."""
+        return self._lookup_flight.do(' '.join(query.lower().split()), self._lookup_citation, query)
+
+    def _lookup_citation(self, query: str) -> Dict[str, Any]:
         """
         1. Determine citation style from the query (APA, MLA, IEEE).
         2. Extract a DOI or a 'title: ...' from the query to look up in CrossRef.
@@ -40,11 +55,13 @@ class CitationAgent:
             metadata = None
             if doi_match:
                 found_doi = doi_match.group(1)
+                get_rate_limiter('crossref').acquire(timeout=self.rate_limit_wait)
                 result = self.works_api.doi(found_doi)
                 if result:
                     metadata = result
             elif title_match:
                 title_text = title_match.group(1).strip()
+                get_rate_limiter('crossref').acquire(timeout=self.rate_limit_wait)
                 search = self.works_api.query(title_text).sort("relevance").order("desc").limit(1)
                 results_list = list(search)
                 if results_list:
@@ -181,27 +198,30 @@ class CitationAgent:
         return f"{parts[-1]}, {' '.join(parts[:-1])}"
 
     def get_paper_details(self, paper_id: str) -> Optional[Dict[str, Any]]:
-        """Get detailed information about a paper from Semantic Scholar."""
+        """Get detailed information about a paper (DOI, arXiv id or Semantic Scholar id)."""
+        return self.get_papers_details([paper_id]).get(paper_id)
+
+    def get_papers_details(self, paper_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Details for many papers at once, through Semantic Scholar's and CrossRef's batch lookups."""
         try:
-            response = requests.get(f"{self.semantic_scholar_api}/paper/{paper_id}")
-            if response.status_code == 200:
-                return response.json()
-            return None
+            return get_metadata_hydrator().hydrate(paper_ids)
         except Exception as e:
             self.logger.error(f"Error getting paper details: {str(e)}")
-            return None
+            return {paper_id: None for paper_id in paper_ids}
 
     def search_papers(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Search for papers using Semantic Scholar API."""
         try:
-            response = requests.get(
-                f"{self.semantic_scholar_api}/paper/search",
-                params={
-                    'query': query,
-                    'limit': limit,
-                    'fields': 'title,authors,year,venue,abstract,url'
-                }
-            )
+            get_rate_limiter('semantic_scholar').acquire(timeout=self.rate_limit_wait)
+            with upstream_call('citation', 'semantic_scholar'):
+                response = http_get(
+                    f"{self.semantic_scholar_api}/paper/search",
+                    params={
+                        'query': query,
+                        'limit': limit,
+                        'fields': 'title,authors,year,venue,abstract,url'
+                    }
+                )
             if response.status_code == 200:
                 return response.json().get('data', [])
             return []
@@ -6,6 +6,7 @@ import boto3
 import os
 from pathlib import Path
 import json
+from utils.metrics import instrument_boto3_client
 
 class ContextAgent:
     """
@@ -16,6 +17,7 @@ class ContextAgent:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.s3_client = boto3.client('s3')
+        instrument_boto3_client(self.s3_client, 'context')
         self.s3_bucket = os.getenv('S3_BUCKET')
         self.context_dir = Path("data/context")
         self.context_dir.mkdir(parents=True, exist_ok=True)
@@ -2,20 +2,22 @@
 from typing import Dict, List, Any, Optional
 import logging
 import requests
+import httpx
 from datetime import datetime
 import json
 import re
 import os
-import tiktoken
 # Added imports for preprocessing and vectorization
-import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
-from sentence_transformers import SentenceTransformer
 import numpy as np
-nltk.download('punkt_tab', quiet=True)
-nltk.download('punkt', quiet=True)
-nltk.download('stopwords', quiet=True)
+from models.embedding_service import get_embedding_service, get_tokenizer
+from utils.startup import ensure_nltk_data
+from utils.metrics import upstream_call
+from utils.rate_limit import get_rate_limiter, RateLimited
+from utils.http import http_get, http_get_async
+from utils.single_flight import SingleFlight
+from utils.config import Config
 
 class FactCheckAgent:
     """
@@ -25,24 +27,34 @@ class FactCheckAgent:
      - Preprocessing queries for better search results
      - Providing text vectorization capabilities
     """
+    # Concurrent checks of the same claim share one NewsAPI request
+    _news_flight = SingleFlight('newsapi_search')
+
     def __init__(self):
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.tokenizer = get_tokenizer()
         self.MAX_TOKENS = 900 # Max tokens for truncation before vectorization etc.
         self.logger = logging.getLogger(__name__)
         # Removed Semantic Scholar API
-        self.arxiv_api = "http://export.arxiv.org/api/query"
-        self.news_api = "https://newsapi.org/v2/everything"
+        self.arxiv_api = Config.ARXIV_API_URL
+        self.news_api = Config.NEWS_API_URL
+        # Longest we wait for a shared upstream rate-limit slot before skipping that source
+        self.rate_limit_wait = float(os.getenv('FACTCHECK_RATE_LIMIT_WAIT', '2'))
 
         # --- New Initializations ---
-        # Preprocessing setup
-        self.stop_words = set(stopwords.words('english'))
+        # Preprocessing setup (NLTK data is only downloaded if it isn't installed yet)
+        ensure_nltk_data('tokenizers/punkt_tab', 'tokenizers/punkt', 'corpora/stopwords')
+        try:
+            self.stop_words = set(stopwords.words('english'))
+        except LookupError:
+            self.logger.warning("NLTK stopwords unavailable, continuing with the custom list only")
+            self.stop_words = set()
         # Add custom fluff words if needed
         self.stop_words.update(['tell', 'me', 'about', 'what', 'is', 'are', 'how', 'show', 'find', 'search', 'for', 'papers', 'articles', 'research', 'on'])
 
         # Vectorization model setup
         try:
-            # Using a relatively small but effective model
-            self.vectorizer_model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Shared, micro-batched all-MiniLM-L6-v2 instance (one per process)
+            self.vectorizer_model = get_embedding_service('all-MiniLM-L6-v2')
             self.logger.info("SentenceTransformer model loaded successfully.")
         except Exception as e:
             self.logger.error(f"Error loading SentenceTransformer model: {e}. Vectorization will be disabled.")
@@ -58,6 +70,17 @@ class FactCheckAgent:
             return self.tokenizer.decode(truncated_tokens) + "..."
         return text
 
+    async def truncate_to_token_limit_async(self, text):
+        """truncate_to_token_limit for callers on an event loop; a model server tokenizer is
+        awaited rather than called with a blocking round trip."""
+        if not isinstance(text, str) or not hasattr(self.tokenizer, 'encode_async'):
+            # The in-process tokenizer doesn't wait on anything
+            return self.truncate_to_token_limit(text)
+        tokens = await self.tokenizer.encode_async(text)
+        if len(tokens) > self.MAX_TOKENS:
+            return await self.tokenizer.decode_async(tokens[:self.MAX_TOKENS]) + "..."
+        return text
+
     def extract_text_from_claim(self, claim):
         """Extract text content from claim object or return claim if it's a string"""
         if isinstance(claim, dict):
@@ -152,33 +175,50 @@ class FactCheckAgent:
             
             # Search for news articles
             news = self._search_news_articles(claim)
-            
-            # Analyze claim against context if provided
-            context_analysis = self._analyze_against_context(claim, context) if context else None
-            
-            # Determine claim status
-            status = self._determine_claim_status(papers, news, context_analysis)
-            
-            # Return only status and evidence, excluding the claim itself
-            return {
-                # "claim": claim,  <-- Removed to prevent duplication
-                "status": status,
-                "evidence": {
-                    "papers": papers,
-                    "news": news,
-                    "context_analysis": context_analysis
-                },
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._claim_result(claim, context, papers, news)
         except Exception as e:
             self.logger.error(f"Error verifying claim: {str(e)}")
-            # Return error status without the claim text
-            return {
-                # "claim": claim, <-- Removed to prevent duplication
-                "status": "error",
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._claim_error(e)
+
+    async def verify_claim_async(self, claim: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """verify_claim with the NewsAPI request and rate-limit wait on the event loop."""
+        try:
+            papers = self._search_relevant_papers(claim)
+            news = await self._search_news_articles_async(claim)
+            return self._claim_result(claim, context, papers, news)
+        except Exception as e:
+            self.logger.error(f"Error verifying claim: {str(e)}")
+            return self._claim_error(e)
+
+    def _claim_result(self, claim: str, context: Optional[Dict[str, Any]], papers: List[Dict[str, Any]],
+                      news: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Analyze claim against context if provided
+        context_analysis = self._analyze_against_context(claim, context) if context else None
+        
+        # Determine claim status
+        status = self._determine_claim_status(papers, news, context_analysis)
+        
+        # Return only status and evidence, excluding the claim itself
+        return {
+            # "claim": claim,  <-- Removed to prevent duplication
+            "status": status,
+            "evidence": {
+                "papers": papers,
+                "news": news,
+                "context_analysis": context_analysis
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+
+    @staticmethod
+    def _claim_error(error: Exception) -> Dict[str, Any]:
+        # Return error status without the claim text
+        return {
+            # "claim": claim, <-- Removed to prevent duplication
+            "status": "error",
+            "error": str(error),
+            "timestamp": datetime.now().isoformat()
+        }
 
     def _preprocess_query(self, query: str) -> str:
         """Removes stop words and non-alphanumeric characters from a query."""
@@ -217,38 +257,26 @@ class FactCheckAgent:
             self.logger.error(f"Error vectorizing text: {e}")
             return None
 
-    def _search_relevant_papers(self, claim: str) -> List[Dict[str, Any]]:
-        """Search for relevant academic papers using a preprocessed query."""
-        processed_claim = self._preprocess_query(claim)
-        if not processed_claim:
-            self.logger.warning("Claim preprocessing resulted in an empty query. Skipping ArXiv search.")
-            return []
+    async def _vectorize_text_async(self, text: str) -> Optional[np.ndarray]:
+        """Awaitable variant of _vectorize_text for callers on an event loop."""
+        if not self.vectorizer_model:
+            self.logger.warning("Vectorizer model not loaded. Cannot vectorize text.")
+            return None
+        if not isinstance(text, str) or not text.strip():
+            return None
         try:
-            # Using ArXiv API directly now
-            response = requests.get(
-                self.arxiv_api,
-                params={
-                    'search_query': f'all:{processed_claim}', # Use preprocessed query
-                    'start': 0,
-                    'max_results': 5 # Limit results
-                }
-            )
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-
-            # Parse ArXiv XML response (requires additional parsing logic)
-            # For simplicity, placeholder - replace with proper XML parsing (e.g., using feedparser)
-            # papers = self._parse_arxiv_response(response.text)
-            # return [self._process_paper(paper) for paper in papers]
-            self.logger.warning("ArXiv XML parsing not fully implemented. Returning empty list for papers.")
-            # Placeholder: Returning empty list until XML parsing is added
-            return []
-
-        except requests.exceptions.RequestException as e:
-            self.logger.error(f"Error during ArXiv request: {e}")
-            return []
+            return await self.vectorizer_model.encode_async(await self.truncate_to_token_limit_async(text))
         except Exception as e:
-            self.logger.error(f"Error searching ArXiv papers: {e}")
-            return []
+            self.logger.error(f"Error vectorizing text: {e}")
+            return None
+
+    def _search_relevant_papers(self, claim: str) -> List[Dict[str, Any]]:
+        """Search for relevant academic papers using a preprocessed query."""
+        # The arXiv XML response isn't parsed yet (see _parse_arxiv_response), so nothing is
+        # requested: the call would only spend a slot of the shared 'arxiv' rate limit, which
+        # paper searches need, on a result that is thrown away.
+        self.logger.debug("ArXiv search for fact-checking is not implemented yet; returning no papers.")
+        return []
 
     def _search_news_articles(self, claim: str) -> List[Dict[str, Any]]:
         """Search for relevant news articles using a preprocessed query."""
@@ -256,27 +284,35 @@ class FactCheckAgent:
         if not processed_claim:
              self.logger.warning("Claim preprocessing resulted in an empty query. Skipping NewsAPI search.")
              return []
+        return self._news_flight.do(processed_claim, self._fetch_news_articles, processed_claim)
+
+    def _fetch_news_articles(self, processed_claim: str) -> List[Dict[str, Any]]:
         try:
             api_key = os.getenv('NEWS_API_KEY')
             if not api_key:
                 self.logger.warning("NEWS_API_KEY not set. Skipping news search.")
                 return []
 
-            response = requests.get(
-                self.news_api,
-                params={
-                    'q': processed_claim, # Use preprocessed query
-                    'apiKey': api_key,
-                    'language': 'en',
-                    'sortBy': 'relevancy',
-                    'pageSize': 5 # Limit results
-                }
-            )
-            response.raise_for_status()
+            get_rate_limiter('newsapi').acquire(timeout=self.rate_limit_wait)
+            with upstream_call('factcheck', 'newsapi'):
+                response = http_get(
+                    self.news_api,
+                    params={
+                        'q': processed_claim, # Use preprocessed query
+                        'apiKey': api_key,
+                        'language': 'en',
+                        'sortBy': 'relevancy',
+                        'pageSize': 5 # Limit results
+                    }
+                )
+                response.raise_for_status()
             if response.status_code == 200:
                 articles = response.json().get('articles', [])
                 return [self._process_news_article(article) for article in articles]
             return []
+        except RateLimited as e:
+            self.logger.warning(f"Skipping news search: {e}")
+            return []
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Error during NewsAPI request: {e}")
             return []
@@ -284,6 +320,45 @@ class FactCheckAgent:
             self.logger.error(f"Error searching news: {e}")
             return []
 
+    async def _search_news_articles_async(self, claim: str) -> List[Dict[str, Any]]:
+        processed_claim = self._preprocess_query(claim)
+        if not processed_claim:
+            self.logger.warning("Claim preprocessing resulted in an empty query. Skipping NewsAPI search.")
+            return []
+        return await self._news_flight.do_async(processed_claim, self._fetch_news_articles_async, processed_claim)
+
+    async def _fetch_news_articles_async(self, processed_claim: str) -> List[Dict[str, Any]]:
+        try:
+            api_key = os.getenv('NEWS_API_KEY')
+            if not api_key:
+                self.logger.warning("NEWS_API_KEY not set. Skipping news search.")
+                return []
+
+            await get_rate_limiter('newsapi').acquire_async(timeout=self.rate_limit_wait)
+            with upstream_call('factcheck', 'newsapi'):
+                response = await http_get_async(
+                    self.news_api,
+                    params={
+                        'q': processed_claim,
+                        'apiKey': api_key,
+                        'language': 'en',
+                        'sortBy': 'relevancy',
+                        'pageSize': 5
+                    }
+                )
+                response.raise_for_status()
+            articles = response.json().get('articles', [])
+            return [self._process_news_article(article) for article in articles]
+        except RateLimited as e:
+            self.logger.warning(f"Skipping news search: {e}")
+            return []
+        except httpx.HTTPError as e:
+            self.logger.error(f"Error during NewsAPI request: {e}")
+            return []
+        except Exception as e:
+            self.logger.error(f"Error searching news: {e}")
+            return []
+
     def _analyze_against_context(self, claim: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze claim against provided context."""
         try:
@@ -1,24 +1,95 @@
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, BinaryIO, List, Dict, Any, Optional, Tuple, Union
 import requests
 from datetime import datetime
 import logging
 import json
+import asyncio
+import functools
 import arxiv
-import time
 import psycopg2
 import os
+import threading
+import time
 from pathlib import Path
 from psycopg2 import OperationalError
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from backend.init_db import init_database
 import boto3
 from botocore.exceptions import ClientError
-import PyPDF2
 import io
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from models.summarization import generate_summary
+from models.reranker import SearchReranker
+from models.pdf_extraction import extract_pdf_text
+from utils.metrics import upstream_call, instrument_boto3_client, instrumented_cursor_factory, stage_timer, SEARCH_LOOKUPS
+from utils.config import Config
+from utils.single_flight import SingleFlight
+from agents.scholar_agent.utils import merge_paper_results, key_digests, encode_cursor, decode_cursor
+from backend.search_cache import SearchCache, get_search_cache
+from backend.paper_index import get_paper_index
+from backend.paper_metadata import get_metadata_hydrator
+from backend.ingestion_jobs import IngestionWorker, get_ingestion_queue, workers_in_process
+from backend.content_store import get_content_store
+from backend.db_pool import pooled_connection
+from backend import async_db
+from backend.async_s3 import AsyncS3
+from backend.s3_upload import LimitedReader, SizeLimitExceeded, UploadResult, upload_stream
+from utils.rate_limit import RateLimited, get_rate_limiter
+from utils.http import http_get, http_get_async, closing_async_client
+
+
+class RateLimitedArxivClient(arxiv.Client):
+    """arxiv.Client whose requests (pages and retries) draw from the shared 'arxiv' rate limit
+    instead of the client's own per-instance delay_seconds.
+
+    Inside `prepaid(deadline)` the thread's first request uses a token the caller already
+    took with `await limiter.acquire_async()` (so an abandoned search hands it back), and
+    later pages and retries only wait until the deadline; after it they are refused.
+    """
+    def __init__(self, *args, max_wait: Optional[float] = None, **kwargs):
+        kwargs['delay_seconds'] = 0
+        super().__init__(*args, **kwargs)
+        self.max_wait = max_wait
+        self.limiter = get_rate_limiter('arxiv')
+        self._requests = threading.local()
+
+    @contextmanager
+    def prepaid(self, deadline: Optional[float]):
+        self._requests.prepaid = True
+        self._requests.deadline = deadline
+        try:
+            yield self
+        finally:
+            self._requests.prepaid = False
+            self._requests.deadline = None
+
+    def _parse_feed(self, url, first_page=True, _try_index=0):
+        if getattr(self._requests, 'prepaid', False):
+            self._requests.prepaid = False
+        else:
+            deadline = getattr(self._requests, 'deadline', None)
+            timeout = self.max_wait if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                raise RateLimited("arxiv: search deadline passed, not sending further requests")
+            self.limiter.acquire(timeout=timeout)
+        return super()._parse_feed(url, first_page=first_page, _try_index=_try_index)
 
 class ScholarAgent:
+    # Threads for the blocking source searches. Kept apart from the loop's default
+    # executor so a search abandoned at its deadline never holds up loop shutdown.
+    _search_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SCHOLAR_SEARCH_THREADS', '16')), thread_name_prefix='scholar-search')
+    # Background refreshes of stale cached searches. A refresh waits on source searches in
+    # _search_executor, so it must not run there: enough of them would take every thread
+    # while their searches queue behind them.
+    _refresh_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SCHOLAR_REFRESH_THREADS', '2')), thread_name_prefix='scholar-refresh')
+    # Identical window searches running at the same time (e.g. a class asking the same question) share one upstream fetch
+    _window_flight = SingleFlight('scholar_search')
+    # One set of upload ingestion worker threads per process, however many agents are created
+    _ingestion_worker: Optional[IngestionWorker] = None
+    _ingestion_worker_lock = threading.Lock()
+
     def __init__(self, context_agent=None, base_url: str = "http://localhost:5000"):
         # Configure logging first
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -31,12 +102,8 @@ class ScholarAgent:
         }
         
         self.context_agent = context_agent
+        # Connected on first use by _ensure_db_connection
         self.db_conn = None
-        try:
-            self._ensure_db_connection()
-        except Exception as e:
-            self.logger.warning(f"Failed to connect to database, continuing without database support: {str(e)}")
-            self.db_conn = None
 
         # Create papers directory if it doesn't exist
         self.papers_dir = Path("data/papers")
@@ -46,12 +113,37 @@ class ScholarAgent:
         self.max_retries = 1
         self.retry_delay = 1  # Initial delay in seconds
         
-        # ArXiv API client
-        self.arxiv_client = arxiv.Client(
-            page_size=10,
-            delay_seconds=3.0,
-            num_retries=3
+        # Federated search: sources queried concurrently by search_papers, each with its own deadline (seconds)
+        self.search_sources = [s.strip() for s in os.getenv('SCHOLAR_SEARCH_SOURCES', 'arxiv,semantic_scholar').split(',') if s.strip()]
+        self.source_timeouts = {
+            'arxiv': float(os.getenv('SCHOLAR_ARXIV_TIMEOUT', '8')),
+            'semantic_scholar': float(os.getenv('SCHOLAR_SEMANTIC_SCHOLAR_TIMEOUT', '5')),
+        }
+
+        # ArXiv API client, paced by the rate limit shared with other workers. A request
+        # that could not start before the search deadline is refused rather than queued.
+        self.arxiv_client = RateLimitedArxivClient(
+            page_size=100,
+            num_retries=3,
+            max_wait=self.source_timeouts['arxiv']
         )
+        self.arxiv_client.query_url_format = Config.ARXIV_API_URL + "?{}"
+
+        # Shared Postgres cache of merged search results (None when SEARCH_CACHE_ENABLED=false)
+        self.search_cache = get_search_cache()
+        # Local full-text index over every paper we have seen; answers first when it has enough hits
+        self.paper_index = get_paper_index()
+        self.local_min_results = int(os.getenv('PAPER_INDEX_MIN_RESULTS', '5'))
+        # Results fetched per source at a time; pages are sliced from these cached windows
+        self.search_window = int(os.getenv('SCHOLAR_SEARCH_WINDOW', '30'))
+        # Windows handed to the cache writer but not yet stored, so the next page doesn't miss them
+        self._unwritten_windows: Dict[str, List[Dict]] = {}
+        # Optional embedding re-ranking of each merged window before it is cached and paged
+        self.reranker = SearchReranker() if os.getenv('SEARCH_RERANK', 'false').lower() == 'true' else None
+        # Largest PDF add_paper_from_url will store
+        self.max_download_bytes = int(os.getenv('PAPER_DOWNLOAD_MAX_MB', '100')) * 1024 * 1024
+        # Stored files by SHA-256: identical uploads share one S3 object, extracted text and summary
+        self.content_store = get_content_store()
         
         # Initialize S3 client
         try:
@@ -65,75 +157,412 @@ class ScholarAgent:
                 aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
                 region_name=os.getenv('AWS_REGION', 'us-east-1')
             )
-            
-            # Verify S3 bucket exists and is accessible
-            self.s3_client.head_bucket(Bucket=self.s3_bucket)
-            self.logger.info(f"Successfully connected to S3 bucket: {self.s3_bucket}")
+            instrument_boto3_client(self.s3_client, 'scholar')
+            # Same client behind awaitable calls, for the native async routes
+            self.s3 = AsyncS3(self.s3_client)
+            # Bucket access is verified on first use (see get_user_library_files) rather
+            # than here, so constructing the agent doesn't need the network
+            self.logger.info(f"S3 client initialized for bucket: {self.s3_bucket}")
             
         except Exception as e:
             self.logger.error(f"Error initializing S3 client: {str(e)}")
             raise
+
+        # Uploads are processed by background workers claiming jobs from ingestion_jobs
+        # (INGESTION_QUEUE_ENABLED=false processes them within the request instead).
+        # INGESTION_WORKERS=0 leaves the jobs to standalone workers (python -m backend.ingestion_jobs).
+        self.ingestion_queue = get_ingestion_queue() if os.getenv('INGESTION_QUEUE_ENABLED', 'true').lower() == 'true' else None
+        self.ingestion_worker = None
+        workers = workers_in_process()
+        if self.ingestion_queue is not None and workers > 0:
+            with ScholarAgent._ingestion_worker_lock:
+                if ScholarAgent._ingestion_worker is None:
+                    ScholarAgent._ingestion_worker = IngestionWorker(
+                        self.ingestion_queue, self._run_ingestion_job, threads=workers,
+                        poll_interval=float(os.getenv('INGESTION_POLL_INTERVAL', '2')),
+                        sweep_interval=float(os.getenv('INGESTION_SWEEP_INTERVAL', '60'))
+                    )
+                    ScholarAgent._ingestion_worker.start()
+            self.ingestion_worker = ScholarAgent._ingestion_worker
     
     
     async def search_papers(self, query: str, max_results: int = 10) -> List[Dict]:
-        """Search for papers using ArXiv API."""
+        """Search for papers; the first page of search_papers_page."""
+        page = await self.search_papers_page(query, max_results)
+        return page['papers']
+
+    async def search_papers_page(self, query: str, page_size: int = 10, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """One page of search results and the cursor for the next page (None when there are no more).
+
+        Pages come from the local index while it has enough matches. Otherwise the
+        configured sources are searched in windows of search_window results per
+        source; each merged window is kept in the shared search cache, so later
+        pages are sliced from it rather than searched again. Raises ValueError for
+        a cursor this method did not issue.
+        """
+        state = decode_cursor(cursor) if cursor else {'src': 'local', 'offset': 0}
+        thin_local: List[Dict] = []
+        if state['src'] == 'local':
+            offset = int(state.get('offset', 0))
+            local_page = await self._local_page(query, page_size, offset)
+            if local_page['next_cursor'] is not None:
+                return local_page
+            if self._thin_local(local_page, offset, page_size):
+                # Too few local matches for a first page: kept in case upstream has none
+                thin_local = local_page['papers']
+                state = {'src': 'upstream', 'window': 0, 'index': 0}
+            else:
+                # The index ran out mid-page: the rest of the page comes from upstream
+                rest = await self._upstream_page(query, page_size - len(local_page['papers']),
+                                                 {'src': 'upstream', 'window': 0, 'index': 0, 'skip': local_page['shown']})
+                return {'papers': local_page['papers'] + rest['papers'], 'next_cursor': rest['next_cursor']}
+
+        page = await self._upstream_page(query, page_size, state)
+        if not page['papers'] and thin_local:
+            return {'papers': thin_local, 'next_cursor': None}
+        return page
+
+    async def search_papers_stream(self, query: str, page_size: int = 10, cursor: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Progressive variant of search_papers_page.
+
+        Yields {'source': ..., 'papers': [...]} batches as soon as they are available
+        (for an uncached first page, as each source returns) and finishes with
+        {'next_cursor': ...}. Papers already yielded are never repeated, neither
+        later in the stream nor on the pages the cursor leads to.
+        """
+        if cursor is None:
+            local_page = await self._local_page(query, page_size, 0)
+            if local_page['next_cursor'] is not None:
+                yield {'source': 'local', 'papers': local_page['papers']}
+                yield {'next_cursor': local_page['next_cursor']}
+                return
+            if not self._thin_local(local_page, 0, page_size):
+                yield {'source': 'local', 'papers': local_page['papers']}
+                page = await self._upstream_page(query, page_size - len(local_page['papers']),
+                                                 {'src': 'upstream', 'window': 0, 'index': 0, 'skip': local_page['shown']})
+                yield {'source': 'upstream', 'papers': page['papers']}
+                yield {'next_cursor': page['next_cursor']}
+                return
+            cached = await self._cached_window(query, 0)
+            if cached is None:
+                # Closed explicitly, so its source searches stop as soon as this stream is closed
+                first_window = self._stream_first_window(query, page_size, fallback=local_page['papers'])
+                try:
+                    async for item in first_window:
+                        yield item
+                finally:
+                    await first_window.aclose()
+                return
+            page = await self._upstream_page(query, page_size, {'src': 'upstream', 'window': 0, 'index': 0}, windows={0: cached})
+            source = 'cache'
+        else:
+            page = await self.search_papers_page(query, page_size, cursor)
+            source = decode_cursor(cursor)['src']
+        yield {'source': source, 'papers': page['papers']}
+        yield {'next_cursor': page['next_cursor']}
+
+    async def _local_page(self, query: str, page_size: int, offset: int) -> Dict[str, Any]:
+        """A page from the local index, starting at row `offset`.
+
+        The index can hold one paper more than once (e.g. under its arXiv URL and its
+        Semantic Scholar id), so rows are de-duplicated by paper_keys, against each
+        other and against the earlier pages, before they count towards the page.
+        Only a full page carries a cursor: the next local page, or upstream once the
+        index has run out. 'shown' is the number of index rows used up to and
+        including this page, which upstream pages skip.
+        """
+        if self.paper_index is None:
+            return {'papers': [], 'next_cursor': None, 'shown': 0}
+        # Extra rows so duplicates don't leave the page short
+        rows = await self._local_rows(query, page_size * 2, offset)
+        earlier = key_digests(await self._local_rows(query, offset, 0)) if offset else set()
+        fresh: List[Dict] = []
+        on_page: set = set()
+        used = distinct = 0
+        for row in rows:
+            keys = key_digests([row])
+            if not keys & earlier:
+                if not keys & on_page:
+                    if distinct == page_size:
+                        break
+                    distinct += 1
+                # A duplicate of a paper on this page is merged into it
+                on_page |= keys
+                fresh.append(row)
+            used += 1
+        papers = merge_paper_results({'local': fresh}, limit=page_size)
+        shown = offset + used
+        if len(papers) < page_size:
+            return {'papers': papers, 'next_cursor': None, 'shown': shown}
+
+        SEARCH_LOOKUPS.labels('local').inc()
+        if used < len(rows) or len(rows) == page_size * 2:
+            next_state = {'src': 'local', 'offset': shown}
+        else:
+            next_state = {'src': 'upstream', 'window': 0, 'index': 0, 'skip': shown}
+        return {'papers': papers, 'next_cursor': encode_cursor(next_state), 'shown': shown}
+
+    def _thin_local(self, local_page: Dict[str, Any], offset: int, page_size: int) -> bool:
+        """Whether a short local page has too few matches to be shown ahead of the upstream results."""
+        return offset == 0 and len(local_page['papers']) < min(self.local_min_results, page_size)
+
+    async def _local_rows(self, query: str, limit: int, offset: int) -> List[Dict]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._search_executor, self.paper_index.search, query, limit, offset)
+
+    async def _upstream_page(self, query: str, page_size: int, state: Dict[str, Any], windows: Optional[Dict[int, List[Dict]]] = None) -> Dict[str, Any]:
+        """Slice a page out of the merged upstream windows, starting at the cursor position."""
+        window, index = int(state.get('window', 0)), int(state.get('index', 0))
+        seen = set(state.get('seen', []))
+        exclude = set(seen)
+        if state.get('skip') and self.paper_index is not None:
+            # Continuing after local pages: don't repeat the papers the index already served
+            exclude |= key_digests(await self._local_rows(query, int(state['skip']), 0))
+
+        windows = windows or {}
+        papers: List[Dict] = []
+        while len(papers) < page_size:
+            if window not in windows:
+                windows[window] = await self._search_window(query, window)
+            results = windows[window]
+            while index < len(results) and len(papers) < page_size:
+                paper = results[index]
+                index += 1
+                if not exclude or not key_digests([paper]) & exclude:
+                    papers.append(paper)
+            if index < len(results):
+                break
+            if len(results) < self.search_window:
+                # Every source ran out inside this window
+                return {'papers': papers, 'next_cursor': None}
+            window, index = window + 1, 0
+
+        next_state = {'src': 'upstream', 'window': window, 'index': index}
+        if seen:
+            next_state['seen'] = sorted(seen)
+        if state.get('skip'):
+            next_state['skip'] = state['skip']
+        return {'papers': papers, 'next_cursor': encode_cursor(next_state)}
+
+    async def _stream_first_window(self, query: str, page_size: int, fallback: List[Dict]) -> AsyncIterator[Dict[str, Any]]:
+        """Search the sources for window 0, yielding each source's new hits as it returns,
+        then cache and index the merged window."""
+        sources = [source for source in self.search_sources if source in self._source_searches()]
+        tasks = {asyncio.ensure_future(self._search_source(source, query, self.search_window, 0)): source for source in sources}
+        results_by_source: Dict[str, List[Dict]] = {}
+        shown: List[Dict] = []
+        seen: set = set()
         try:
-            # Search ArXiv directly
-            self.logger.info(f"Searching ArXiv for: {query}")
-            arxiv_papers = self._search_arxiv(query, max_results)
-            
-            if arxiv_papers:
-                return arxiv_papers[:max_results]
-            
-            # If no results from ArXiv, return empty list
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = tasks[task]
+                    results_by_source[source] = task.result()
+                    batch = []
+                    for paper in results_by_source[source]:
+                        if len(shown) + len(batch) >= page_size:
+                            break
+                        if not key_digests([paper]) & seen:
+                            batch.append({**paper, 'sources': [source]})
+                            seen |= key_digests([paper])
+                    if batch:
+                        shown.extend(batch)
+                        yield {'source': source, 'papers': batch}
+        finally:
+            # The consumer may stop early; don't leave source searches running (or unawaited) behind it
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        merged = await self._merge_window(query, {source: results_by_source[source] for source in sources if results_by_source.get(source)})
+        if not merged:
             self.logger.warning(f"No results found for query: {query}")
-            return []
+            if fallback:
+                yield {'source': 'local', 'papers': fallback}
+            yield {'next_cursor': None}
+            return
+        SEARCH_LOOKUPS.labels('miss').inc()
+        self._store_window(query, 0, merged)
+        more = len(merged) > len(shown) or len(merged) >= self.search_window
+        next_state = {'src': 'upstream', 'window': 0, 'index': 0, 'seen': sorted(key_digests(shown))}
+        yield {'next_cursor': encode_cursor(next_state) if more else None}
+
+    def _window_key(self, query: str, window: int) -> Tuple[str, str]:
+        source = ','.join(sorted(self.search_sources))
+        return self.search_cache.make_key(query, source, self.search_window, offset=window * self.search_window), source
+
+    async def _cached_window(self, query: str, window: int) -> Optional[List[Dict]]:
+        """A window from the search cache, or None on a miss. Stale windows are refreshed in the background."""
+        if self.search_cache is None:
+            return None
+        loop = asyncio.get_running_loop()
+        key, source = self._window_key(query, window)
+        unwritten = self._unwritten_windows.get(key)
+        if unwritten is not None:
+            SEARCH_LOOKUPS.labels('hit').inc()
+            return unwritten
+        cached = await loop.run_in_executor(self._search_executor, self.search_cache.get, key)
+        if cached is None:
+            return None
+        papers, stale = cached
+        SEARCH_LOOKUPS.labels('stale' if stale else 'hit').inc()
+        if stale:
+            self._refresh_executor.submit(self._refresh_search_cache, key, query, source, window)
+        return papers
+
+    async def _search_window(self, query: str, window: int) -> List[Dict]:
+        """Merged results of every source for one window, from the cache when possible."""
+        cached = await self._cached_window(query, window)
+        if cached is not None:
+            return cached
+        SEARCH_LOOKUPS.labels('miss').inc()
+        key = (','.join(sorted(self.search_sources)), self.search_window, window, SearchCache.normalize(query))
+        return await self._window_flight.do_async(key, self._fetch_window, query, window)
+
+    async def _fetch_window(self, query: str, window: int) -> List[Dict]:
+        papers = await self._search_uncached(query, self.search_window, offset=window * self.search_window)
+        if papers:
+            self._store_window(query, window, papers)
+        return papers
+
+    def _store_window(self, query: str, window: int, papers: List[Dict]) -> None:
+        """Cache and index a merged window without holding up the caller."""
+        if self.paper_index is not None:
+            self.paper_index.add_papers(papers)
+        if self.search_cache is not None:
+            key, source = self._window_key(query, window)
+            self._unwritten_windows[key] = papers
+            self._search_executor.submit(self._write_window, key, query, source, papers)
+
+    def _write_window(self, key: str, query: str, source: str, papers: List[Dict]) -> None:
+        try:
+            self.search_cache.set(key, query, source, self.search_window, papers)
+        finally:
+            self._unwritten_windows.pop(key, None)
+
+    def _refresh_search_cache(self, key: str, query: str, source: str, window: int) -> None:
+        """Re-run a stale search and store it, unless another worker has already claimed the refresh."""
+        try:
+            if not self.search_cache.claim_refresh(key):
+                return
+            papers = asyncio.run(closing_async_client(
+                self._search_uncached(query, self.search_window, offset=window * self.search_window)
+            ))
+            if papers:
+                if self.paper_index is not None:
+                    self.paper_index.add_papers(papers)
+                self.search_cache.set(key, query, source, self.search_window, papers)
+        except Exception as e:
+            self.logger.error(f"Error refreshing cached search for '{query}': {str(e)}")
+
+    async def _search_uncached(self, query: str, max_results: int = 10, offset: int = 0) -> List[Dict]:
+        """Search all configured sources concurrently and merge the results.
+
+        Each source is asked for max_results results starting at offset, under its
+        own deadline from source_timeouts; a source that fails or misses its
+        deadline is left out and whatever the others returned is merged,
+        de-duplicated by DOI, arXiv id and normalized title.
+        """
+        try:
+            self.logger.info(f"Searching {', '.join(self.search_sources)} for: {query}")
+            sources = [source for source in self.search_sources if source in self._source_searches()]
+            results = await asyncio.gather(*(self._search_source(source, query, max_results, offset) for source in sources))
+            results_by_source = {source: papers for source, papers in zip(sources, results) if papers}
+
+            papers = await self._merge_window(query, results_by_source)
+            if not papers:
+                self.logger.warning(f"No results found for query: {query}")
+            return papers
             
         except Exception as e:
             self.logger.error(f"Error searching papers: {str(e)}")
             return []
 
+    async def _merge_window(self, query: str, results_by_source: Dict[str, List[Dict]]) -> List[Dict]:
+        """Merge the sources' results and, if enabled, re-rank them by embedding similarity to the query."""
+        papers = merge_paper_results(results_by_source)
+        if self.reranker is None or len(papers) < 2:
+            return papers
+        try:
+            with stage_timer('rerank'):
+                return await self.reranker.rerank(query, papers)
+        except Exception as e:
+            self.logger.error(f"Error re-ranking search results, keeping source order: {str(e)}")
+            return papers
 
-    def _make_request_with_backoff(self, url, params=None):
-        """Helper method to make API requests with exponential backoff"""
-        retries = 0
-        while retries <= self.max_retries:
-            try:
-                response = requests.get(url, headers=self.headers, params=params)
-                
-                # If successful, return the response
-                if response.status_code == 200:
-                    return response
-                
-                # If rate limited, try ArXiv instead
-                if response.status_code == 429:
-                    self.logger.warning("Rate limited by Semantic Scholar. Falling back to ArXiv API.")
-                    return None
-                
-                # For other errors, raise the exception
-                response.raise_for_status()
-                
-            except requests.exceptions.RequestException as e:
-                if retries == self.max_retries:
-                    raise e
-                retries += 1
-                wait_time = self.retry_delay * (2 ** retries)
-                self.logger.warning(f"Request failed. Retrying in {wait_time} seconds. Error: {str(e)}")
-                time.sleep(wait_time)
-        
-        raise requests.exceptions.RequestException(f"Max retries ({self.max_retries}) exceeded")
+    def _source_searches(self) -> Dict[str, Any]:
+        return {
+            'arxiv': self._search_arxiv_async,
+            'semantic_scholar': self._search_semantic_scholar_papers,
+        }
 
-    def _search_arxiv(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
-        """Search papers using ArXiv API"""
+    async def _search_source(self, source: str, query: str, max_results: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """Run one source's search under its deadline; returns [] on timeout or error."""
+        timeout = self.source_timeouts.get(source)
+        try:
+            return await asyncio.wait_for(self._source_searches()[source](query, max_results, offset), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Search source '{source}' exceeded its {timeout}s deadline, continuing without it")
+        except Exception as e:
+            self.logger.error(f"Search source '{source}' failed: {str(e)}")
+        return []
+
+    async def _search_arxiv_async(self, query: str, max_results: int, offset: int = 0) -> List[Dict[str, Any]]:
+        # The first request's token is taken here, on the loop, so a search abandoned at its
+        # deadline gives it back instead of a thread waiting for it and then using it anyway
+        timeout = self.source_timeouts.get('arxiv')
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            await self.arxiv_client.limiter.acquire_async(timeout=timeout)
+        except RateLimited as e:
+            self.logger.warning(f"ArXiv search skipped: {str(e)}")
+            return []
+        # The arxiv client is blocking, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._search_executor, self._search_arxiv, query, max_results, offset, deadline)
+
+    async def _search_semantic_scholar_papers(self, query: str, max_results: int, offset: int = 0) -> List[Dict[str, Any]]:
+        result = await self._search_semantic_scholar(query, max_results, offset)
+        return result.get('papers', []) if result.get('status') == 'success' else []
+
+
+    async def _make_request_with_backoff(self, url, params=None, upstream: str = 'semantic_scholar'):
+        """Make an API request under the upstream's shared rate limit. Connection errors and
+        5xx responses are retried with backoff by the shared HTTP client (utils.http)."""
+        limiter = get_rate_limiter(upstream)
+        await limiter.acquire_async(timeout=self.source_timeouts.get(upstream))
+        with upstream_call('scholar', 'http'):
+            response = await http_get_async(url, headers=self.headers, params=params)
+
+        # If successful, return the response
+        if response.status_code == 200:
+            return response
+
+        # If rate limited, back every worker off and let the caller fall back to other sources
+        if response.status_code == 429:
+            self.logger.warning("Rate limited by Semantic Scholar. Falling back to ArXiv API.")
+            retry_after = response.headers.get('Retry-After', '')
+            limiter.penalize(float(retry_after) if retry_after.isdigit() else self.retry_delay * 5)
+            return None
+
+        # For other errors, raise the exception
+        response.raise_for_status()
+
+    def _search_arxiv(self, query: str, limit: int = 10, offset: int = 0, deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Search papers using ArXiv API. Called with the first request's token already taken
+        (see _search_arxiv_async); further requests wait for theirs until `deadline`."""
         try:
             search = arxiv.Search(
                 query=query,
-                max_results=limit,
+                max_results=offset + limit,
                 sort_by=arxiv.SortCriterion.Relevance
             )
             
             papers = []
-            for result in self.arxiv_client.results(search):
+            with upstream_call('scholar', 'arxiv'), self.arxiv_client.prepaid(deadline):
+                results = list(self.arxiv_client.results(search, offset=offset))
+            for result in results:
                 paper = {
                     "id": result.entry_id,
                     "title": result.title,
@@ -143,6 +572,8 @@ class ScholarAgent:
                     "venue": "arXiv",
                     "citations": None,  # ArXiv doesn't provide citation counts
                     "url": result.pdf_url,
+                    "doi": result.doi,
+                    "arxiv_id": result.get_short_id(),
                     "timestamp": datetime.now().isoformat()
                 }
                 papers.append(paper)
@@ -157,19 +588,20 @@ class ScholarAgent:
         """Search papers using Semantic Scholar API"""
         try:
             # Use Semantic Scholar API directly
-            url = "https://api.semanticscholar.org/graph/v1/paper/search"
+            url = f"{Config.SEMANTIC_SCHOLAR_API_URL}/paper/search"
             params = {
                 "query": query,
                 "limit": limit,
                 "offset": offset,
-                "fields": "paperId,title,abstract,authors,year,venue,citationCount,url,updated"
+                "fields": "paperId,externalIds,title,abstract,authors,year,venue,citationCount,url"
             }
             
-            response = self._make_request_with_backoff(url, params=params)
+            response = await self._make_request_with_backoff(url, params=params)
             if response:
                 data = response.json()
                 papers = []
                 for result in data.get("data", []):
+                    external_ids = result.get("externalIds") or {}
                     paper = {
                         "id": result.get("paperId", ""),
                         "title": result.get("title", ""),
@@ -179,7 +611,9 @@ class ScholarAgent:
                         "venue": result.get("venue", ""),
                         "citations": result.get("citationCount", 0),
                         "url": result.get("url", ""),
-                        "timestamp": result.get("updated", "").split("T")[0] if result.get("updated") else ""
+                        "doi": external_ids.get("DOI"),
+                        "arxiv_id": external_ids.get("ArXiv"),
+                        "timestamp": datetime.now().isoformat()
                     }
                     papers.append(paper)
                 
@@ -200,23 +634,15 @@ class ScholarAgent:
                 'message': str(e)
             }
 
+    async def hydrate_papers(self, paper_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Metadata for many papers (DOIs, arXiv ids or S2 ids) in a few batch requests; None for unknown ids."""
+        return await get_metadata_hydrator().hydrate_async(paper_ids)
+
     async def _fetch_semantic_scholar_paper(self, paper_id: str) -> Dict[str, Any]:
         """Fetch paper details from Semantic Scholar API"""
         try:
-            response = self._make_request_with_backoff(f"{self.base_url}/paper/{paper_id}")
-            if response:
-                data = response.json()
-                paper = {
-                    "id": data["paperId"],
-                    "title": data["title"],
-                    "abstract": data["abstract"],
-                    "authors": [author["name"] for author in data["authors"]],
-                    "year": data["year"],
-                    "venue": data["venue"],
-                    "citations": data["citationCount"],
-                    "url": data["url"],
-                    "timestamp": data["updated"].split("T")[0]
-                }
+            paper = (await self.hydrate_papers([paper_id])).get(paper_id)
+            if paper:
                 return {
                     'status': 'success',
                     'paper': paper
@@ -234,10 +660,22 @@ class ScholarAgent:
             }
 
     
-    async def upload_paper(self, user_id: str, file_data: bytes, file_name: str, file_type: str) -> Dict:
-        """Upload a paper to S3, generate summary, and save metadata to DB."""
-        extracted_text = None
-        summary = None
+    async def upload_paper(self, user_id: str, file_data: Union[bytes, BinaryIO], file_name: str, file_type: str) -> Dict:
+        """Upload a paper to S3 and queue its text extraction, summary and DB entry as a background job.
+
+        file_data may be bytes or a binary stream; a stream is sent to S3 in multipart
+        chunks as it is read (backend/s3_upload.py), so the file is never held in memory
+        whole. The type is sniffed from the content, overriding file_type for known formats.
+
+        Returns status 'queued' with a job_id for get_ingestion_job. If the job can't be
+        queued (queue disabled or database unavailable) the file is processed within the
+        request instead and status is 'success'. A file whose content is already stored
+        (same SHA-256, uploaded by anyone) reuses that S3 object and its text and summary,
+        so it is added to the library straight away with 'deduplicated' set; while the
+        first copy is still being processed, the entry is added without a summary and
+        gets the first copy's once it is ready, instead of processing the file again.
+        Stored text without a summary is summarized by a queued job like a new file.
+        """
         s3_key = None # Initialize s3_key
         file_id = str(uuid.uuid4()) # Generate file_id early
 
@@ -246,7 +684,7 @@ class ScholarAgent:
 
             # Validate inputs (as before)
             if not user_id: raise ValueError("User ID is required")
-            if not file_data: raise ValueError("File data is required")
+            if file_data is None: raise ValueError("File data is required")
             if not file_name: raise ValueError("File name is required")
             if not file_type: raise ValueError("File type is required")
 
@@ -257,97 +695,98 @@ class ScholarAgent:
             self.logger.info(f"Created S3 key: {s3_key}")
 
             # Upload to S3
+            loop = asyncio.get_running_loop()
+            stream = io.BytesIO(file_data) if isinstance(file_data, (bytes, bytearray)) else file_data
             try:
                 self.logger.info("Attempting S3 upload")
-                self.s3_client.put_object(
-                    Bucket=self.s3_bucket,
-                    Key=s3_key,
-                    Body=file_data,
-                    ContentType=file_type,
-                    Metadata={
+                uploaded = await loop.run_in_executor(None, functools.partial(
+                    upload_stream, self.s3_client, self.s3_bucket, s3_key, stream,
+                    content_type=file_type,
+                    metadata={
                         'user_id': user_id,
                         'file_name': file_name,
                         'file_type': file_type,
                         'created_at': datetime.now().isoformat()
                     }
-                )
-                self.logger.info("S3 upload successful")
+                ))
+                file_type = uploaded.content_type
+                self.logger.info(f"S3 upload successful ({uploaded.size} bytes, {file_type})")
+            except ValueError:
+                raise
             except Exception as e:
                 self.logger.error(f"S3 upload error: {str(e)}", exc_info=True)
                 # If S3 fails, we don't proceed to DB/summary
                 raise ValueError(f"Failed to upload file to S3: {str(e)}")
 
-            # Extract text based on file type
-            self.logger.info(f"Attempting text extraction for file type: {file_type}")
-            if file_type == 'application/pdf':
-                extracted_text = self._extract_text_from_pdf(file_data)
-                self.logger.info(f"Extracted ~{len(extracted_text)} chars from PDF")
-            elif file_type == 'text/plain':
-                try:
-                    extracted_text = file_data.decode('utf-8')
-                    self.logger.info(f"Decoded ~{len(extracted_text)} chars from TXT")
-                except UnicodeDecodeError:
-                    self.logger.warning(f"Could not decode file {file_name} as UTF-8. Trying latin-1.")
-                    try:
-                        extracted_text = file_data.decode('latin-1')
-                        self.logger.info(f"Decoded ~{len(extracted_text)} chars from TXT with latin-1")
-                    except Exception as decode_err:
-                         self.logger.error(f"Failed to decode TXT file {file_name} with any encoding: {decode_err}")
-                         extracted_text = None # Ensure it's None if all decoding fails
-            else:
-                self.logger.warning(f"Skipping text extraction/summarization for unsupported file type: {file_type}")
+            stored = await loop.run_in_executor(None, self._find_stored_content, uploaded)
+            if stored is not None:
+                s3_key = stored['s3_key']
+            url = f"https://{self.s3_bucket}.s3.amazonaws.com/{s3_key}"
 
-            # Generate summary if text was extracted
-            if extracted_text:
-                try:
-                    # Assuming generate_summary takes text, a prompt (?), and discipline (?)
-                    # We need to define appropriate defaults or pass them in. Using placeholders for now.
-                    # TODO: Determine appropriate prompt and discipline for summarization
-                    prompt_placeholder = "General Summary"
-                    discipline_placeholder = "General"
-                    self.logger.info(f"Generating summary for file {file_id}...")
-                    summary_result = generate_summary(extracted_text, prompt_placeholder, discipline_placeholder)
-                    # Assuming generate_summary returns a dict with a 'summary' key
-                    summary = summary_result.get('summary', None)
-                    if summary:
-                         self.logger.info(f"Generated summary for file {file_id} (length: {len(summary)})")
-                    else:
-                         self.logger.warning(f"generate_summary did not return a 'summary' key for file {file_id}")
-
-                except Exception as summary_err:
-                    self.logger.error(f"Error generating summary for file {file_id}: {summary_err}", exc_info=True)
-                    summary = None # Ensure summary is None if generation fails
-            else:
-                 self.logger.info(f"No text extracted for file {file_id}, skipping summary generation.")
+            processed = stored is not None and stored['extracted_text'] is not None
+            if processed and (stored['summary'] or not stored['extracted_text']):
+                # Already processed: just add the library entry
+                result = await loop.run_in_executor(
+                    None, self._ingest_from_s3, user_id, file_id, file_name, file_type, s3_key, None, uploaded.sha256
+                )
+                if self.context_agent:
+                    self.context_agent.add_uploaded_file(user_id, file_name)
+                return {
+                    'status': 'success',
+                    'file_id': file_id,
+                    'size': uploaded.size,
+                    'sha256': uploaded.sha256,
+                    'deduplicated': True,
+                    'message': f"File uploaded successfully. Summary {'reused' if result['summary'] else 'not available'}.",
+                    'url': url
+                }
+
+            # Text without a summary (summarizing failed before) skips the claim and is queued like a new file
+            if not processed and not await loop.run_in_executor(None, self.content_store.claim_processing, uploaded.sha256):
+                # Another upload of the same content is being processed; its summary fills in this entry
+                await loop.run_in_executor(
+                    None, self._save_library_entry, user_id, file_id, file_name, file_type, s3_key, None, uploaded.sha256
+                )
+                if self.context_agent:
+                    self.context_agent.add_uploaded_file(user_id, file_name)
+                return {
+                    'status': 'success',
+                    'file_id': file_id,
+                    'size': uploaded.size,
+                    'sha256': uploaded.sha256,
+                    'deduplicated': True,
+                    'message': "File uploaded successfully. Its summary will be added when processing of the same file finishes.",
+                    'url': url
+                }
+
+            job_id = await self._enqueue_ingestion(user_id, file_id, file_name, file_type, s3_key, uploaded.sha256)
+            if job_id is not None:
+                if self.context_agent:
+                    self.context_agent.add_uploaded_file(user_id, file_name)
+                return {
+                    'status': 'queued',
+                    'job_id': job_id,
+                    'file_id': file_id,
+                    'size': uploaded.size,
+                    'sha256': uploaded.sha256,
+                    'deduplicated': stored is not None,
+                    'message': "File uploaded successfully. Text extraction and summary are running in the background.",
+                    'url': url
+                }
 
-            # Save metadata (including summary, if generated) to DB
+            # No job queue: process the file within the request
             try:
-                self.logger.info(f"Saving file metadata to DB for file {file_id}")
-                self._ensure_db_connection()
-                with self.db_conn.cursor() as cur:
-                    sql = """
-                        INSERT INTO user_files (id, user_id, file_name, file_type, s3_key, summary, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    """
-                    params = (
-                        file_id,
-                        user_id,
-                        file_name,
-                        file_type,
-                        s3_key,
-                        summary, # Use the generated summary (can be None)
-                        datetime.now() # Use current timestamp for DB
-                    )
-                    cur.execute(sql, params)
-                self.db_conn.commit()
-                self.logger.info(f"Successfully saved metadata for file {file_id} to DB")
+                result = await loop.run_in_executor(
+                    None, self._ingest_from_s3, user_id, file_id, file_name, file_type, s3_key, None, uploaded.sha256
+                )
+                summary = result['summary']
             except Exception as db_err:
+                # The file is in S3; report success even though its library entry could not be saved
                 self.logger.error(f"Database error saving metadata for file {file_id}: {db_err}", exc_info=True)
-                # Log DB error, but potentially still return success for upload?
-                # Or should this be a critical failure? Deciding to return success for now.
-                # Consider if a rollback mechanism for S3 is needed if DB fails.
+                summary = None
+                if not processed:
+                    await loop.run_in_executor(None, self.content_store.release_processing, uploaded.sha256)
 
-            # After successful upload (around line 344):
             if self.context_agent:
                 self.context_agent.add_uploaded_file(user_id, file_name)
                 self.logger.info(f"Logged upload activity for {file_name}")
@@ -356,8 +795,11 @@ class ScholarAgent:
             return {
                 'status': 'success',
                 'file_id': file_id,
+                'size': uploaded.size,
+                'sha256': uploaded.sha256,
+                'deduplicated': stored is not None,
                 'message': f"File uploaded successfully. Summary generation {'succeeded' if summary else 'skipped or failed'}.",
-                'url': f"https://{self.s3_bucket}.s3.amazonaws.com/{s3_key}" # Use the defined s3_key
+                'url': url
             }
 
         except ValueError as ve:
@@ -367,15 +809,188 @@ class ScholarAgent:
             self.logger.error(f"Unexpected error in upload_paper: {str(e)}", exc_info=True)
             return {'status': 'error', 'message': f"An unexpected error occurred: {str(e)}"}
 
+    async def _enqueue_ingestion(self, user_id: str, file_id: str, file_name: str, file_type: str, s3_key: str,
+                                 content_sha256: str) -> Optional[str]:
+        """Queue the extraction, summary and library entry of a stored file; the job id, or None if
+        there is no queue (disabled, or the database is unavailable)."""
+        if self.ingestion_queue is None:
+            return None
+        job_id = str(uuid.uuid4())
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(
+            None, self.ingestion_queue.enqueue, job_id, user_id, file_id, file_name, file_type, s3_key, content_sha256
+        ):
+            return None
+        if self.ingestion_worker is not None:
+            self.ingestion_worker.wake()
+        return job_id
+
+    def get_ingestion_job(self, user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status and per-stage progress of one of the user's upload jobs, or None if there is no such job."""
+        if self.ingestion_queue is None:
+            return None
+        return self._job_status(self.ingestion_queue.get(job_id, user_id))
+
+    async def get_ingestion_job_async(self, user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """get_ingestion_job on the async Postgres pool."""
+        if self.ingestion_queue is None:
+            return None
+        return self._job_status(await self.ingestion_queue.get_async(job_id, user_id))
+
+    @staticmethod
+    def _job_status(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if job is None:
+            return None
+        for field in ('created_at', 'updated_at', 'finished_at'):
+            if job[field] is not None:
+                job[field] = job[field].isoformat()
+        return job
+
+    def _run_ingestion_job(self, job: Dict[str, Any], report) -> Dict[str, Any]:
+        """IngestionWorker handler."""
+        return self._ingest_from_s3(job['user_id'], job['file_id'], job['file_name'], job['file_type'], job['s3_key'],
+                                    report, job['content_sha256'])
+
+    def _ingest_from_s3(self, user_id: str, file_id: str, file_name: str, file_type: str, s3_key: str, report=None,
+                        content_sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Fetch an uploaded file back from S3 and ingest it; content already processed isn't fetched."""
+        stored = self.content_store.get(content_sha256) if content_sha256 else None
+        if stored is not None and stored['extracted_text'] is not None:
+            file_data = None
+        else:
+            obj = self.s3_client.get_object(Bucket=self.s3_bucket, Key=s3_key)
+            file_data = obj['Body'].read()
+        return self._ingest_file(user_id, file_id, file_name, file_type, s3_key, file_data, report, content_sha256, stored)
+
+    def _ingest_file(self, user_id: str, file_id: str, file_name: str, file_type: str, s3_key: str,
+                     file_data: Optional[bytes], report=None, content_sha256: Optional[str] = None,
+                     stored: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Extract text from an uploaded file, summarize it and save its user_files row.
+
+        `report(stage, status, **detail)` is told about each stage. A failed summary is
+        recorded and skipped; a failed DB write raises. Text and summary already in
+        `stored` (the content_blobs row for content_sha256) are reused, and new ones are
+        saved there for later copies of the same file.
+        """
+        report = report or (lambda stage, status, **detail: None)
+
+        # Extract text based on file type
+        if stored is not None and stored['extracted_text'] is not None:
+            extracted_text = stored['extracted_text']
+            report('extract', 'done' if extracted_text else 'skipped', reused=True, chars=len(extracted_text))
+        else:
+            report('extract', 'running')
+            started = time.perf_counter()
+            extracted_text = self._extract_text(file_data, file_name, file_type)
+            report('extract', 'done' if extracted_text else 'skipped',
+                   seconds=round(time.perf_counter() - started, 3), chars=len(extracted_text or ''))
+
+        # Generate summary if text was extracted
+        summary = None
+        if stored is not None and stored['summary']:
+            summary = stored['summary']
+            report('summarize', 'done', reused=True)
+        elif extracted_text:
+            report('summarize', 'running')
+            started = time.perf_counter()
+            try:
+                # Assuming generate_summary takes text, a prompt (?), and discipline (?)
+                # We need to define appropriate defaults or pass them in. Using placeholders for now.
+                # TODO: Determine appropriate prompt and discipline for summarization
+                prompt_placeholder = "General Summary"
+                discipline_placeholder = "General"
+                self.logger.info(f"Generating summary for file {file_id}...")
+                summary_result = generate_summary(extracted_text, prompt_placeholder, discipline_placeholder)
+                # Assuming generate_summary returns a dict with a 'summary' key
+                summary = summary_result.get('summary', None)
+                if summary:
+                     self.logger.info(f"Generated summary for file {file_id} (length: {len(summary)})")
+                else:
+                     self.logger.warning(f"generate_summary did not return a 'summary' key for file {file_id}")
+                report('summarize', 'done' if summary else 'skipped', seconds=round(time.perf_counter() - started, 3))
+
+            except Exception as summary_err:
+                self.logger.error(f"Error generating summary for file {file_id}: {summary_err}", exc_info=True)
+                summary = None # Ensure summary is None if generation fails
+                report('summarize', 'failed', error=str(summary_err))
+        else:
+             self.logger.info(f"No text extracted for file {file_id}, skipping summary generation.")
+             report('summarize', 'skipped')
+
+        if content_sha256 and (stored is None or stored['extracted_text'] is None or summary != stored['summary']):
+            # '' marks content with no extractable text, so copies don't try again
+            self.content_store.save_results(content_sha256, extracted_text or '', summary)
+
+        # Save metadata (including summary, if generated) to DB
+        report('index', 'running')
+        self._save_library_entry(user_id, file_id, file_name, file_type, s3_key, summary, content_sha256)
+        report('index', 'done')
+
+        return {'file_id': file_id, 'summary': summary}
+
+    def _save_library_entry(self, user_id: str, file_id: str, file_name: str, file_type: str, s3_key: str,
+                            summary: Optional[str], content_sha256: Optional[str]) -> None:
+        """Write a file's user_files row; without a summary, takes the stored content's if it has one."""
+        self.logger.info(f"Saving file metadata to DB for file {file_id}")
+        with pooled_connection() as conn:
+            if conn is None:
+                raise RuntimeError("Database unavailable")
+            with conn.cursor() as cur:
+                # A retried job overwrites the row its earlier attempt may have written
+                cur.execute(
+                    """
+                    INSERT INTO user_files (id, user_id, file_name, file_type, s3_key, summary, content_sha256, created_at)
+                    VALUES (%s, %s, %s, %s, %s, COALESCE(%s, (SELECT summary FROM content_blobs WHERE sha256 = %s)), %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET summary = EXCLUDED.summary
+                    """,
+                    (file_id, user_id, file_name, file_type, s3_key, summary, content_sha256, content_sha256, datetime.now())
+                )
+        self.logger.info(f"Successfully saved metadata for file {file_id} to DB")
+
+    def _find_stored_content(self, uploaded: UploadResult) -> Optional[Dict[str, Any]]:
+        """The content_blobs row for content identical to a just-uploaded object, which is then deleted
+        in favour of the stored copy. None if the content is new (the upload becomes its stored copy)
+        or the database is unavailable (the upload is kept as is)."""
+        stored, created = self.content_store.register(uploaded.sha256, uploaded.key, uploaded.size, uploaded.content_type)
+        if stored is None or created or stored['s3_key'] == uploaded.key:
+            return None
+        self.logger.info(f"{uploaded.key} has the same content as {stored['s3_key']}; reusing the stored copy")
+        try:
+            self.s3_client.delete_object(Bucket=self.s3_bucket, Key=uploaded.key)
+        except Exception as e:
+            self.logger.warning(f"Could not delete duplicate upload {uploaded.key}: {str(e)}")
+        return stored
+
+    def _extract_text(self, file_data: bytes, file_name: str, file_type: str) -> Optional[str]:
+        """Text of a PDF or plain-text upload; None for other types or undecodable text."""
+        self.logger.info(f"Attempting text extraction for file type: {file_type}")
+        if file_type == 'application/pdf':
+            extracted_text = self._extract_text_from_pdf(file_data)
+            self.logger.info(f"Extracted ~{len(extracted_text)} chars from PDF")
+            return extracted_text
+        if file_type == 'text/plain':
+            try:
+                extracted_text = file_data.decode('utf-8')
+                self.logger.info(f"Decoded ~{len(extracted_text)} chars from TXT")
+                return extracted_text
+            except UnicodeDecodeError:
+                self.logger.warning(f"Could not decode file {file_name} as UTF-8. Trying latin-1.")
+                try:
+                    extracted_text = file_data.decode('latin-1')
+                    self.logger.info(f"Decoded ~{len(extracted_text)} chars from TXT with latin-1")
+                    return extracted_text
+                except Exception as decode_err:
+                     self.logger.error(f"Failed to decode TXT file {file_name} with any encoding: {decode_err}")
+                     return None
+        self.logger.warning(f"Skipping text extraction/summarization for unsupported file type: {file_type}")
+        return None
+
     def _extract_text_from_pdf(self, pdf_data: bytes) -> str:
-        """Extract text from PDF file."""
+        """Extract text from PDF file, page ranges in parallel for long documents (models/pdf_extraction.py)."""
         try:
-            pdf_file = io.BytesIO(pdf_data)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-            return text
+            extracted = extract_pdf_text(pdf_data)
+            self.logger.info(f"Extracted {len(extracted.pages)} pages with {extracted.engine}")
+            return extracted.text
         except Exception as e:
             self.logger.error(f"Error extracting text from PDF: {str(e)}")
             return ""
@@ -432,22 +1047,15 @@ class ScholarAgent:
                             )['Metadata']
                             
                             # Extract file ID from the key
-                            file_id = obj['Key'].split('/')[2]
-                            
-                            # Generate pre-signed URL
-                            url = self._generate_presigned_url(obj['Key'])
-                            
-                            if url:
-                                files.append({
-                                    'id': file_id,
-                                    'file_name': metadata.get('file_name', obj['Key'].split('/')[-1]),
-                                    'file_type': metadata.get('file_type', 'application/octet-stream'),
-                                    'created_at': metadata.get('created_at', obj['LastModified'].isoformat()),
-                                    'url': url
-                                })
+                            entry = self._library_entry(obj['Key'].split('/')[2], obj, metadata)
+                            if entry:
+                                files.append(entry)
                         except Exception as e:
                             self.logger.error(f"Error processing file {obj['Key']}: {str(e)}")
                             continue
+
+                # Files whose content was already stored point at that copy instead
+                files.extend(self._shared_library_files(user_id))
                 
                 self.logger.info(f"Found {len(files)} files for user {user_id}")
                 return files
@@ -472,6 +1080,9 @@ class ScholarAgent:
             )
             
             if 'Contents' not in response or not response['Contents']:
+                shared = self._shared_library_files(user_id, file_id)
+                if shared:
+                    return shared[0]
                 self.logger.error(f"File {file_id} not found for user {user_id}")
                 return None
                 
@@ -483,25 +1094,77 @@ class ScholarAgent:
                 Key=obj['Key']
             )['Metadata']
             
-            # Generate pre-signed URL
-            url = self._generate_presigned_url(obj['Key'])
-            
-            if not url:
+            entry = self._library_entry(file_id, obj, metadata)
+            if not entry:
                 self.logger.error(f"Failed to generate URL for file {file_id}")
-                return None
-            
-            return {
-                'id': file_id,
-                'file_name': metadata.get('file_name', obj['Key'].split('/')[-1]),
-                'file_type': metadata.get('file_type', 'application/octet-stream'),
-                'created_at': metadata.get('created_at', obj['LastModified'].isoformat()),
-                'url': url
-            }
+            return entry
             
         except Exception as e:
             self.logger.error(f"Error getting file details: {str(e)}", exc_info=True)
             return None
 
+    def _library_entry(self, file_id: str, obj: Dict[str, Any], metadata: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Library entry for a user_uploads/ object from its listing and S3 metadata (None if it can't be presigned)."""
+        url = self._generate_presigned_url(obj['Key'])
+        if not url:
+            return None
+        return {
+            'id': file_id,
+            'file_name': metadata.get('file_name', obj['Key'].split('/')[-1]),
+            'file_type': metadata.get('file_type', 'application/octet-stream'),
+            'created_at': metadata.get('created_at', obj['LastModified'].isoformat()),
+            'url': url
+        }
+
+    async def get_user_library_files_async(self, user_id: str) -> List[Dict[str, Any]]:
+        """get_user_library_files on the async S3 and Postgres clients; object metadata is fetched concurrently."""
+        try:
+            # A missing or inaccessible bucket fails the listing itself, so there is no separate head_bucket
+            response = await self.s3.list_objects_v2(Bucket=self.s3_bucket, Prefix=f"user_uploads/{user_id}/")
+            objects = response.get('Contents', [])
+            heads = await asyncio.gather(
+                *(self.s3.head_object(Bucket=self.s3_bucket, Key=obj['Key']) for obj in objects),
+                return_exceptions=True
+            )
+            files = []
+            for obj, head in zip(objects, heads):
+                if isinstance(head, Exception):
+                    self.logger.error(f"Error processing file {obj['Key']}: {str(head)}")
+                    continue
+                entry = self._library_entry(obj['Key'].split('/')[2], obj, head['Metadata'])
+                if entry:
+                    files.append(entry)
+
+            files.extend(await self._shared_library_files_async(user_id))
+            self.logger.info(f"Found {len(files)} files for user {user_id}")
+            return files
+
+        except Exception as e:
+            self.logger.error(f"Error getting user files: {str(e)}", exc_info=True)
+            return []
+
+    async def get_file_details_async(self, user_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+        """get_file_details on the async S3 and Postgres clients."""
+        try:
+            response = await self.s3.list_objects_v2(Bucket=self.s3_bucket, Prefix=f"user_uploads/{user_id}/{file_id}/")
+            if not response.get('Contents'):
+                shared = await self._shared_library_files_async(user_id, file_id)
+                if shared:
+                    return shared[0]
+                self.logger.error(f"File {file_id} not found for user {user_id}")
+                return None
+
+            obj = response['Contents'][0]
+            metadata = (await self.s3.head_object(Bucket=self.s3_bucket, Key=obj['Key']))['Metadata']
+            entry = self._library_entry(file_id, obj, metadata)
+            if not entry:
+                self.logger.error(f"Failed to generate URL for file {file_id}")
+            return entry
+
+        except Exception as e:
+            self.logger.error(f"Error getting file details: {str(e)}", exc_info=True)
+            return None
+
     def delete_file(self, user_id: str, file_id: str) -> bool:
         """Delete a file from S3."""
         try:
@@ -514,15 +1177,33 @@ class ScholarAgent:
             )
             
             if 'Contents' not in response:
+                if self._delete_shared_file(user_id, file_id):
+                    self.logger.info(f"Successfully deleted file {file_id} for user {user_id}")
+                    return True
                 self.logger.error(f"File {file_id} not found for user {user_id}")
                 return False
                 
             # Delete all objects with this prefix (in case there are multiple versions)
             for obj in response['Contents']:
+                if self.content_store.other_references(obj['Key'], file_id):
+                    # Other library entries share this copy; move it out of the user's folder instead
+                    shared_key = 'shared/' + obj['Key'][len('user_uploads/'):]
+                    self.s3_client.copy_object(
+                        Bucket=self.s3_bucket,
+                        Key=shared_key,
+                        CopySource={'Bucket': self.s3_bucket, 'Key': obj['Key']}
+                    )
+                    self.content_store.move(obj['Key'], shared_key)
+                else:
+                    self.content_store.forget(obj['Key'])
                 self.s3_client.delete_object(
                     Bucket=self.s3_bucket,
                     Key=obj['Key']
                 )
+            with pooled_connection() as conn:
+                if conn is not None:
+                    with conn.cursor() as cur:
+                        cur.execute("DELETE FROM user_files WHERE id = %s AND user_id = %s", (file_id, user_id))
             
             self.logger.info(f"Successfully deleted file {file_id} for user {user_id}")
             return True
@@ -531,10 +1212,75 @@ class ScholarAgent:
             self.logger.error(f"Error deleting file: {str(e)}", exc_info=True)
             return False
 
+    def _shared_library_files(self, user_id: str, file_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Library entries (all of the user's, or just file_id) stored as a reference to another
+        entry's S3 object rather than under their own user_uploads/{user_id}/{file_id}/ folder."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return []
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT id, file_name, file_type, s3_key, created_at FROM user_files
+                    WHERE user_id = %s AND (%s IS NULL OR id = %s)
+                    """,
+                    (user_id, file_id, file_id)
+                )
+                rows = cur.fetchall()
+        return self._shared_entries(user_id, rows)
+
+    async def _shared_library_files_async(self, user_id: str, file_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        rows = await async_db.fetch(
+            'scholar',
+            """
+            SELECT id, file_name, file_type, s3_key, created_at FROM user_files
+            WHERE user_id = $1 AND ($2::text IS NULL OR id = $2)
+            """,
+            user_id, file_id
+        )
+        return self._shared_entries(user_id, [tuple(row) for row in rows])
+
+    def _shared_entries(self, user_id: str, rows: List[tuple]) -> List[Dict[str, Any]]:
+        files = []
+        for row_id, file_name, file_type, s3_key, created_at in rows:
+            if s3_key.startswith(f"user_uploads/{user_id}/{row_id}/"):
+                continue
+            url = self._generate_presigned_url(s3_key)
+            if url:
+                files.append({
+                    'id': row_id,
+                    'file_name': file_name,
+                    'file_type': file_type,
+                    'created_at': created_at.isoformat() if created_at else None,
+                    'url': url
+                })
+        return files
+
+    def _delete_shared_file(self, user_id: str, file_id: str) -> bool:
+        """Delete a library entry that references another entry's S3 object. The object is deleted
+        too if it was moved out of its owner's folder (see delete_file) and nothing else uses it."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return False
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM user_files WHERE id = %s AND user_id = %s RETURNING s3_key", (file_id, user_id))
+                row = cur.fetchone()
+        if row is None:
+            return False
+        s3_key = row[0]
+        if s3_key.startswith('shared/') and not self.content_store.other_references(s3_key, file_id):
+            self.s3_client.delete_object(Bucket=self.s3_bucket, Key=s3_key)
+            self.content_store.forget(s3_key)
+        return True
+
     async def add_paper_from_url(self, user_id: str, url: str) -> Dict:
-        """Fetches paper PDF from URL, uploads to S3, and saves metadata to DB."""
+        """Fetches paper PDF from URL, uploads to S3, and saves metadata to DB.
+
+        A PDF already stored (same SHA-256) is not kept twice: the library entry points
+        at the stored copy and takes its summary. New content is extracted and summarized
+        by an ingestion job, as for uploads; job_id is set when one was queued.
+        """
         file_id = str(uuid.uuid4()) # Generate unique ID for this file
-        pdf_data = None
         s3_key = None
         
         # Extract necessary details safely
@@ -549,85 +1295,59 @@ class ScholarAgent:
             if not user_id: raise ValueError("User ID is required")
             if not paper_url: raise ValueError("Paper URL is required")
 
-            # 1. Fetch PDF Content from URL
+            # 1+2. Stream the PDF from the URL straight into S3, in constant memory
+            s3_key = f"user_uploads/{user_id}/{file_id}/{file_name}"
+            metadata = {
+                'user_id': user_id,
+                'file_name': file_name,
+                'file_type': 'application/pdf',
+                'original_url': paper_url, # Store original source URL
+                'added_from': 'search',
+                'created_at': datetime.now().isoformat()
+            }
             try:
-                self.logger.info(f"Fetching PDF from {paper_url}")
-                # Use stream=True for potentially large files, add timeout
-                response = requests.get(paper_url, headers=self.headers, stream=True, timeout=30, allow_redirects=True)
-                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                
-                # Check content type - be flexible but prefer application/pdf
-                content_type = response.headers.get('content-type', '').lower()
-                if 'application/pdf' not in content_type:
-                    self.logger.warning(f"Content-Type from {paper_url} is '{content_type}', not application/pdf. Proceeding cautiously.")
-                    # Optional: Could add more checks here (e.g., magic numbers) if needed
-                
-                # Read content (consider memory usage for very large files)
-                pdf_data = response.content # Reads the entire content into memory
-                self.logger.info(f"Successfully fetched PDF data (approx {len(pdf_data)} bytes)")
-                
-            except requests.exceptions.RequestException as e:
+                self.logger.info(f"Fetching PDF from {paper_url} into S3 key: {s3_key}")
+                loop = asyncio.get_running_loop()
+                uploaded = await loop.run_in_executor(None, self._download_to_s3, paper_url, s3_key, metadata)
+                self.logger.info(f"Successfully stored PDF ({uploaded.size} bytes, sha256 {uploaded.sha256[:12]})")
+            except ValueError:
+                raise
+            except requests.RequestException as e:
                 self.logger.error(f"Failed to fetch PDF from URL {paper_url}: {e}", exc_info=True)
                 raise ValueError(f"Could not retrieve paper from URL: {e}")
-            except Exception as e:
-                 self.logger.error(f"Unexpected error fetching PDF from {paper_url}: {e}", exc_info=True)
-                 raise ValueError(f"An unexpected error occurred while fetching the paper.")
-            
-            if not pdf_data:
-                 raise ValueError("Failed to get PDF data from the URL.")
-
-            # 2. Upload PDF to S3
-            s3_key = f"user_uploads/{user_id}/{file_id}/{file_name}"
-            try:
-                self.logger.info(f"Uploading fetched PDF to S3 key: {s3_key}")
-                self.s3_client.put_object(
-                    Bucket=self.s3_bucket,
-                    Key=s3_key,
-                    Body=pdf_data,
-                    ContentType='application/pdf',
-                    Metadata={
-                        'user_id': user_id,
-                        'file_name': file_name,
-                        'file_type': 'application/pdf',
-                        'original_url': paper_url, # Store original source URL
-                        'added_from': 'search',
-                        'created_at': datetime.now().isoformat()
-                    }
-                )
-                self.logger.info("S3 upload successful")
             except Exception as e:
                 self.logger.error(f"S3 upload error for key {s3_key}: {e}", exc_info=True)
                 raise ValueError(f"Failed to upload file to S3: {e}")
 
-            # 3. Save Metadata to Database (user_files table)
-            # Note: Skipping summarization for now as it wasn't in upload_paper either.
-            # If summarization is needed, extract text and call generate_summary here.
+            stored = await loop.run_in_executor(None, self._find_stored_content, uploaded)
+            if stored is not None:
+                s3_key = stored['s3_key']
+
+            # 3. Save the library entry now, so the paper shows as added; it takes a stored summary if there is one
             try:
-                self.logger.info(f"Saving file metadata to DB for file {file_id}")
-                self._ensure_db_connection()
-                with self.db_conn.cursor() as cur:
-                    sql = """
-                        INSERT INTO user_files (id, user_id, file_name, file_type, s3_key, summary, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (id) DO NOTHING -- Or update if needed
-                    """
-                    params = (
-                        file_id,
-                        user_id,
-                        file_name,
-                        'application/pdf', # Set file type as PDF
-                        s3_key,
-                        None, # No summary generated here
-                        datetime.now()
-                    )
-                    cur.execute(sql, params)
-                self.db_conn.commit()
-                self.logger.info(f"Successfully saved metadata for file {file_id} to DB")
+                await loop.run_in_executor(
+                    None, self._save_library_entry, user_id, file_id, file_name, 'application/pdf', s3_key, None, uploaded.sha256
+                )
             except Exception as db_err:
                 self.logger.error(f"Database error saving metadata for file {file_id}: {db_err}", exc_info=True)
-                # Decide if this failure should prevent success response.
-                # For now, log but continue. Consider cleanup (e.g., delete S3 object).
-                pass 
+
+            # 4. Extract and summarize new content in the background, as for uploads
+            job_id = None
+            processed = stored is not None and stored['extracted_text'] is not None
+            needs_summary = processed and not stored['summary'] and bool(stored['extracted_text'])
+            if needs_summary or (not processed and await loop.run_in_executor(
+                    None, self.content_store.claim_processing, uploaded.sha256)):
+                job_id = await self._enqueue_ingestion(user_id, file_id, file_name, 'application/pdf', s3_key, uploaded.sha256)
+                if job_id is None:
+                    # No job queue: process within the request instead
+                    try:
+                        await loop.run_in_executor(
+                            None, self._ingest_from_s3, user_id, file_id, file_name, 'application/pdf', s3_key, None, uploaded.sha256
+                        )
+                    except Exception as e:
+                        self.logger.error(f"Error processing paper {file_id} from {paper_url}: {e}", exc_info=True)
+                        if not processed:
+                            await loop.run_in_executor(None, self.content_store.release_processing, uploaded.sha256)
 
             # After successful S3 upload, log the activity
             if self.context_agent:
@@ -637,7 +1357,11 @@ class ScholarAgent:
             return {
                 'status': 'success',
                 'file_id': file_id,
-                'file_name': file_name
+                'file_name': file_name,
+                'size': uploaded.size,
+                'sha256': uploaded.sha256,
+                'deduplicated': stored is not None,
+                'job_id': job_id
             }
 
         except ValueError as ve:
@@ -647,6 +1371,34 @@ class ScholarAgent:
             self.logger.error(f"Unexpected error in add_paper_from_url: {str(e)}", exc_info=True)
             return {'status': 'error', 'message': f"An unexpected error occurred: {str(e)}"}
 
+    def _download_to_s3(self, url: str, s3_key: str, metadata: Dict[str, str]) -> UploadResult:
+        """Pipe a PDF download into an S3 multipart upload without holding the file in memory.
+
+        Raises ValueError if the response is not a PDF (checked on the first bytes,
+        before anything is stored) or is larger than max_download_bytes.
+        """
+        with upstream_call('scholar', 'paper_download'):
+            response = http_get(url, headers=self.headers, stream=True)
+        with response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '').lower()
+            if 'application/pdf' not in content_type:
+                self.logger.warning(f"Content-Type from {url} is '{content_type}', not application/pdf. Checking the content.")
+            length = response.headers.get('content-length', '')
+            if length.isdigit() and int(length) > self.max_download_bytes:
+                raise SizeLimitExceeded(f"File is larger than the {self.max_download_bytes // (1024 * 1024)} MB limit")
+
+            def require_pdf(head: bytes) -> None:
+                # The PDF header may follow a little leading garbage, but must be within the first 1 KB
+                if b'%PDF-' not in head[:1024]:
+                    raise ValueError(f"URL did not return a PDF (Content-Type '{content_type or 'unknown'}')")
+
+            response.raw.decode_content = True
+            return upload_stream(
+                self.s3_client, self.s3_bucket, s3_key, LimitedReader(response.raw, self.max_download_bytes),
+                content_type='application/pdf', metadata=metadata, validate=require_pdf
+            )
+
     def __del__(self):
         """Clean up database connection when the object is destroyed."""
         if hasattr(self, 'db_conn') and self.db_conn and not self.db_conn.closed:
@@ -729,6 +1481,37 @@ class ScholarAgent:
             self.logger.error(f"Error generating presigned URL for file {file_id}: {e}", exc_info=True)
             return None
 
+    async def check_library_status_async(self, user_id: str, paper_urls: List[str]) -> Dict[str, Dict]:
+        """check_library_status on the async Postgres pool."""
+        if not user_id or not paper_urls:
+            return {}
+        try:
+            rows = await async_db.fetch(
+                'scholar',
+                "SELECT id, s3_key, original_url FROM user_files WHERE user_id = $1 AND original_url = ANY($2::text[])",
+                user_id, list(paper_urls)
+            )
+            found_urls = {
+                row['original_url']: {'inLibrary': True, 'file_id': row['id'], 's3_key': row['s3_key']}
+                for row in rows
+            }
+            return {url: found_urls.get(url, {'inLibrary': False, 'file_id': None, 's3_key': None}) for url in paper_urls}
+        except Exception as e:
+            self.logger.error(f"Error checking library status for user {user_id}: {e}", exc_info=True)
+            return {url: {'inLibrary': False, 'file_id': None, 's3_key': None, 'error': 'Failed to check status'} for url in paper_urls}
+
+    async def get_presigned_url_for_file_async(self, user_id: str, file_id: str) -> Optional[str]:
+        """get_presigned_url_for_file on the async Postgres pool."""
+        try:
+            row = await async_db.fetchrow('scholar', "SELECT s3_key FROM user_files WHERE id = $1 AND user_id = $2", file_id, user_id)
+            if row is None:
+                self.logger.warning(f"File {file_id} not found or does not belong to user {user_id}")
+                return None
+            return self._generate_presigned_url(row['s3_key'])
+        except Exception as e:
+            self.logger.error(f"Error generating presigned URL for file {file_id}: {e}", exc_info=True)
+            return None
+
     async def like_paper(self, user_id: str, file_name: str) -> Dict:
         """Add a paper to user's liked papers."""
         try:
@@ -749,7 +1532,9 @@ class ScholarAgent:
                     port=os.getenv('DB_PORT', '5432'),
                     dbname=os.getenv('DB_NAME', 'thesys_ai'),
                     user=os.getenv('DB_USER', 'postgres'),
-                    password=os.getenv('DB_PASSWORD')
+                    password=os.getenv('DB_PASSWORD'),
+                    connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+                    cursor_factory=instrumented_cursor_factory('scholar')
                 )
                 self.db_conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
                 self.logger.info("Successfully connected to database")
@@ -1 +1,89 @@
-import requests
\ No newline at end of file
+import base64
+import hashlib
+import json
+import re
+from itertools import zip_longest
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+_ARXIV_ID = re.compile(r'(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?', re.IGNORECASE)
+
+
+def normalize_title(title: Optional[str]) -> str:
+    """Lowercase a title and collapse everything but letters and digits, for matching."""
+    return re.sub(r'[^a-z0-9]+', ' ', (title or '').lower()).strip()
+
+
+def normalize_arxiv_id(value: Optional[str]) -> Optional[str]:
+    """Extract a version-less arXiv id from an id or abs/pdf URL ('http://arxiv.org/abs/2101.00001v2' -> '2101.00001')."""
+    if not value:
+        return None
+    match = _ARXIV_ID.search(str(value))
+    return match.group(1).lower() if match else None
+
+
+def paper_keys(paper: Dict[str, Any]) -> List[str]:
+    """Identity keys for a search result: DOI, arXiv id and normalized title."""
+    keys = []
+    if paper.get('doi'):
+        keys.append(f"doi:{str(paper['doi']).lower()}")
+    arxiv_id = normalize_arxiv_id(paper.get('arxiv_id'))
+    if arxiv_id:
+        keys.append(f"arxiv:{arxiv_id}")
+    title = normalize_title(paper.get('title'))
+    if title:
+        keys.append(f"title:{title}")
+    return keys
+
+
+def merge_paper_results(results_by_source: Dict[str, List[Dict[str, Any]]], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Merge ranked result lists from several sources into one de-duplicated list.
+
+    Sources are interleaved by rank so each contributes its best hits first. A
+    paper found by more than one source (same DOI, arXiv id or normalized title)
+    is kept once, at its best position, with missing fields filled in from the
+    other copies and every source listed in 'sources'.
+    """
+    merged: List[Dict[str, Any]] = []
+    index: Dict[str, Dict[str, Any]] = {}
+
+    for row in zip_longest(*results_by_source.values()):
+        for source, paper in zip(results_by_source.keys(), row):
+            if paper is None:
+                continue
+            keys = paper_keys(paper)
+            existing = next((index[key] for key in keys if key in index), None)
+            if existing is None:
+                existing = {**paper, 'sources': [source]}
+                merged.append(existing)
+            else:
+                for field, value in paper.items():
+                    if existing.get(field) in (None, '', []) and value not in (None, '', []):
+                        existing[field] = value
+                if source not in existing['sources']:
+                    existing['sources'].append(source)
+            for key in paper_keys(existing):
+                index.setdefault(key, existing)
+
+    return merged[:limit] if limit else merged
+
+
+def key_digests(papers: Iterable[Dict[str, Any]]) -> Set[str]:
+    """Short digests of every identity key of the given papers, compact enough to carry in a cursor."""
+    return {hashlib.sha1(key.encode('utf-8')).hexdigest()[:8] for paper in papers for key in paper_keys(paper)}
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    """Opaque, URL-safe pagination cursor for a search position."""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Inverse of encode_cursor; raises ValueError for anything it did not produce."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(state, dict) or state.get('src') not in ('local', 'upstream'):
+        raise ValueError("Invalid cursor")
+    return state
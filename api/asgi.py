@@ -0,0 +1,488 @@
+"""
+ASGI entry point: serves the app on one long-lived event loop per worker process.
+
+    gunicorn api.asgi:app    # settings in gunicorn.conf.py
+
+The hot routes (chat, search, fact-check, paper metadata, uploads and their
+status, the library and /metrics) run natively on the server's event loop, so
+the AsyncOpenAI client, the httpx client and the asyncpg pool
+(backend/async_db.py) are shared by every request and a slow upstream only costs a coroutine, not a thread. S3 calls
+go through backend/async_s3.py's own small thread pool, and the remaining
+blocking agent work through a bounded default executor. Every other route is
+served by the Flask app in api/index.py, mounted behind a WSGI adapter with its
+own bounded thread limit.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+import anyio.to_thread
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from werkzeug.utils import secure_filename
+
+from api.index import app as flask_app, chat_manager, logger, _sse_event, _ndjson_line, _search_params, _timed_chat_events
+from backend.async_db import close_async_pool
+from backend.multipart_stream import MultipartError, MultipartUpload
+from models.model_server import ModelServerClient
+from utils.startup import get_startup_report
+from utils.http import close_async_client, get_async_client
+from utils.metrics import start_request_timings, get_request_timings, server_timing_header, observe_request, metrics_payload
+
+# Streamed bodies run after the headers are sent, so they get no Server-Timing header
+STREAMING_MEDIA_TYPES = ('text/event-stream', 'application/x-ndjson')
+
+# Threads for blocking agent/DB/S3 calls made from async routes (run_in_executor(None, ...))
+EXECUTOR_WORKERS = int(os.getenv('ASGI_EXECUTOR_WORKERS', '32'))
+# Threads serving the mounted Flask routes
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '40'))
+# Build the agents, DB connections and OpenAI client before serving, off the event loop
+WARMUP = os.getenv('ASGI_WARMUP', 'true').lower() == 'true'
+# Longest /api/health waits for the model server to answer a ping
+HEALTH_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '2'))
+# Largest paper_ids list /api/papers/metadata accepts
+METADATA_MAX_IDS = int(os.getenv('PAPER_METADATA_MAX_IDS', '500'))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='agent-io')
+    loop.set_default_executor(executor)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = WSGI_THREADS
+    # This loop's HTTP client lives until shutdown (closing_async_client leaves it open)
+    get_async_client()
+    if WARMUP:
+        await _warm_components(loop)
+    else:
+        chat_manager.start_ingestion_workers()
+    logger.info(f"ASGI app started ({EXECUTOR_WORKERS} executor threads, {WSGI_THREADS} WSGI threads)")
+    try:
+        yield
+    finally:
+        if chat_manager.__dict__.get('openai_client') is not None:
+            await chat_manager.openai_client.close()
+        await close_async_client()
+        await close_async_pool()
+        executor.shutdown(wait=False)
+
+
+async def _warm_components(loop: asyncio.AbstractEventLoop) -> None:
+    """Build every lazy component in the executor, so no request builds one on the event loop.
+    A failure is in the startup report and the component is built again on first use."""
+    async def warm(name: str) -> None:
+        try:
+            await loop.run_in_executor(None, getattr, chat_manager, name)
+        except Exception:
+            pass
+
+    await asyncio.gather(*(warm(name) for name in chat_manager.WARMUP_COMPONENTS))
+
+
+app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+
+
+@app.middleware('http')
+async def server_timing(request: Request, call_next):
+    """Server-Timing header and latency histogram for the native routes (Flask handles its own)."""
+    started = time.perf_counter()
+    start_request_timings()
+    response = await call_next(request)
+    if 'server-timing' not in response.headers:
+        total = time.perf_counter() - started
+        if not response.headers.get('content-type', '').startswith(STREAMING_MEDIA_TYPES):
+            response.headers['Server-Timing'] = server_timing_header(get_request_timings(), total)
+        route = request.scope.get('route')
+        observe_request(request.method, route.path if route else 'unmatched', response.status_code, total)
+    return response
+
+
+async def _json_body(request: Request) -> Optional[Dict[str, Any]]:
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@app.post('/api/chat')
+async def chat(request: Request):
+    user_id = "test_user"  # Placeholder for development
+
+    try:
+        data = await _json_body(request)
+        if not data:
+            logger.error("No JSON data received")
+            return JSONResponse({'error': 'No data provided'}, status_code=400)
+
+        message = data.get('message', '')
+        if not message:
+            logger.error("No message provided")
+            return JSONResponse({'error': 'Message is required'}, status_code=400)
+
+        response_data = await chat_manager.process_message(
+            message=message,
+            user_id=user_id,
+            temperature=float(data.get('temperature', 0.7)),
+            previous_context_vector=data.get('previous_context_vector')
+        )
+        return JSONResponse(jsonable_encoder(response_data))
+
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.post('/api/chat/stream')
+async def chat_stream(request: Request):
+    """Streaming variant of /api/chat that sends Server-Sent Events as work finishes."""
+    user_id = "test_user"  # Placeholder for development
+
+    data = await _json_body(request)
+    if not data:
+        logger.error("No JSON data received")
+        return JSONResponse({'error': 'No data provided'}, status_code=400)
+
+    message = data.get('message', '')
+    if not message:
+        logger.error("No message provided")
+        return JSONResponse({'error': 'Message is required'}, status_code=400)
+
+    temperature = float(data.get('temperature', 0.7))
+
+    async def generate():
+        # Runs after the headers are sent; stage timings go in the trailing 'timing' event
+        timings = start_request_timings()
+        try:
+            async for event, payload in _timed_chat_events(chat_manager.stream_message(message, user_id, temperature), timings):
+                yield _sse_event(event, payload)
+        except Exception as e:
+            logger.error(f"Error in chat stream endpoint: {str(e)}", exc_info=True)
+            yield _sse_event('error', {'error': str(e)})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post('/api/papers/search')
+async def search_papers(request: Request):
+    """Endpoint for searching papers. Pass 'limit' for the page size and the returned
+    'next_cursor' as 'cursor' to fetch the next page."""
+    try:
+        data = await _json_body(request) or {}
+        query = data.get('query')
+        if not query:
+            return JSONResponse({'error': 'Query is required'}, status_code=400)
+        try:
+            limit, cursor = _search_params(data)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        result = await chat_manager.search_papers(query, data.get('user_id'), limit, cursor)
+        return JSONResponse(jsonable_encoder(result))
+
+    except Exception as e:
+        logger.error(f"Error in search_papers endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.post('/api/papers/search/stream')
+async def search_papers_stream(request: Request):
+    """Streaming variant of /api/papers/search: newline-delimited JSON, one record per batch of hits."""
+    data = await _json_body(request) or {}
+    query = data.get('query')
+    if not query:
+        return JSONResponse({'error': 'Query is required'}, status_code=400)
+    try:
+        limit, cursor = _search_params(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    async def generate():
+        try:
+            async for record in chat_manager.stream_search_papers(query, data.get('user_id'), limit, cursor):
+                yield _ndjson_line(jsonable_encoder(record))
+        except Exception as e:
+            logger.error(f"Error in search_papers stream endpoint: {str(e)}", exc_info=True)
+            yield _ndjson_line({'type': 'error', 'error': str(e)})
+
+    return StreamingResponse(
+        generate(),
+        media_type='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.get('/api/startup')
+async def startup_report():
+    """Per-component initialization timings for this worker."""
+    return JSONResponse(get_startup_report())
+
+
+@app.get('/api/health')
+async def health():
+    """Health check for the load balancer: 503 while the shared model server doesn't answer."""
+    socket_path = os.getenv('MODEL_SERVER_SOCKET')
+    if socket_path:
+        try:
+            await asyncio.wait_for(ModelServerClient(socket_path).request_async({'op': 'ping'}), timeout=HEALTH_TIMEOUT)
+        except (OSError, RuntimeError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            return JSONResponse({'status': 'unavailable', 'model_server': str(e) or type(e).__name__}, status_code=503)
+    return JSONResponse({'status': 'ok'})
+
+
+@app.get('/metrics')
+async def metrics():
+    """Prometheus metrics: request/stage latency histograms and upstream call counters."""
+    payload, content_type = metrics_payload()
+    return Response(payload, media_type=content_type)
+
+
+@app.post('/api/factcheck')
+async def factcheck(request: Request):
+    """Endpoint for fact-checking claims."""
+    try:
+        data = await _json_body(request) or {}
+        claim = data.get('claim')
+        if not claim:
+            return JSONResponse({'error': 'Claim is required'}, status_code=400)
+
+        result = await chat_manager.verify_claim_async(claim, data.get('user_id'))
+        return JSONResponse(jsonable_encoder(result))
+
+    except Exception as e:
+        logger.error(f"Error in factcheck endpoint: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.post('/api/papers/metadata')
+async def hydrate_papers(request: Request):
+    """Metadata (including citation counts) for a list of 'paper_ids' (DOIs, arXiv ids or
+    Semantic Scholar ids), fetched in batches rather than one request per paper."""
+    try:
+        data = await _json_body(request) or {}
+        paper_ids = data.get('paper_ids')
+        if not paper_ids or not isinstance(paper_ids, list):
+            return JSONResponse({'status': 'error', 'message': 'List of paper_ids required'}, status_code=400)
+        if len(paper_ids) > METADATA_MAX_IDS:
+            return JSONResponse({'status': 'error', 'message': f'At most {METADATA_MAX_IDS} paper_ids per request'}, status_code=400)
+
+        papers = await chat_manager.scholar_agent.hydrate_papers([str(paper_id) for paper_id in paper_ids])
+        return JSONResponse(jsonable_encoder({'status': 'success', 'papers': papers}))
+
+    except Exception as e:
+        logger.error(f"Error in hydrate_papers endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'status': 'error', 'message': f'Server error: {str(e)}'}, status_code=500)
+
+
+@app.post('/api/papers/upload')
+async def upload_paper(request: Request):
+    """Endpoint for uploading papers.
+
+    The multipart body is parsed as it arrives and the file part is streamed on to S3
+    (backend/multipart_stream.py), so the file is never buffered whole. user_id is taken
+    from the query string or from a form field sent before the file.
+    """
+    try:
+        try:
+            upload = MultipartUpload(request.headers.get('content-type', ''))
+            chunks = request.stream()
+            has_file = await upload.read_until_file(chunks)
+        except MultipartError as e:
+            logger.error(f"Invalid upload body: {str(e)}")
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        if not has_file:
+            logger.error("No file provided in request")
+            return JSONResponse({'error': 'No file provided'}, status_code=400)
+
+        user_id = request.query_params.get('user_id') or upload.fields.get('user_id')
+        if not user_id:
+            logger.error("User ID is required")
+            return JSONResponse({'error': 'User ID is required (in the query string or before the file)'}, status_code=400)
+
+        if not upload.filename:
+            logger.error("No filename provided")
+            return JSONResponse({'error': 'No filename provided'}, status_code=400)
+
+        file_type = upload.content_type or 'application/pdf'  # Default to PDF if not specified
+        file_name = secure_filename(upload.filename)
+
+        feeding = asyncio.create_task(upload.feed_file(chunks))
+        try:
+            result = await chat_manager.scholar_agent.upload_paper(
+                user_id=user_id,
+                file_data=upload.file,
+                file_name=file_name,
+                file_type=file_type
+            )
+        finally:
+            # Stops reading the body if the upload was rejected before the end of the file
+            feeding.cancel()
+            await asyncio.gather(feeding, return_exceptions=True)
+
+        if 'error' in result or result.get('status') == 'error':
+            logger.error(f"Error uploading paper: {result.get('error') or result.get('message')}")
+            return JSONResponse(result, status_code=500)
+
+        # Extraction and summary run in the background; poll the job's status URL
+        if result.get('status') == 'queued':
+            status_path = request.app.url_path_for('get_upload_job', job_id=result['job_id'])
+            result['status_url'] = f"{status_path}?{urlencode({'user_id': user_id})}"
+            return JSONResponse(result, status_code=202)
+
+        return JSONResponse(result)
+
+    except Exception as e:
+        logger.error(f"Error in upload_paper endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.get('/api/papers/upload/{job_id}')
+async def get_upload_job(job_id: str, request: Request):
+    """Status of a background upload job: overall status plus per-stage progress (upload, extract, summarize, index)."""
+    try:
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return JSONResponse({'status': 'error', 'message': 'User ID required'}, status_code=400)
+
+        job = await chat_manager.scholar_agent.get_ingestion_job_async(user_id, job_id)
+        if job is None:
+            return JSONResponse({'status': 'error', 'message': 'Job not found'}, status_code=404)
+        return JSONResponse(jsonable_encoder({'status': 'success', 'job': job}))
+
+    except Exception as e:
+        logger.error(f"Error in get_upload_job endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'status': 'error', 'message': f'Server error: {str(e)}'}, status_code=500)
+
+
+async def _library_user_id(request: Request) -> Optional[str]:
+    """user_id from the query string (GET/DELETE) or the JSON body (POST)."""
+    if request.method == 'POST':
+        return (await _json_body(request) or {}).get('user_id')
+    return request.query_params.get('user_id')
+
+
+@app.api_route('/api/library/files', methods=['GET', 'POST'])
+async def get_user_files(request: Request):
+    """Get all files in a user's library."""
+    try:
+        user_id = await _library_user_id(request)
+        if not user_id:
+            logger.error("User ID is required")
+            return JSONResponse({'error': 'User ID is required'}, status_code=400)
+
+        files = await chat_manager.scholar_agent.get_user_library_files_async(user_id)
+        if not files:
+            logger.warning(f"No files found for user {user_id}")
+            return JSONResponse({'files': []})
+
+        logger.info(f"Found {len(files)} files for user {user_id}")
+        processed_files = [
+            {
+                'id': file.get('id', ''),
+                'file_name': file.get('file_name', ''),
+                'file_type': file.get('file_type', 'application/octet-stream'),
+                'created_at': file.get('created_at', ''),
+                'url': file.get('url', '')
+            }
+            for file in files
+        ]
+        return JSONResponse({'status': 'success', 'files': processed_files})
+
+    except Exception as e:
+        logger.error(f"Error in get_user_files endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'status': 'error', 'error': str(e)}, status_code=500)
+
+
+@app.api_route('/api/library/files/{file_id}', methods=['GET', 'POST'])
+async def get_file_details(file_id: str, request: Request):
+    """Get details of a specific file."""
+    try:
+        user_id = await _library_user_id(request)
+        if not user_id:
+            logger.error("User ID is required")
+            return JSONResponse({'error': 'User ID is required'}, status_code=400)
+
+        file_details = await chat_manager.scholar_agent.get_file_details_async(user_id, file_id)
+        if not file_details:
+            logger.warning(f"File {file_id} not found for user {user_id}")
+            return JSONResponse({'error': 'File not found'}, status_code=404)
+
+        logger.info(f"Found file details for {file_id}")
+        return JSONResponse(jsonable_encoder({'status': 'success', 'file': file_details}))
+
+    except Exception as e:
+        logger.error(f"Error in get_file_details endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'status': 'error', 'error': str(e)}, status_code=500)
+
+
+@app.delete('/api/library/files/{file_id}/delete')
+async def delete_file(file_id: str, request: Request):
+    """Delete a file from the user's library."""
+    try:
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return JSONResponse({'error': 'User ID is required'}, status_code=400)
+
+        # Rare, and moves shared content between keys in several steps; left on the executor
+        loop = asyncio.get_running_loop()
+        success = await loop.run_in_executor(None, chat_manager.scholar_agent.delete_file, user_id, file_id)
+        if not success:
+            return JSONResponse({'error': 'Failed to delete file'}, status_code=500)
+        return JSONResponse({'message': 'File deleted successfully'})
+
+    except Exception as e:
+        logger.error(f"Error in delete_file endpoint: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.post('/api/library/check_status')
+async def check_library_status(request: Request):
+    """Checks if multiple papers (by URL) exist in a user's library."""
+    try:
+        data = await _json_body(request) or {}
+        user_id = data.get('user_id')
+        paper_urls = data.get('paper_urls')
+        if not user_id:
+            return JSONResponse({'status': 'error', 'message': 'User ID required'}, status_code=400)
+        if not paper_urls or not isinstance(paper_urls, list):
+            return JSONResponse({'status': 'error', 'message': 'List of paper_urls required'}, status_code=400)
+
+        status_dict = await chat_manager.scholar_agent.check_library_status_async(user_id, paper_urls)
+        return JSONResponse({'status': 'success', 'library_status': status_dict})
+
+    except Exception as e:
+        logger.error(f"Error in check_library_status endpoint: {str(e)}", exc_info=True)
+        return JSONResponse({'status': 'error', 'message': f'Server error: {str(e)}'}, status_code=500)
+
+
+@app.get('/api/library/files/{file_id}/url')
+async def get_library_file_url(file_id: str, request: Request):
+    """Gets a presigned S3 URL for a file in the user's library."""
+    try:
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return JSONResponse({'status': 'error', 'message': 'User ID required'}, status_code=400)
+
+        presigned_url = await chat_manager.scholar_agent.get_presigned_url_for_file_async(user_id, file_id)
+        if presigned_url:
+            return JSONResponse({'status': 'success', 'url': presigned_url})
+        return JSONResponse({'status': 'error', 'message': 'File not found or access denied'}, status_code=404)
+
+    except Exception as e:
+        logger.error(f"Error in get_library_file_url endpoint for file {file_id}: {str(e)}", exc_info=True)
+        return JSONResponse({'status': 'error', 'message': f'Server error: {str(e)}'}, status_code=500)
+
+
+# Everything else (citations, chat history, frontend) is served by the Flask app
+app.mount('/', WSGIMiddleware(flask_app))
@@ -8,18 +8,32 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context, url_for
 from flask_cors import CORS
 import uuid
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 import logging
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 import psycopg2
 import time
+import threading
 import asyncio
+import contextvars
+import functools
+import json
 from backend.context_agent import ContextAgent as CA # Ensure context_agent is initialized
+from backend.response_cache import ResponseCache
+from backend.paper_metadata import get_metadata_hydrator
+from backend.ingestion_jobs import workers_in_process
+from models.prompt_packer import PromptPacker
+from utils.startup import lazy_component, start_warmup, timed_init, get_startup_report
+from utils.http import close_async_client, closing_async_client
+from utils.metrics import (
+    start_request_timings, get_request_timings, record_stage, stage_timer, upstream_call,
+    server_timing_header, observe_request, metrics_payload, instrumented_cursor_factory
+)
 
 # Load environment variables
 load_dotenv()
@@ -34,6 +48,7 @@ try:
     from agents.citation_agent.agent import CitationAgent
     from agents.factcheck_agent.agent import FactCheckAgent
     from agents.context_agent.agent import ContextAgent
+    from agents.scholar_agent.utils import decode_cursor
 except ModuleNotFoundError:
     # Add the project root directory to the Python path
     import sys
@@ -46,52 +61,206 @@ except ModuleNotFoundError:
     from agents.citation_agent.agent import CitationAgent
     from agents.factcheck_agent.agent import FactCheckAgent
     from agents.context_agent.agent import ContextAgent
+    from agents.scholar_agent.utils import decode_cursor
 
-app = Flask(__name__)
+class _Flask(Flask):
+    def async_to_sync(self, func):
+        # Each async view runs on its own event loop; close the HTTP client it opened before the loop goes
+        async def run(*args, **kwargs):
+            return await closing_async_client(func(*args, **kwargs))
+        return super().async_to_sync(run)
+
+
+app = _Flask(__name__)
 CORS(app)
 
 # Configure upload folder
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'txt'}
+# Largest page /api/papers/search will return
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '50'))
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+@app.before_request
+def _start_request_timing():
+    g.request_started = time.perf_counter()
+    start_request_timings()
+
+@app.after_request
+def _add_server_timing(response):
+    """Report per-stage timings in a Server-Timing header and record the request latency."""
+    started = g.get('request_started')
+    if started is None:
+        return response
+    total = time.perf_counter() - started
+    # A streamed body hasn't run yet, so its timings go in a trailing event instead
+    if not response.is_streamed:
+        response.headers['Server-Timing'] = server_timing_header(get_request_timings(), total)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_request(request.method, route, response.status_code, total)
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _ndjson_line(data: Dict[str, Any]) -> str:
+    """Format one record of a newline-delimited JSON stream."""
+    return json.dumps(data, default=str) + "\n"
+
+def _search_params(data: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+    """Page size and cursor of a paper search request; raises ValueError if either is invalid."""
+    limit = max(1, min(int(data.get('limit') or 10), SEARCH_MAX_PAGE_SIZE))
+    cursor = data.get('cursor') or None
+    if cursor is not None:
+        decode_cursor(str(cursor))
+    return limit, cursor
+
+def _iter_async_generator(agen):
+    """Drive an async generator from a sync Flask streaming response on its own event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(close_async_client())
+        # Anything the generator left running would be destroyed pending with the loop
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+async def _timed_chat_events(events: AsyncIterator[Tuple[str, Dict[str, Any]]], timings: Dict[str, float]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Pass chat stream events through, adding a 'timing' event just before 'done' with the
+    Server-Timing value a buffered response would have had. `timings` must be the request's
+    collector (start_request_timings) in the context the stream runs in."""
+    started = time.perf_counter()
+    async for event, payload in events:
+        if event == 'done':
+            yield 'timing', {'server_timing': server_timing_header(timings, time.perf_counter() - started)}
+        yield event, payload
+
 class ChatManager:
+    # Deadline (seconds) for each stage of process_message; a stage that misses it
+    # is dropped from the response instead of holding up the whole request.
+    STAGE_TIMEOUTS = {
+        'factcheck': float(os.getenv('CHAT_FACTCHECK_TIMEOUT', '10')),
+        'search': float(os.getenv('CHAT_SEARCH_TIMEOUT', '15')),
+        'citations': float(os.getenv('CHAT_CITATIONS_TIMEOUT', '5')),
+        'uploads': float(os.getenv('CHAT_UPLOADS_TIMEOUT', '5')),
+    }
+    CHAT_MODEL = "gpt-3.5-turbo"
+    OPENAI_UNAVAILABLE_TEXT = "Error: AI service is unavailable."
+    OPENAI_ERROR_TEXT = "I encountered an error while generating the response."
+    # Built by the background warm-up when CHAT_WARMUP is enabled, in this order
+    WARMUP_COMPONENTS = ('openai_client', 'factcheck_agent', 'prompt_packer', 'citation_agent', 'context_agent', 'scholar_agent')
+
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+
+        # Run independent process_message stages concurrently (set to false to run them in sequence)
+        self.concurrent_stages = os.getenv('CHAT_CONCURRENT_STAGES', 'true').lower() == 'true'
         
-        # Initialize agents
-        self.scholar_agent = ScholarAgent()
-        self.citation_agent = CitationAgent()
-        self.factcheck_agent = FactCheckAgent()
-        self.context_agent = ContextAgent()
-        
+        # Agents, the prompt packer, the DB connection and the OpenAI client are built
+        # on first use (see the lazy_component properties below), so importing this
+        # module doesn't touch the network; each build is timed into the startup report.
+
         # Store chat sessions
         self.chat_sessions = {}
 
-        # Initialize DB connection
+        # Token budget for the query plus search/upload context in the chat prompt
+        self.prompt_token_budget = int(os.getenv('CHAT_PROMPT_TOKEN_BUDGET', '1800'))
+
+        # Cache for chat answers: exact prompt matches plus near-duplicate questions
+        self.response_cache = None
+        if os.getenv('CHAT_CACHE_ENABLED', 'true').lower() == 'true':
+            self.response_cache = ResponseCache(
+                max_entries=int(os.getenv('CHAT_CACHE_MAX_ENTRIES', '1000')),
+                ttl_seconds=float(os.getenv('CHAT_CACHE_TTL', '3600')),
+                similarity_threshold=float(os.getenv('CHAT_CACHE_SIMILARITY', '0.95'))
+            )
+
         self.db_conn = None
-        try:
-            self._ensure_db_connection()
-        except Exception as e:
-            self.logger.warning(f"Failed to connect to database, continuing without database support: {str(e)}")
-            self.db_conn = None
+        self._db_retry_at = 0.0
+
+        # Optionally build everything in the background right away instead of on the first request
+        if os.getenv('CHAT_WARMUP', 'false').lower() == 'true':
+            start_warmup(self, self.WARMUP_COMPONENTS)
+
+    def start_ingestion_workers(self) -> Optional[threading.Thread]:
+        """Build the scholar agent, which starts this process's ingestion workers, in the background.
+        Called when a server starts (not on import), so jobs queued before a restart don't wait
+        for the first scholar request."""
+        if workers_in_process() > 0:
+            return start_warmup(self, ('scholar_agent',))
+        return None
+
+    @lazy_component
+    def scholar_agent(self) -> ScholarAgent:
+        return ScholarAgent()
+
+    @lazy_component
+    def citation_agent(self) -> CitationAgent:
+        return CitationAgent()
+
+    @lazy_component
+    def factcheck_agent(self) -> FactCheckAgent:
+        return FactCheckAgent()
 
-        # Initialize OpenAI client once
+    @lazy_component
+    def context_agent(self) -> ContextAgent:
+        return ContextAgent()
+
+    @lazy_component
+    def prompt_packer(self) -> PromptPacker:
+        # Same cl100k_base encoder FactCheckAgent uses
+        return PromptPacker(self.factcheck_agent.tokenizer)
+
+    @lazy_component
+    def openai_client(self):
         try:
             from openai import AsyncOpenAI
-            self.openai_client = AsyncOpenAI() 
+            client = AsyncOpenAI()
             self.logger.info("OpenAI client initialized successfully.")
+            return client
         except ImportError:
             self.logger.error("OpenAI library not found. Please install openai.")
-            self.openai_client = None
+            raise
         except Exception as e:
-             self.logger.error(f"Failed to initialize OpenAI client: {e}", exc_info=True)
-             self.openai_client = None
+            self.logger.error(f"Failed to initialize OpenAI client: {e}", exc_info=True)
+            raise
+
+    def _get_openai_client(self):
+        """The OpenAI client, or None if it can't be built right now (retried on the next call)."""
+        try:
+            return self.openai_client
+        except Exception:
+            return None
+
+    def _get_db_connection(self):
+        """Return the database connection, connecting on first use; None if the database is unreachable."""
+        if self.db_conn and not self.db_conn.closed:
+            return self.db_conn
+        # After a failed attempt, don't make every request wait on the connect timeout again
+        if time.monotonic() < self._db_retry_at:
+            return None
+        try:
+            timed_init('database', self._ensure_db_connection)
+        except Exception as e:
+            self.logger.warning(f"Failed to connect to database, continuing without database support: {str(e)}")
+            self.db_conn = None
+            self._db_retry_at = time.monotonic() + float(os.getenv('DB_RETRY_INTERVAL', '30'))
+        return self.db_conn
 
     def _ensure_db_connection(self) -> None:
         """Ensure database connection is established."""
@@ -102,7 +271,9 @@ class ChatManager:
                     port=os.getenv('DB_PORT', '5432'),
                     dbname=os.getenv('DB_NAME', 'thesys_ai'),
                     user=os.getenv('DB_USER', 'postgres'),
-                    password=os.getenv('DB_PASSWORD')
+                    password=os.getenv('DB_PASSWORD'),
+                    connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+                    cursor_factory=instrumented_cursor_factory('chat')
                 )
                 self.db_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
                 self.logger.info("Successfully connected to database")
@@ -115,18 +286,41 @@ class ChatManager:
         """Process a message using vector context, including temperature setting."""
         try:
             self.logger.info(f"Processing message for user {user_id} with temp {temperature}.")
-            
-            # Fact-check the message
-            fact_check_result = self.factcheck_agent.verify_claim(message)
+            degraded: Dict[str, str] = {}
+
+            # A repeat of a recent question reuses its answer and skips search and generation
+            cached_response = self._exact_cached_response(message, user_id, temperature)
+            if cached_response:
+                return {**cached_response, 'cached': True}
+
+            # Fact-check, paper search (+ citations) and the uploaded-summary lookup are
+            # independent, so in concurrent mode they run side by side and the request
+            # costs roughly the slowest stage instead of the sum of all of them. The
+            # near-duplicate lookup has to embed the message, so it runs alongside them
+            # too rather than in front of them; a hit cancels the stages.
+            if self.concurrent_stages:
+                lookup = asyncio.ensure_future(self._lookup_cached_response(message, user_id, temperature))
+                stages = [asyncio.ensure_future(stage) for stage in self._chat_stages(message, user_id, degraded)]
+                try:
+                    message_vector, cached_response = await lookup
+                    if cached_response:
+                        return {**cached_response, 'cached': True}
+                    fact_check_result, (papers, citations), uploaded_summaries = await asyncio.gather(*stages)
+                finally:
+                    for task in stages:
+                        task.cancel()
+                    await asyncio.gather(*stages, return_exceptions=True)
+            else:
+                message_vector, cached_response = await self._lookup_cached_response(message, user_id, temperature)
+                if cached_response:
+                    return {**cached_response, 'cached': True}
+                factcheck_stage, search_stage, uploads_stage = self._chat_stages(message, user_id, degraded)
+                fact_check_result = await factcheck_stage
+                papers, citations = await search_stage
+                uploaded_summaries = await uploads_stage
             self.logger.info(f"Fact check result: {fact_check_result}")
-            
-            # Search for relevant papers
-            papers = await self.scholar_agent.search_papers(message)
             self.logger.info(f"Found {len(papers)} papers via search")
             
-            # Generate citations for searched papers
-            citations = [self.citation_agent.generate_citation(p, 'apa') for p in papers]
-            
             # Prepare raw data (searched papers)
             raw_response_data = {
                 'papers': papers,
@@ -139,12 +333,13 @@ class ChatManager:
                 user_id=user_id,
                 user_message=message,
                 raw_data=raw_response_data,
-                temperature=temperature
+                temperature=temperature,
+                uploaded_summaries=uploaded_summaries
             )
             self.logger.info(f"Formatted response length: {len(formatted_response_text)} chars")
             
             # Vectorize and prepare final response (as before)
-            response_vector = self.factcheck_agent._vectorize_text(formatted_response_text)
+            response_vector = await self._run_stage('vectorize', self._call_component, 'factcheck_agent', '_vectorize_text_async', formatted_response_text)
             if response_vector is not None:
                 response_vector = response_vector.tolist()
                 self.logger.info(f"Generated response vector of dimension {len(response_vector)}")
@@ -155,8 +350,13 @@ class ChatManager:
             final_response = {
                 'text': formatted_response_text,
                 'raw_data': raw_response_data, # Keep original raw data
-                'response_vector': response_vector
+                'response_vector': response_vector,
+                'partial': bool(degraded),
+                'degraded_stages': degraded
             }
+
+            if not degraded:
+                self._cache_response(message, user_id, temperature, message_vector, final_response)
             
             return final_response
             
@@ -169,86 +369,343 @@ class ChatManager:
                 'response_vector': None
             }
 
-    async def _format_response_with_openai(self, user_id: str, user_message: str, raw_data: Dict[str, Any], temperature: float) -> str:
+    async def _run_stage(self, name: str, func, *args, default: Any = None, degraded: Optional[Dict[str, str]] = None) -> Any:
+        """Run one process_message stage under its deadline from STAGE_TIMEOUTS.
+
+        Blocking callables are moved to the default executor so they don't stall the
+        event loop. On timeout or error the stage's default is returned and the
+        reason is recorded in `degraded` so the caller can return a partial result.
+        """
+        timeout = self.STAGE_TIMEOUTS.get(name)
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                awaitable = func(*args)
+            else:
+                awaitable = self._run_blocking(func, *args)
+            return await asyncio.wait_for(awaitable, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Stage '{name}' exceeded its {timeout}s deadline, continuing without it")
+            if degraded is not None:
+                degraded[name] = 'timeout'
+            return default
+        except Exception as e:
+            self.logger.error(f"Stage '{name}' failed: {str(e)}", exc_info=True)
+            if degraded is not None:
+                degraded[name] = 'error'
+            return default
+        finally:
+            record_stage(name, time.perf_counter() - started)
+
+    def _chat_stages(self, message: str, user_id: str, degraded: Dict[str, str]) -> List[Any]:
+        """Coroutines for the fact-check, search (+ citations) and uploaded-summary stages, in that order."""
+        return [
+            self._run_stage('factcheck', self._call_component, 'factcheck_agent', 'verify_claim_async', message,
+                            default={'status': 'unknown'}, degraded=degraded),
+            self._search_and_cite(message, degraded),
+            self._run_stage('uploads', self._get_uploaded_file_summaries, user_id, default=[], degraded=degraded),
+        ]
+
+    def _exact_cached_response(self, message: str, user_id: str, temperature: float) -> Optional[Dict[str, Any]]:
+        """The user's cached answer to the same question (after normalization), without embedding it."""
+        if not self.response_cache:
+            return None
+        cached_response = self.response_cache.get(self.response_cache.make_key(message, self.CHAT_MODEL, temperature, scope=user_id))
+        if cached_response:
+            self.logger.info(f"Serving cached response for a repeated question from user {user_id}")
+        return cached_response
+
+    async def _lookup_cached_response(self, message: str, user_id: str, temperature: float) -> Tuple[Optional[Any], Optional[Dict[str, Any]]]:
+        """Embed the message and look for the user's cached answer to a near-duplicate question.
+
+        Returns the message vector (reused when caching the new answer) and the cached
+        response, if any. Answers are only reused for the user who asked: they can be
+        built from that user's uploads, and one user's question shouldn't answer another's.
+        """
+        if not self.response_cache:
+            return None, None
+        message_vector = await self._run_stage('vectorize', self._call_component, 'factcheck_agent', '_vectorize_text_async', message)
+        cached_response = self.response_cache.get_similar(message_vector, self.CHAT_MODEL, temperature, scopes=(user_id,))
+        if cached_response:
+            self.logger.info(f"Serving cached response for a near-duplicate question from user {user_id}")
+        return message_vector, cached_response
+
+    def _cache_response(self, message: str, user_id: str, temperature: float, message_vector: Optional[Any], response: Dict[str, Any]) -> None:
+        """Store a successful answer for the user's repeated and near-duplicate questions."""
+        if not self.response_cache or message_vector is None:
+            return
+        if response.get('text') in (self.OPENAI_UNAVAILABLE_TEXT, self.OPENAI_ERROR_TEXT):
+            return
+        key = self.response_cache.make_key(message, self.CHAT_MODEL, temperature, scope=user_id)
+        self.response_cache.set(key, response, self.CHAT_MODEL, temperature, vector=message_vector, scope=user_id)
+
+    async def _search_and_cite(self, message: str, degraded: Dict[str, str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Search for papers, then generate citations for whatever the search returned."""
+        papers = await self._run_stage('search', self._call_component, 'scholar_agent', 'search_papers', message, default=[], degraded=degraded)
+        if not papers:
+            return [], []
+        citations = await self._run_stage('citations', self._generate_citations, papers, default=[], degraded=degraded)
+        return papers, citations
+
+    def _generate_citations(self, papers: List[Dict[str, Any]]) -> List[str]:
+        """Generate APA citations for searched papers."""
+        return [self.citation_agent.generate_citation(p, 'apa') for p in papers]
+
+    def _get_uploaded_file_summaries(self, user_id: str) -> List[str]:
+        """Fetch summaries of the user's most recently uploaded files."""
+        uploaded_files_summaries = []
+        try:
+            db_conn = self._get_db_connection()
+            if not db_conn:
+                self.logger.warning("No database connection, skipping uploaded file summaries")
+                return uploaded_files_summaries
+            with db_conn.cursor() as cur:
+                # Fetch summary for the 3 most recent non-null summaries for this user
+                sql = """
+                    SELECT file_name, summary 
+                    FROM user_files 
+                    WHERE user_id = %s AND summary IS NOT NULL
+                    ORDER BY created_at DESC
+                    LIMIT 3
+                """
+                with stage_timer('db'):
+                    cur.execute(sql, (user_id,))
+                    results = cur.fetchall()
+                for row in results:
+                    file_name, summary_text = row
+                    if summary_text:
+                        uploaded_files_summaries.append(f"File: {file_name}\nSummary: {summary_text}")
+            self.logger.info(f"Fetched {len(uploaded_files_summaries)} summaries for uploaded files for user {user_id}")
+        except Exception as db_err:
+             self.logger.error(f"Error fetching uploaded file summaries from DB for user {user_id}: {db_err}", exc_info=True)
+        return uploaded_files_summaries
+
+    async def _component(self, name: str) -> Any:
+        """A lazy component, built in the executor if it isn't yet: on a cold worker building an agent
+        (models, boto3, DB connections) takes seconds and must not stall the event loop."""
+        if lazy_component.is_loaded(self, name):
+            return getattr(self, name)
+        return await self._run_blocking(getattr, self, name)
+
+    async def _call_component(self, name: str, method: str, *args: Any) -> Any:
+        """Await a lazy component's coroutine method, building the component first (see _component).
+        As a stage function, the stage's deadline and default cover the build too."""
+        return await getattr(await self._component(name), method)(*args)
+
+    async def _run_blocking(self, func, *args: Any) -> Any:
+        """Run func in the default executor with the request context (so timings recorded there count).
+        Prompt packing goes through here: with MODEL_SERVER_SOCKET set every token count is a
+        blocking socket round trip, which must not stall the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args))
+
+    def _build_chat_messages(self, user_message: str, raw_data: Dict[str, Any], uploaded_summaries: List[str]) -> List[Dict[str, str]]:
+        """Build the OpenAI chat messages from searched papers and uploaded file summaries."""
+        # Prepare summaries of *searched* papers
+        paper_summaries_searched = []
+        for paper in raw_data.get('papers', []):
+            authors = ', '.join(paper.get('authors', [])[:5])
+            authors_str = f"{authors}{' et al.' if len(paper.get('authors', [])) > 5 else ''}"
+            summary_text = f"Title: {paper.get('title', '')}\nAuthors: {authors_str}\nYear: {paper.get('year', '')}\nAbstract: {paper.get('abstract', '')}"
+            paper_summaries_searched.append(summary_text)
+
+        # Keep the most relevant papers and upload summaries that fit the token budget,
+        # trimming the last one that doesn't fit whole
+        user_message, packed = self.prompt_packer.pack(
+            user_message,
+            {'papers': paper_summaries_searched, 'uploads': uploaded_summaries or []},
+            self.prompt_token_budget
+        )
+        searched_papers_prompt_section = chr(10).join(packed['papers']) if packed['papers'] else 'No specific papers found via search related to this query.'
+        uploaded_files_prompt_section = chr(10).join(packed['uploads']) if packed['uploads'] else 'No relevant file summaries found from your recent uploads.'
+
+        # Prepare prompt including both searched and uploaded summaries
+        prompt = (
+            f"Provide a comprehensive response to the query based *only* on the user's current message, "
+            f"the provided research summaries from search, and summaries from recently uploaded files.\n\n"
+            f"User Query: {user_message}\n\n"
+            f"Relevant Research Summaries (from Search):\n"
+            f"{searched_papers_prompt_section}\n\n"
+            f"Relevant Summaries (from Your Uploads):\n"
+            f"{uploaded_files_prompt_section}\n\n"
+            f"Guidelines:\n"
+            f"- Address the user's current query directly.\n"
+            f"- Integrate findings from both searched research and uploaded file summaries if relevant.\n"
+            f"- Cite papers (Author, Year) if used from the search results.\n"
+            f"- Refer to uploaded files by name if using their summaries.\n"
+            f"- Explain concepts clearly.\n"
+            f"- Structure the response logically.\n"
+            f"- Aim for a response length of 400-600 words."
+        )
+
+        return [
+            {"role": "system", "content": "You are a research assistant answering queries based on the current message, article summaries from search, and summaries from the user's uploaded files. Do not refer to past interactions."},
+            {"role": "user", "content": prompt}
+        ]
+
+    async def _format_response_with_openai(self, user_id: str, user_message: str, raw_data: Dict[str, Any], temperature: float, uploaded_summaries: Optional[List[str]] = None) -> str:
         """Format response using OpenAI, including summaries and temperature setting."""
-        if not self.openai_client:
+        openai_client = self._get_openai_client()
+        if not openai_client:
              self.logger.error("OpenAI client not initialized. Cannot format response.")
-             return "Error: AI service is unavailable."
+             return self.OPENAI_UNAVAILABLE_TEXT
         
         try:
-            # Prepare summaries of *searched* papers (as before)
-            paper_summaries_searched = []
-            num_papers_to_include = min(len(raw_data.get('papers', [])), 3)
-            for paper in raw_data['papers'][:num_papers_to_include]:
-                title = paper['title'][:150] + '...' if len(paper['title']) > 150 else paper['title']
-                abstract = paper['abstract'][:400] + '...' if len(paper['abstract']) > 400 else paper['abstract']
-                authors = ', '.join(paper['authors'][:5])
-                authors_str = f"{authors}{' et al.' if len(paper['authors']) > 5 else ''}"
-                summary_text = f"Title: {title}\nAuthors: {authors_str}\nYear: {paper['year']}\nAbstract Snippet: {abstract}"
-                paper_summaries_searched.append(summary_text)
-            searched_papers_prompt_section = chr(10).join(paper_summaries_searched) if paper_summaries_searched else 'No specific papers found via search related to this query.'
-
-            # --- NEW: Fetch summaries of recently uploaded files --- 
-            uploaded_files_summaries = []
-            try:
-                with self.db_conn.cursor() as cur:
-                    # Fetch summary for the 3 most recent non-null summaries for this user
-                    sql = """
-                        SELECT file_name, summary 
-                        FROM user_files 
-                        WHERE user_id = %s AND summary IS NOT NULL
-                        ORDER BY created_at DESC
-                        LIMIT 3
-                    """
-                    cur.execute(sql, (user_id,))
-                    results = cur.fetchall()
-                    for row in results:
-                        file_name, summary_text = row
-                        if summary_text:
-                            uploaded_files_summaries.append(f"File: {file_name}\nSummary: {summary_text}")
-                self.logger.info(f"Fetched {len(uploaded_files_summaries)} summaries for uploaded files for user {user_id}")
-            except Exception as db_err:
-                 self.logger.error(f"Error fetching uploaded file summaries from DB for user {user_id}: {db_err}", exc_info=True)
-            uploaded_files_prompt_section = chr(10).join(uploaded_files_summaries) if uploaded_files_summaries else 'No relevant file summaries found from your recent uploads.'
-            # --- END NEW SECTION --- 
-
-            # Prepare prompt including both searched and uploaded summaries
-            prompt = (
-                f"Provide a comprehensive response to the query based *only* on the user's current message, "
-                f"the provided research summaries from search, and summaries from recently uploaded files.\n\n"
-                f"User Query: {user_message}\n\n"
-                f"Relevant Research Summaries (from Search):\n"
-                f"{searched_papers_prompt_section}\n\n"
-                f"Relevant Summaries (from Your Uploads):\n"
-                f"{uploaded_files_prompt_section}\n\n"
-                f"Guidelines:\n"
-                f"- Address the user's current query directly.\n"
-                f"- Integrate findings from both searched research and uploaded file summaries if relevant.\n"
-                f"- Cite papers (Author, Year) if used from the search results.\n"
-                f"- Refer to uploaded files by name if using their summaries.\n"
-                f"- Explain concepts clearly.\n"
-                f"- Structure the response logically.\n"
-                f"- Aim for a response length of 400-600 words."
-            )
+            # Summaries of recently uploaded files (fetched concurrently by process_message)
+            if uploaded_summaries is None:
+                uploaded_summaries = await self._run_blocking(self._get_uploaded_file_summaries, user_id)
+            messages = await self._run_blocking(self._build_chat_messages, user_message, raw_data, uploaded_summaries)
+
+            # Identical prompts (same papers, uploads and question) reuse the previous completion
+            cache_key = None
+            if self.response_cache:
+                cache_key = self.response_cache.make_key(messages[-1]['content'], self.CHAT_MODEL, temperature)
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    self.logger.info("Serving cached OpenAI response for an identical prompt")
+                    return cached_text
 
             self.logger.info(f"Sending prompt to OpenAI (Temp: {temperature})")
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a research assistant answering queries based on the current message, article summaries from search, and summaries from the user's uploaded files. Do not refer to past interactions."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=temperature,
-                max_tokens=2000
-            )
+            with stage_timer('openai'), upstream_call('chat', 'openai'):
+                response = await openai_client.chat.completions.create(
+                    model=self.CHAT_MODEL,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=2000
+                )
             gpt_response = response.choices[0].message.content
             self.logger.info(f"GPT Response length: {len(gpt_response)} chars")
+
+            if cache_key and gpt_response:
+                self.response_cache.set(cache_key, gpt_response, self.CHAT_MODEL, temperature)
             
             return gpt_response
             
         except Exception as e:
             self.logger.error(f"Error formatting response with OpenAI: {str(e)}", exc_info=True)
-            return "I encountered an error while generating the response."
+            return self.OPENAI_ERROR_TEXT
+
+    async def _stream_response_with_openai(self, user_message: str, raw_data: Dict[str, Any], temperature: float, uploaded_summaries: List[str]) -> AsyncIterator[str]:
+        """Stream the formatted response from OpenAI, yielding text deltas as they arrive."""
+        openai_client = self._get_openai_client()
+        if not openai_client:
+            self.logger.error("OpenAI client not initialized. Cannot format response.")
+            yield self.OPENAI_UNAVAILABLE_TEXT
+            return
+
+        messages = await self._run_blocking(self._build_chat_messages, user_message, raw_data, uploaded_summaries)
+        self.logger.info(f"Streaming prompt to OpenAI (Temp: {temperature})")
+        # Timed until the last token arrives
+        with stage_timer('openai'), upstream_call('chat', 'openai'):
+            stream = await openai_client.chat.completions.create(
+                model=self.CHAT_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=2000,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+
+    async def stream_message(self, message: str, user_id: str, temperature: float) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Process a message like process_message, yielding (event, data) pairs as each part is ready.
+
+        Papers and citations are sent as soon as search returns, followed by the OpenAI
+        tokens as they stream in, and the response vector last.
+        """
+        self.logger.info(f"Streaming message for user {user_id} with temp {temperature}.")
+        degraded: Dict[str, str] = {}
+
+        cached_response = self._exact_cached_response(message, user_id, temperature)
+        if cached_response:
+            for item in self._cached_events(cached_response):
+                yield item
+            return
+
+        # The stages start while the message is embedded for the near-duplicate lookup
+        lookup = asyncio.ensure_future(self._lookup_cached_response(message, user_id, temperature))
+        factcheck_stage, search_stage, uploads_stage = self._chat_stages(message, user_id, degraded)
+        tasks = {
+            asyncio.ensure_future(factcheck_stage): 'fact_check',
+            asyncio.ensure_future(search_stage): 'papers',
+            asyncio.ensure_future(uploads_stage): 'uploads',
+        }
+        results: Dict[str, Any] = {}
+        try:
+            message_vector, cached_response = await lookup
+            if cached_response:
+                for item in self._cached_events(cached_response):
+                    yield item
+                return
+
+            # Send each stage as it finishes; the prompt only needs papers and uploads,
+            # so generation starts without waiting for the fact check.
+            pending = set(tasks)
+            while 'papers' not in results or 'uploads' not in results:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = tasks[task]
+                    results[name] = task.result()
+                    if name == 'papers':
+                        papers, citations = results[name]
+                        yield 'papers', {'papers': papers, 'citations': citations}
+                    elif name == 'fact_check':
+                        yield 'fact_check', results[name]
+
+            papers, citations = results['papers']
+            raw_response_data = {'papers': papers, 'citations': citations}
+            text_parts: List[str] = []
+            try:
+                async for delta in self._stream_response_with_openai(message, raw_response_data, temperature, results['uploads']):
+                    text_parts.append(delta)
+                    yield 'token', {'text': delta}
+            except Exception as e:
+                self.logger.error(f"Error streaming response from OpenAI: {str(e)}", exc_info=True)
+                yield 'error', {'error': self.OPENAI_ERROR_TEXT}
+                degraded['openai'] = 'error'
+            formatted_response_text = ''.join(text_parts)
+
+            # Only the fact check can still be running at this point
+            for task in pending:
+                results[tasks[task]] = await task
+                yield 'fact_check', results[tasks[task]]
+
+            response_vector = await self._run_stage('vectorize', self._call_component, 'factcheck_agent', '_vectorize_text_async', formatted_response_text) if formatted_response_text else None
+            response_vector = response_vector.tolist() if response_vector is not None else None
+            yield 'vector', {'response_vector': response_vector}
+
+            if not degraded:
+                raw_response_data['fact_check'] = results['fact_check']
+                self._cache_response(message, user_id, temperature, message_vector, {
+                    'text': formatted_response_text,
+                    'raw_data': raw_response_data,
+                    'response_vector': response_vector,
+                    'partial': False,
+                    'degraded_stages': {}
+                })
+            yield 'done', {'partial': bool(degraded), 'degraded_stages': degraded}
+        finally:
+            lookup.cancel()
+            for task in tasks:
+                task.cancel()
+            # Let the cancellations finish before the caller's loop can close (e.g. on a client disconnect)
+            await asyncio.gather(lookup, *tasks, return_exceptions=True)
+
+    @staticmethod
+    def _cached_events(cached_response: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """stream_message events replaying a cached answer."""
+        raw_data = cached_response.get('raw_data', {})
+        return [
+            ('papers', {'papers': raw_data.get('papers', []), 'citations': raw_data.get('citations', [])}),
+            ('fact_check', raw_data.get('fact_check', {})),
+            ('token', {'text': cached_response.get('text', '')}),
+            ('vector', {'response_vector': cached_response.get('response_vector')}),
+            ('done', {'partial': False, 'degraded_stages': {}, 'cached': True}),
+        ]
 
     def get_chat_history(self, user_id: str) -> List[Dict[str, Any]]:
         """Get chat history for a user."""
@@ -275,11 +732,21 @@ class ChatManager:
             self.logger.error(f"Error verifying claim: {str(e)}")
             return {'error': str(e)}
 
-    async def search_papers(self, query: str, user_id: Optional[str] = None) -> Dict[str, Any]:
-        """Search for papers and generate citations."""
+    async def verify_claim_async(self, claim: str, user_id: Optional[str]) -> Dict[str, Any]:
+        """verify_claim for the native route; only the user-context lookup needs a thread."""
+        try:
+            context = await self._run_blocking(self.context_agent.get_user_context, user_id) if user_id else None
+            return await self._call_component('factcheck_agent', 'verify_claim_async', claim, context)
+        except Exception as e:
+            self.logger.error(f"Error verifying claim: {str(e)}")
+            return {'error': str(e)}
+
+    async def search_papers(self, query: str, user_id: Optional[str] = None, limit: int = 10, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Search for a page of papers and generate citations; next_cursor fetches the following page."""
         try:
             # Search papers
-            papers = await self.scholar_agent.search_papers(query)
+            page = await self._call_component('scholar_agent', 'search_papers_page', query, limit, cursor)
+            papers = page['papers']
             self.logger.info(f"ChatManager found {len(papers)} papers for query: '{query}'")
 
             # Get user context if available
@@ -294,13 +761,32 @@ class ChatManager:
             return {
                 'papers': papers,
                 'citations': citations,
-                'context': context
+                'context': context,
+                'next_cursor': page['next_cursor']
             }
 
         except Exception as e:
             self.logger.error(f"Error searching papers in ChatManager: {str(e)}", exc_info=True)
             return {'error': str(e)}
 
+    async def stream_search_papers(self, query: str, user_id: Optional[str] = None, limit: int = 10, cursor: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming variant of search_papers.
+
+        Yields a 'papers' record (with citations) for each batch of hits as sources
+        return them, then a 'done' record with the user context and next_cursor.
+        """
+        total = 0
+        scholar_agent = await self._component('scholar_agent')
+        async for item in scholar_agent.search_papers_stream(query, limit, cursor):
+            if 'papers' in item:
+                total += len(item['papers'])
+                citations = [self.citation_agent.generate_citation(paper, style='apa') for paper in item['papers']]
+                yield {'type': 'papers', 'source': item['source'], 'papers': item['papers'], 'citations': citations}
+            else:
+                self.logger.info(f"ChatManager streamed {total} papers for query: '{query}'")
+                context = self.context_agent.get_user_context(user_id) if user_id else None
+                yield {'type': 'done', 'count': total, 'context': context, 'next_cursor': item['next_cursor']}
+
     def generate_citation(self, source: Dict[str, Any], style: str = 'apa') -> str:
         """Generate a citation for a source."""
         try:
@@ -323,6 +809,17 @@ chat_manager = ChatManager()
 context_agent = CA()
 
 # --- New Endpoints ---
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: request/stage latency histograms and upstream call counters."""
+    payload, content_type = metrics_payload()
+    return Response(payload, content_type=content_type)
+
+@app.route('/api/startup', methods=['GET'])
+def startup_report():
+    """Per-component initialization timings for this worker."""
+    return jsonify(get_startup_report())
+
 @app.route('/api/activity', methods=['GET'])
 async def get_activity():
     # TODO: Implement proper user authentication to get user_id
@@ -400,6 +897,39 @@ async def chat():
         logger.error(f"Error in chat endpoint: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /api/chat that sends Server-Sent Events as work finishes."""
+    user_id = "test_user"  # Placeholder for development
+
+    data = request.json
+    if not data:
+        logger.error("No JSON data received")
+        return jsonify({'error': 'No data provided'}), 400
+
+    message = data.get('message', '')
+    if not message:
+        logger.error("No message provided")
+        return jsonify({'error': 'Message is required'}), 400
+
+    temperature = float(data.get('temperature', 0.7))
+
+    def generate():
+        # The headers are already sent when this runs; stage timings go in the trailing 'timing' event
+        timings = start_request_timings()
+        try:
+            for event, payload in _iter_async_generator(_timed_chat_events(chat_manager.stream_message(message, user_id, temperature), timings)):
+                yield _sse_event(event, payload)
+        except Exception as e:
+            logger.error(f"Error in chat stream endpoint: {str(e)}", exc_info=True)
+            yield _sse_event('error', {'error': str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/factcheck', methods=['POST'])
 def factcheck():
     """Endpoint for fact-checking claims."""
@@ -442,7 +972,8 @@ def generate_citation():
 
 @app.route('/api/papers/search', methods=['POST'])
 async def search_papers():
-    """Endpoint for searching papers."""
+    """Endpoint for searching papers. Pass 'limit' for the page size and the returned
+    'next_cursor' as 'cursor' to fetch the next page."""
     try:
         data = request.json
         query = data.get('query')
@@ -450,9 +981,13 @@ async def search_papers():
         
         if not query:
             return jsonify({'error': 'Query is required'}), 400
+        try:
+            limit, cursor = _search_params(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Search papers using chat manager
-        result = await chat_manager.search_papers(query, user_id)
+        result = await chat_manager.search_papers(query, user_id, limit, cursor)
         
         return jsonify(result)
         
@@ -460,6 +995,52 @@ async def search_papers():
         logger.error(f"Error in search_papers endpoint: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/papers/search/stream', methods=['POST'])
+def search_papers_stream():
+    """Streaming variant of /api/papers/search: newline-delimited JSON, one record per batch of hits."""
+    data = request.json or {}
+    query = data.get('query')
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+    try:
+        limit, cursor = _search_params(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        try:
+            for record in _iter_async_generator(chat_manager.stream_search_papers(query, data.get('user_id'), limit, cursor)):
+                yield _ndjson_line(record)
+        except Exception as e:
+            logger.error(f"Error in search_papers stream endpoint: {str(e)}", exc_info=True)
+            yield _ndjson_line({'type': 'error', 'error': str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/papers/metadata', methods=['POST'])
+def hydrate_papers():
+    """Metadata (including citation counts) for a list of 'paper_ids' (DOIs, arXiv ids or
+    Semantic Scholar ids), fetched in batches rather than one request per paper."""
+    try:
+        data = request.json or {}
+        paper_ids = data.get('paper_ids')
+        if not paper_ids or not isinstance(paper_ids, list):
+            return jsonify({'status': 'error', 'message': 'List of paper_ids required'}), 400
+        max_ids = int(os.getenv('PAPER_METADATA_MAX_IDS', '500'))
+        if len(paper_ids) > max_ids:
+            return jsonify({'status': 'error', 'message': f'At most {max_ids} paper_ids per request'}), 400
+
+        papers = get_metadata_hydrator().hydrate([str(paper_id) for paper_id in paper_ids])
+        return jsonify({'status': 'success', 'papers': papers}), 200
+
+    except Exception as e:
+        logger.error(f"Error in hydrate_papers endpoint: {str(e)}", exc_info=True)
+        return jsonify({'status': 'error', 'message': f'Server error: {str(e)}'}), 500
+
 @app.route('/api/papers/upload', methods=['POST'])
 async def upload_paper():
     """Endpoint for uploading papers."""
@@ -483,20 +1064,22 @@ async def upload_paper():
         file_type = file.content_type or 'application/pdf'  # Default to PDF if not specified
         file_name = secure_filename(file.filename)
         
-        # Read file data
-        file_data = file.read()
-        
-        # Upload paper using scholar agent
+        # Upload paper using scholar agent; the file is streamed to S3 in parts rather than read into memory
         result = await chat_manager.scholar_agent.upload_paper(
             user_id=user_id,
-            file_data=file_data,
+            file_data=file.stream,
             file_name=file_name,
             file_type=file_type
         )
         
-        if 'error' in result:
-            logger.error(f"Error uploading paper: {result['error']}")
+        if 'error' in result or result.get('status') == 'error':
+            logger.error(f"Error uploading paper: {result.get('error') or result.get('message')}")
             return jsonify(result), 500
+
+        # Extraction and summary run in the background; poll the job's status URL
+        if result.get('status') == 'queued':
+            result['status_url'] = url_for('get_upload_job', job_id=result['job_id'], user_id=user_id)
+            return jsonify(result), 202
             
         return jsonify(result)
         
@@ -504,6 +1087,23 @@ async def upload_paper():
         logger.error(f"Error in upload_paper endpoint: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/papers/upload/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """Status of a background upload job: overall status plus per-stage progress (upload, extract, summarize, index)."""
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return jsonify({'status': 'error', 'message': 'User ID required'}), 400
+
+        job = chat_manager.scholar_agent.get_ingestion_job(user_id, job_id)
+        if job is None:
+            return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+        return jsonify({'status': 'success', 'job': job}), 200
+
+    except Exception as e:
+        logger.error(f"Error in get_upload_job endpoint: {str(e)}", exc_info=True)
+        return jsonify({'status': 'error', 'message': f'Server error: {str(e)}'}), 500
+
 @app.route('/api/library/files', methods=['GET', 'POST'])
 def get_user_files():
     """Get all files in a user's library."""
@@ -762,5 +1362,6 @@ def serve_frontend(path):
         return send_from_directory(frontend_folder, 'index.html')
 
 if __name__ == '__main__':
+    chat_manager.start_ingestion_workers()
     # Consider debug=False when serving static files this way in production
     app.run(debug=True, port=5000)
@@ -0,0 +1,233 @@
+"""
+Bulk load of an arXiv metadata snapshot into the papers table.
+
+Reads the snapshot (the JSON-lines dump arXiv publishes through Kaggle, one
+record per line, optionally gzipped) as a stream, normalizes each record to the
+papers columns and loads them in batches: COPY into a temporary staging table,
+then one upsert into papers. Each batch commits together with a checkpoint of
+how many records have been loaded, so an interrupted load resumes where it
+stopped.
+
+Loaded papers use the same ids and URLs as live arXiv search results, so the
+local index (backend/paper_index.py) answers searches from them and later live
+results update the same rows.
+
+    python -m backend.arxiv_ingest arxiv-metadata-oai-snapshot.json.gz --batch-size 5000
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import psycopg2
+
+from backend.db_pool import connection_params
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ('id', 'title', 'abstract', 'authors', 'year', 'venue', 'url')
+_WHITESPACE = re.compile(r'\s+')
+_AUTHOR_SPLIT = re.compile(r',\s*|\s+and\s+')
+
+
+def iter_records(path: str, skip: int = 0) -> Iterator[Dict[str, Any]]:
+    """Snapshot records one at a time, after skipping the first `skip` lines."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line_number, line in enumerate(f):
+            if line_number < skip:
+                continue
+            line = line.strip()
+            if not line:
+                yield {}
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping malformed record on line {line_number + 1}")
+                yield {}
+
+
+def normalize_record(record: Dict[str, Any]) -> Optional[tuple]:
+    """A row of _COLUMNS for a snapshot record, or None if it has no id or title."""
+    arxiv_id = (record.get('id') or '').strip()
+    title = _WHITESPACE.sub(' ', record.get('title') or '').strip()
+    if not arxiv_id or not title:
+        return None
+    versions = record.get('versions') or []
+    version = (versions[-1].get('version') if versions else None) or 'v1'
+    abstract = _WHITESPACE.sub(' ', record.get('abstract') or '').strip() or None
+    journal_ref = _WHITESPACE.sub(' ', record.get('journal-ref') or '').strip()
+
+    return (
+        # Same form as arxiv.Result.entry_id / pdf_url, which live search results use
+        f"http://arxiv.org/abs/{arxiv_id}{version}",
+        title,
+        abstract,
+        _authors(record),
+        _year(record),
+        journal_ref or 'arXiv',
+        f"http://arxiv.org/pdf/{arxiv_id}{version}",
+    )
+
+
+def _authors(record: Dict[str, Any]) -> List[str]:
+    parsed = record.get('authors_parsed')
+    if parsed:
+        # [last, first, suffix] -> "first last suffix"
+        return [
+            ' '.join(part for part in (names[1] if len(names) > 1 else '', names[0], names[2] if len(names) > 2 else '') if part)
+            for names in parsed if names
+        ]
+    authors = _WHITESPACE.sub(' ', record.get('authors') or '')
+    return [author.strip() for author in _AUTHOR_SPLIT.split(authors) if author.strip()]
+
+
+def _year(record: Dict[str, Any]) -> Optional[int]:
+    versions = record.get('versions') or []
+    if versions and versions[0].get('created'):
+        try:
+            return parsedate_to_datetime(versions[0]['created']).year
+        except (TypeError, ValueError):
+            pass
+    update_date = record.get('update_date') or ''
+    return int(update_date[:4]) if update_date[:4].isdigit() else None
+
+
+def _pg_array(values: List[str]) -> str:
+    return '{' + ','.join('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values) + '}'
+
+
+class ArxivSnapshotLoader:
+    """Loads snapshot records into papers in COPY batches, checkpointing after each batch under `source`."""
+    def __init__(self, conn, source: str, batch_size: int = 5000):
+        self.logger = logging.getLogger(__name__)
+        self.conn = conn
+        self.source = source
+        self.batch_size = batch_size
+
+    def checkpoint(self) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT records_done FROM ingest_checkpoints WHERE source = %s", (self.source,))
+            row = cur.fetchone()
+        self.conn.commit()
+        return row[0] if row else 0
+
+    def reset(self) -> None:
+        with self.conn.cursor() as cur:
+            cur.execute("DELETE FROM ingest_checkpoints WHERE source = %s", (self.source,))
+        self.conn.commit()
+
+    def load(self, path: str) -> int:
+        """Load the snapshot from the last checkpoint on; returns the number of papers written."""
+        done = self.checkpoint()
+        if done:
+            self.logger.info(f"Resuming {self.source} after {done} records")
+        self._create_staging()
+
+        written = 0
+        started = time.monotonic()
+        batch: List[tuple] = []
+        consumed = 0
+        for record in iter_records(path, skip=done):
+            consumed += 1
+            row = normalize_record(record) if record else None
+            if row:
+                batch.append(row)
+            if consumed >= self.batch_size:
+                written += self._write_batch(batch, done + consumed)
+                done += consumed
+                batch, consumed = [], 0
+                self.logger.info(f"{self.source}: {done} records read, {written} papers written ({written / (time.monotonic() - started):.0f}/s)")
+        if consumed:
+            written += self._write_batch(batch, done + consumed)
+            done += consumed
+
+        with self.conn.cursor() as cur:
+            cur.execute("ANALYZE papers")
+        self.conn.commit()
+        self.logger.info(f"{self.source}: finished, {done} records read, {written} papers written")
+        return written
+
+    def _create_staging(self) -> None:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS papers_staging (
+                    id VARCHAR(255), title TEXT, abstract TEXT, authors TEXT[], year INTEGER, venue TEXT, url TEXT
+                )
+                """
+            )
+        self.conn.commit()
+
+    def _write_batch(self, rows: List[tuple], records_done: int) -> int:
+        """COPY a batch into staging, upsert it into papers and move the checkpoint, in one transaction."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow((*row[:3], _pg_array(row[3]), *row[4:]))
+        buffer.seek(0)
+
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("TRUNCATE papers_staging")
+                cur.copy_expert(f"COPY papers_staging ({', '.join(_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+                # Same merge rules as insert_paper(): keep what we already know about a paper
+                cur.execute(
+                    """
+                    INSERT INTO papers (id, title, abstract, authors, year, venue, url)
+                    SELECT DISTINCT ON (id) id, title, abstract, authors, year, venue, url
+                    FROM papers_staging ORDER BY id
+                    ON CONFLICT (id) DO UPDATE SET
+                        title = EXCLUDED.title,
+                        abstract = COALESCE(EXCLUDED.abstract, papers.abstract),
+                        authors = COALESCE(NULLIF(EXCLUDED.authors, '{}'), papers.authors),
+                        year = COALESCE(EXCLUDED.year, papers.year),
+                        venue = COALESCE(EXCLUDED.venue, papers.venue),
+                        url = COALESCE(EXCLUDED.url, papers.url),
+                        updated_at = CURRENT_TIMESTAMP
+                    """
+                )
+                written = cur.rowcount
+                cur.execute(
+                    """
+                    INSERT INTO ingest_checkpoints (source, records_done) VALUES (%s, %s)
+                    ON CONFLICT (source) DO UPDATE SET records_done = EXCLUDED.records_done, updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (self.source, records_done)
+                )
+            self.conn.commit()
+            return written
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load an arXiv metadata snapshot (JSON lines, optionally gzipped) into the papers table")
+    parser.add_argument('path', help="Snapshot file, e.g. arxiv-metadata-oai-snapshot.json.gz")
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('ARXIV_INGEST_BATCH_SIZE', '5000')))
+    parser.add_argument('--source', help="Checkpoint name (default: the file name)")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and load from the first record")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    conn = psycopg2.connect(**connection_params())
+    try:
+        loader = ArxivSnapshotLoader(conn, args.source or os.path.basename(args.path), batch_size=args.batch_size)
+        if args.restart:
+            loader.reset()
+        loader.load(args.path)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
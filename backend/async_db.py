@@ -0,0 +1,113 @@
+"""
+Async Postgres access for the native ASGI routes.
+
+One asyncpg pool per event loop (asyncpg connections are bound to the loop that
+opened them), created on first use from the same DB_* settings as
+backend/db_pool.py. Queries use asyncpg's $1, $2 placeholders. Like
+pooled_connection(), async_connection() yields None while the database is
+unreachable so callers can degrade instead of failing the request.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, List, Optional
+
+import asyncpg
+
+from backend.db_pool import connection_params
+from utils.metrics import upstream_call
+
+logger = logging.getLogger(__name__)
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncpg.Pool]" = weakref.WeakKeyDictionary()
+_retry_at: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, float]" = weakref.WeakKeyDictionary()
+_max_connections = int(os.getenv('ASYNC_DB_POOL_MAX_CONNECTIONS', os.getenv('DB_POOL_MAX_CONNECTIONS', '8')))
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # Decode json/jsonb columns to Python objects, as psycopg2 does
+    for typename in ('json', 'jsonb'):
+        await conn.set_type_codec(typename, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def get_async_pool() -> Optional[asyncpg.Pool]:
+    """The running loop's pool, or None if the database is unavailable (retried after DB_RETRY_INTERVAL)."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is not None:
+        return pool
+    if time.monotonic() < _retry_at.get(loop, 0.0):
+        return None
+    params = connection_params()
+    try:
+        pool = await asyncpg.create_pool(
+            host=params['host'],
+            port=int(params['port']),
+            database=params['dbname'],
+            user=params['user'],
+            password=params['password'],
+            timeout=params['connect_timeout'],
+            min_size=1,
+            max_size=_max_connections,
+            init=_init_connection
+        )
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        logger.warning(f"Could not create async database pool: {str(e)}")
+        _retry_at[loop] = time.monotonic() + float(os.getenv('DB_RETRY_INTERVAL', '30'))
+        return None
+    # Another request may have created one while this one was connecting
+    if loop in _pools:
+        await pool.close()
+        return _pools[loop]
+    _pools[loop] = pool
+    return pool
+
+
+@asynccontextmanager
+async def async_connection():
+    """Borrow a connection from the running loop's pool (None if the database is unavailable)."""
+    pool = await get_async_pool()
+    if pool is None:
+        yield None
+        return
+    async with pool.acquire() as conn:
+        yield conn
+
+
+async def fetch(agent: str, query: str, *args: Any) -> List[asyncpg.Record]:
+    """Rows for query, counted and timed as a Postgres upstream call of agent; [] without a database."""
+    async with async_connection() as conn:
+        if conn is None:
+            return []
+        with upstream_call(agent, 'postgres'):
+            return await conn.fetch(query, *args)
+
+
+async def fetchrow(agent: str, query: str, *args: Any) -> Optional[asyncpg.Record]:
+    """First row for query (None if there is none or no database)."""
+    async with async_connection() as conn:
+        if conn is None:
+            return None
+        with upstream_call(agent, 'postgres'):
+            return await conn.fetchrow(query, *args)
+
+
+async def executemany(agent: str, query: str, args: List[tuple]) -> bool:
+    """Run query once per argument tuple; False without a database."""
+    async with async_connection() as conn:
+        if conn is None:
+            return False
+        with upstream_call(agent, 'postgres'):
+            await conn.executemany(query, args)
+        return True
+
+
+async def close_async_pool() -> None:
+    """Close the running loop's pool, e.g. on application shutdown."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
@@ -0,0 +1,40 @@
+"""
+Awaitable interface to a boto3 S3 client for the native ASGI routes.
+
+boto3 clients are thread-safe, so each call runs on a small dedicated thread
+pool rather than the loop's default executor: a burst of library listings
+waits for an S3 thread instead of starving the agent work queued there.
+Operations are the boto3 client's own methods with the same keyword arguments:
+
+    s3 = AsyncS3(s3_client)
+    response = await s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
+
+generate_presigned_url only signs locally, so it stays a plain method.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# Matches botocore's default max_pool_connections, so no thread waits for a connection
+S3_THREADS = int(os.getenv('ASYNC_S3_THREADS', '10'))
+_executor = ThreadPoolExecutor(max_workers=S3_THREADS, thread_name_prefix='s3-io')
+
+
+class AsyncS3:
+    """Wraps a boto3 S3 client; every operation except presigning is a coroutine."""
+    def __init__(self, client: Any):
+        self.client = client
+
+    def generate_presigned_url(self, *args: Any, **kwargs: Any) -> str:
+        return self.client.generate_presigned_url(*args, **kwargs)
+
+    def __getattr__(self, operation: str) -> Callable[..., Any]:
+        method = getattr(self.client, operation)
+
+        async def call(**params: Any) -> Any:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_executor, functools.partial(method, **params))
+
+        return call
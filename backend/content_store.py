@@ -0,0 +1,170 @@
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from backend.db_pool import pooled_connection
+
+logger = logging.getLogger(__name__)
+
+_BLOB_COLUMNS = ('sha256', 's3_key', 'size', 'content_type', 'extracted_text', 'summary')
+
+
+def get_content_store() -> 'ContentStore':
+    """Process-wide ContentStore."""
+    global _content_store
+    with _content_store_lock:
+        if _content_store is None:
+            _content_store = ContentStore(processing_lease=float(os.getenv('CONTENT_PROCESSING_LEASE', '3600')))
+    return _content_store
+
+
+class ContentStore:
+    """
+    Content-addressed registry of stored files (the content_blobs table).
+
+    Each distinct file, by SHA-256, is stored in S3 once: the first upload's
+    object becomes the blob, and later uploads of the same bytes (by any user)
+    get a user_files row pointing at it instead of their own copy. The blob also
+    keeps the extracted text and summary, so they are computed once per file:
+    one upload claims the processing (for `processing_lease` seconds, after which a
+    later copy may take it over), and copies uploaded meanwhile just wait for it.
+    """
+    def __init__(self, processing_lease: float = 3600.0):
+        self.logger = logging.getLogger(__name__)
+        self.processing_lease = processing_lease
+
+    def register(self, sha256: str, s3_key: str, size: int, content_type: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Record s3_key as the blob for sha256 unless one exists. Returns (blob, created);
+        (None, False) if the database is unavailable."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return None, False
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"""
+                        INSERT INTO content_blobs (sha256, s3_key, size, content_type) VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (sha256) DO NOTHING
+                        RETURNING {', '.join(_BLOB_COLUMNS)}
+                        """,
+                        (sha256, s3_key, size, content_type)
+                    )
+                    row = cur.fetchone()
+                    if row:
+                        return dict(zip(_BLOB_COLUMNS, row)), True
+                    cur.execute(f"SELECT {', '.join(_BLOB_COLUMNS)} FROM content_blobs WHERE sha256 = %s", (sha256,))
+                    row = cur.fetchone()
+                    return (dict(zip(_BLOB_COLUMNS, row)) if row else None), False
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not register content {sha256[:12]}: {str(e)}")
+                return None, False
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with pooled_connection() as conn:
+            if conn is None:
+                return None
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"SELECT {', '.join(_BLOB_COLUMNS)} FROM content_blobs WHERE sha256 = %s", (sha256,))
+                    row = cur.fetchone()
+                    return dict(zip(_BLOB_COLUMNS, row)) if row else None
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not read content {sha256[:12]}: {str(e)}")
+                return None
+
+    def claim_processing(self, sha256: str) -> bool:
+        """Claim the extraction and summary of unprocessed content. False if it is already processed
+        or another upload holds the claim; True (process it yourself) if the database is unavailable."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return True
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE content_blobs SET processing_until = NOW() + make_interval(secs => %s)
+                        WHERE sha256 = %s AND extracted_text IS NULL
+                          AND (processing_until IS NULL OR processing_until < NOW())
+                        RETURNING sha256
+                        """,
+                        (self.processing_lease, sha256)
+                    )
+                    return cur.fetchone() is not None
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not claim processing of content {sha256[:12]}: {str(e)}")
+                return True
+
+    def release_processing(self, sha256: str) -> None:
+        """Give up a claim whose processing failed, so the next upload of the content can take it."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE content_blobs SET processing_until = NULL WHERE sha256 = %s AND extracted_text IS NULL",
+                        (sha256,)
+                    )
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not release processing of content {sha256[:12]}: {str(e)}")
+
+    def save_results(self, sha256: str, extracted_text: Optional[str], summary: Optional[str]) -> None:
+        """Keep a blob's extracted text and summary, and fill in the summary of every library
+        entry for it that doesn't have one yet (copies added while it was being processed)."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE content_blobs SET
+                            extracted_text = COALESCE(%s, extracted_text), summary = COALESCE(%s, summary),
+                            processing_until = NULL
+                        WHERE sha256 = %s
+                        """,
+                        (extracted_text, summary, sha256)
+                    )
+                    if summary:
+                        cur.execute(
+                            "UPDATE user_files SET summary = %s WHERE content_sha256 = %s AND summary IS NULL",
+                            (summary, sha256)
+                        )
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not save results for content {sha256[:12]}: {str(e)}")
+
+    def other_references(self, s3_key: str, file_id: str) -> List[str]:
+        """Ids of library entries other than file_id that point at s3_key."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return []
+            with conn.cursor() as cur:
+                cur.execute("SELECT id FROM user_files WHERE s3_key = %s AND id <> %s", (s3_key, file_id))
+                return [row[0] for row in cur.fetchall()]
+
+    def move(self, old_key: str, new_key: str) -> None:
+        """Point the blob and every library entry at a relocated object."""
+        with pooled_connection() as conn:
+            if conn is None:
+                raise RuntimeError("Database unavailable")
+            with conn.cursor() as cur:
+                cur.execute("UPDATE content_blobs SET s3_key = %s WHERE s3_key = %s", (new_key, old_key))
+                cur.execute("UPDATE user_files SET s3_key = %s WHERE s3_key = %s", (new_key, old_key))
+
+    def forget(self, s3_key: str) -> None:
+        """Drop the blob stored at s3_key once its object is deleted."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM content_blobs WHERE s3_key = %s", (s3_key,))
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not remove content record for {s3_key}: {str(e)}")
+
+
+_content_store: Optional[ContentStore] = None
+_content_store_lock = threading.Lock()
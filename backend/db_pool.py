@@ -0,0 +1,72 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from utils.metrics import instrumented_cursor_factory
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_retry_at = 0.0
+# ThreadedConnectionPool raises once every connection is out; callers queue here instead
+_max_connections = int(os.getenv('DB_POOL_MAX_CONNECTIONS', '8'))
+_available = threading.BoundedSemaphore(_max_connections)
+
+
+def connection_params() -> Dict[str, Any]:
+    """psycopg2.connect() keyword arguments from the DB_* settings."""
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': os.getenv('DB_PORT', '5432'),
+        'dbname': os.getenv('DB_NAME', 'thesys_ai'),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD'),
+        'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+    }
+
+
+def get_db_pool() -> Optional[ThreadedConnectionPool]:
+    """
+    Process-wide pool of autocommit connections for the search cache and paper index.
+
+    Created on first use from the DB_* settings. If the database is unreachable,
+    returns None and does not try again for DB_RETRY_INTERVAL seconds.
+    """
+    global _pool, _retry_at
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None and time.monotonic() >= _retry_at:
+            try:
+                _pool = ThreadedConnectionPool(
+                    1, _max_connections,
+                    cursor_factory=instrumented_cursor_factory('search'),
+                    **connection_params()
+                )
+            except Exception as e:
+                logger.warning(f"Could not create database pool: {str(e)}")
+                _retry_at = time.monotonic() + float(os.getenv('DB_RETRY_INTERVAL', '30'))
+        return _pool
+
+
+@contextmanager
+def pooled_connection():
+    """Borrow an autocommit connection from the pool (None if the database is unavailable)."""
+    pool = get_db_pool()
+    if pool is None:
+        yield None
+        return
+    with _available:
+        conn = pool.getconn()
+        try:
+            conn.autocommit = True
+            yield conn
+        finally:
+            # A connection that died mid-query is discarded rather than handed out again
+            pool.putconn(conn, close=conn.closed != 0)
@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from backend.db_pool import pooled_connection
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """
+    Persistent store of paper embeddings keyed by (paper id, model).
+
+    Vectors are kept in the paper_embeddings table as raw float32 bytes, with an
+    in-process LRU of up to `memory_entries` vectors in front so hot papers skip
+    the database round trip as well.
+    """
+    def __init__(self, model: str, memory_entries: int = 5000):
+        self.logger = logging.getLogger(__name__)
+        self.model = model
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, paper_ids: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Stored embeddings for whichever of the given papers have one."""
+        found: Dict[str, np.ndarray] = {}
+        missing = []
+        with self._lock:
+            for paper_id in dict.fromkeys(paper_ids):
+                vector = self._memory.get(paper_id)
+                if vector is None:
+                    missing.append(paper_id)
+                else:
+                    self._memory.move_to_end(paper_id)
+                    found[paper_id] = vector
+        if not missing:
+            return found
+
+        with pooled_connection() as conn:
+            if conn is None:
+                return found
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT paper_id, embedding FROM paper_embeddings WHERE model = %s AND paper_id = ANY(%s)",
+                        (self.model, missing)
+                    )
+                    rows = cur.fetchall()
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not read paper embeddings: {str(e)}")
+                return found
+
+        loaded = {paper_id: np.frombuffer(bytes(blob), dtype=np.float32) for paper_id, blob in rows}
+        self._remember(loaded)
+        found.update(loaded)
+        return found
+
+    def put_many(self, embeddings: Dict[str, np.ndarray]) -> None:
+        """Store embeddings; papers that already have one for this model are left as they are."""
+        if not embeddings:
+            return
+        self._remember(embeddings)
+        rows = [
+            (paper_id, self.model, psycopg2.Binary(np.asarray(vector, dtype=np.float32).tobytes()))
+            for paper_id, vector in embeddings.items()
+        ]
+        with pooled_connection() as conn:
+            if conn is None:
+                return
+            try:
+                with conn.cursor() as cur:
+                    execute_values(
+                        cur,
+                        "INSERT INTO paper_embeddings (paper_id, model, embedding) VALUES %s ON CONFLICT (paper_id, model) DO NOTHING",
+                        rows
+                    )
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not store {len(rows)} paper embeddings: {str(e)}")
+
+    def _remember(self, embeddings: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for paper_id, vector in embeddings.items():
+                self._memory[paper_id] = np.asarray(vector, dtype=np.float32)
+                self._memory.move_to_end(paper_id)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model: str) -> EmbeddingStore:
+    """Process-wide EmbeddingStore for a model."""
+    with _stores_lock:
+        if model not in _stores:
+            _stores[model] = EmbeddingStore(model, memory_entries=int(os.getenv('EMBEDDING_STORE_MEMORY', '5000')))
+        return _stores[model]
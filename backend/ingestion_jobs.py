@@ -0,0 +1,312 @@
+"""
+Durable background queue for ingesting uploaded files.
+
+An upload request only stores the file in S3 and enqueues a row in
+ingestion_jobs; text extraction, summarization and saving the library entry run
+in worker threads that claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers (in the API processes or standalone) share the queue without
+taking the same job twice. A claimed job holds a lease; if its worker dies, the
+job is picked up again once the lease runs out. Failed jobs are retried up to
+`max_attempts` times.
+
+Progress is recorded per stage in the job's `stages` column for the status
+endpoint. Standalone workers:
+
+    python -m backend.ingestion_jobs --threads 4
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import asyncpg
+import psycopg2
+
+from backend import async_db
+from backend.db_pool import pooled_connection
+
+logger = logging.getLogger(__name__)
+
+# In order; 'upload' is done by the request itself before the job is queued
+STAGES = ('upload', 'extract', 'summarize', 'index')
+
+_JOB_COLUMNS = ('id', 'user_id', 'file_id', 'file_name', 'file_type', 's3_key', 'content_sha256', 'status', 'stage', 'stages',
+                'attempts', 'error', 'result', 'created_at', 'updated_at', 'finished_at')
+
+# Follows a `failed` CTE of failed jobs: drops their content's processing claim unless it was processed anyway
+_RELEASE_CONTENT = """
+UPDATE content_blobs SET processing_until = NULL
+WHERE sha256 IN (SELECT content_sha256 FROM failed) AND extracted_text IS NULL
+"""
+
+
+def get_ingestion_queue() -> 'IngestionQueue':
+    """Process-wide IngestionQueue configured from the environment."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestionQueue(
+                lease_seconds=float(os.getenv('INGESTION_LEASE_SECONDS', '900')),
+                max_attempts=int(os.getenv('INGESTION_MAX_ATTEMPTS', '3')),
+                retry_delay=float(os.getenv('INGESTION_RETRY_DELAY', '30'))
+            )
+    return _queue
+
+
+class IngestionQueue:
+    """The ingestion_jobs table: enqueue, claim, progress and completion of jobs."""
+    def __init__(self, lease_seconds: float = 900.0, max_attempts: int = 3, retry_delay: float = 30.0):
+        self.logger = logging.getLogger(__name__)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, job_id: str, user_id: str, file_id: str, file_name: str, file_type: str, s3_key: str,
+                content_sha256: Optional[str] = None) -> bool:
+        """Queue a job for a file already stored in S3; False if the database is unavailable."""
+        stages = {'upload': {'status': 'done'}}
+        return self._execute(
+            """
+            INSERT INTO ingestion_jobs (id, user_id, file_id, file_name, file_type, s3_key, content_sha256, stage, stages)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, 'upload', %s)
+            """,
+            (job_id, user_id, file_id, file_name, file_type, s3_key, content_sha256, json.dumps(stages))
+        ) is not None
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Take the oldest runnable job (queued, or running with an expired lease), or None."""
+        row = self._execute(
+            f"""
+            UPDATE ingestion_jobs SET
+                status = 'running', attempts = attempts + 1, updated_at = NOW(),
+                locked_until = NOW() + make_interval(secs => %s)
+            WHERE id = (
+                SELECT id FROM ingestion_jobs
+                WHERE ((status = 'queued' AND run_after <= NOW()) OR (status = 'running' AND locked_until < NOW()))
+                  AND attempts < %s
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {', '.join(_JOB_COLUMNS)}
+            """,
+            (self.lease_seconds, self.max_attempts),
+            fetch=True
+        )
+        return dict(zip(_JOB_COLUMNS, row)) if row else None
+
+    def fail_exhausted(self) -> None:
+        """Mark failed the jobs that have used all their attempts but were never failed, e.g. because
+        the worker died during the last one (its lease ran out); claim() would never pick them up.
+        Run periodically by IngestionWorker's sweeper thread."""
+        self._execute(
+            f"""
+            WITH failed AS (
+                UPDATE ingestion_jobs SET status = 'failed', locked_until = NULL, updated_at = NOW(), finished_at = NOW(),
+                    error = COALESCE(error || '; ', '') || 'worker stopped during the last attempt'
+                WHERE status IN ('queued', 'running') AND attempts >= %s
+                  AND (status = 'queued' OR locked_until < NOW())
+                RETURNING content_sha256
+            )
+            {_RELEASE_CONTENT}
+            """,
+            (self.max_attempts,)
+        )
+
+    def record_stage(self, job_id: str, stage: str, status: str, **detail: Any) -> None:
+        """Record a stage starting ('running'), finishing ('done'/'skipped') or failing, and renew the lease."""
+        self._execute(
+            """
+            UPDATE ingestion_jobs SET stage = %s, stages = stages || jsonb_build_object(%s, %s::jsonb), updated_at = NOW(),
+                locked_until = NOW() + make_interval(secs => %s)
+            WHERE id = %s
+            """,
+            (stage, stage, json.dumps({'status': status, **detail}), self.lease_seconds, job_id)
+        )
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._execute(
+            """
+            UPDATE ingestion_jobs SET status = 'done', result = %s, error = NULL, locked_until = NULL,
+                updated_at = NOW(), finished_at = NOW()
+            WHERE id = %s
+            """,
+            (json.dumps(result), job_id)
+        )
+
+    def fail(self, job: Dict[str, Any], error: str) -> None:
+        """Put a failed job back in the queue after retry_delay, or mark it failed after max_attempts.
+        A job failed for good gives up its content's processing claim (ContentStore.claim_processing),
+        so the next upload of the same file processes it instead of waiting out the lease."""
+        if job['attempts'] < self.max_attempts:
+            self._execute(
+                """
+                UPDATE ingestion_jobs SET status = 'queued', error = %s, locked_until = NULL, updated_at = NOW(),
+                    run_after = NOW() + make_interval(secs => %s)
+                WHERE id = %s
+                """,
+                (error, self.retry_delay * job['attempts'], job['id'])
+            )
+        else:
+            self._execute(
+                f"""
+                WITH failed AS (
+                    UPDATE ingestion_jobs SET status = 'failed', error = %s, locked_until = NULL,
+                        updated_at = NOW(), finished_at = NOW()
+                    WHERE id = %s
+                    RETURNING content_sha256
+                )
+                {_RELEASE_CONTENT}
+                """,
+                (error, job['id'])
+            )
+
+    def get(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """A user's job, for the status endpoint."""
+        row = self._execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM ingestion_jobs WHERE id = %s AND user_id = %s",
+            (job_id, user_id),
+            fetch=True
+        )
+        return dict(zip(_JOB_COLUMNS, row)) if row else None
+
+    async def get_async(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """get() on the async pool, for the native status route."""
+        try:
+            row = await async_db.fetchrow(
+                'ingestion',
+                f"SELECT {', '.join(_JOB_COLUMNS)} FROM ingestion_jobs WHERE id = $1 AND user_id = $2",
+                job_id, user_id
+            )
+        except asyncpg.PostgresError as e:
+            self.logger.warning(f"Ingestion queue query failed: {str(e)}")
+            return None
+        return dict(row) if row else None
+
+    def _execute(self, sql: str, params: tuple, fetch: bool = False):
+        """Run one statement; returns the fetched row (or True) on success, None on failure."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return None
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    return cur.fetchone() if fetch else True
+            except psycopg2.Error as e:
+                self.logger.warning(f"Ingestion queue query failed: {str(e)}")
+                return None
+
+
+class IngestionWorker:
+    """
+    Threads that claim jobs and run them through `handler(job, report)`.
+
+    `report(stage, status, **detail)` records progress; the handler returns the
+    job's result or raises to fail it. Idle threads poll every `poll_interval`
+    seconds, or sooner when woken by `wake()` after a local enqueue. One more
+    thread fails abandoned jobs (IngestionQueue.fail_exhausted) every
+    `sweep_interval` seconds.
+    """
+    def __init__(self, queue: IngestionQueue, handler: Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]],
+                 threads: int = 1, poll_interval: float = 2.0, sweep_interval: float = 60.0):
+        self.logger = logging.getLogger(__name__)
+        self.queue = queue
+        self.handler = handler
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        # wake() calls not yet consumed by an idle thread; each one ends exactly one wait
+        self._wakeups = threading.Condition()
+        self._pending_wakeups = 0
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            for i in range(self.threads):
+                threading.Thread(target=self._run, name=f'ingestion-worker-{i}', daemon=True).start()
+            threading.Thread(target=self._sweep, name='ingestion-sweeper', daemon=True).start()
+            self._started = True
+
+    def wake(self) -> None:
+        with self._wakeups:
+            # More than one per thread would only send threads to find an empty queue
+            self._pending_wakeups = min(self._pending_wakeups + 1, self.threads)
+            self._wakeups.notify()
+
+    def run_one(self) -> bool:
+        """Claim and run one job; False if there was none."""
+        job = self.queue.claim()
+        if job is None:
+            return False
+
+        def report(stage: str, status: str, **detail: Any) -> None:
+            self.queue.record_stage(job['id'], stage, status, **detail)
+
+        self.logger.info(f"Running ingestion job {job['id']} for {job['file_name']} (attempt {job['attempts']})")
+        try:
+            result = self.handler(job, report)
+            self.queue.complete(job['id'], result)
+        except Exception as e:
+            self.logger.error(f"Ingestion job {job['id']} failed: {str(e)}", exc_info=True)
+            self.queue.fail(job, str(e))
+        return True
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                self.logger.error(f"Ingestion worker error: {str(e)}", exc_info=True)
+            self._wait_for_work()
+
+    def _wait_for_work(self) -> None:
+        """Wait up to poll_interval, or until a wake() that no other thread has consumed.
+        A wake() that arrives while this thread is busy is consumed by its next wait."""
+        with self._wakeups:
+            if not self._pending_wakeups:
+                self._wakeups.wait(self.poll_interval)
+            if self._pending_wakeups:
+                self._pending_wakeups -= 1
+
+    def _sweep(self) -> None:
+        while True:
+            try:
+                self.queue.fail_exhausted()
+            except Exception as e:
+                self.logger.error(f"Ingestion sweep error: {str(e)}", exc_info=True)
+            time.sleep(self.sweep_interval)
+
+
+_queue: Optional[IngestionQueue] = None
+_queue_lock = threading.Lock()
+
+
+def workers_in_process() -> int:
+    """Ingestion worker threads each API process runs (0 if jobs are left to standalone workers)."""
+    if os.getenv('INGESTION_QUEUE_ENABLED', 'true').lower() != 'true':
+        return 0
+    return int(os.getenv('INGESTION_WORKERS', '1'))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run background ingestion workers")
+    parser.add_argument('--threads', type=int, default=int(os.getenv('INGESTION_WORKERS', '1')))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.environ['INGESTION_WORKERS'] = str(args.threads)
+    from agents.scholar_agent.agent import ScholarAgent
+    ScholarAgent()
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()
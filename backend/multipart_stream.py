@@ -0,0 +1,184 @@
+"""
+Incremental multipart/form-data parsing for streamed uploads.
+
+Werkzeug and Starlette's form parsers both take the whole body before the
+handler runs (in memory, or spooled to disk). MultipartUpload parses the body
+as it arrives from the ASGI server instead: plain fields before the file are
+collected, and the file part's bytes are handed to a blocking reader, so
+backend/s3_upload.py's upload_stream can send them to S3 from a worker thread
+while the event loop is still receiving the rest of the body:
+
+    upload = MultipartUpload(request.headers['content-type'])
+    chunks = request.stream()
+    if await upload.read_until_file(chunks):
+        feeding = asyncio.create_task(upload.feed_file(chunks))
+        await loop.run_in_executor(None, upload_stream, s3, bucket, key, upload.file)
+
+At most `max_chunks` received chunks wait for the reader, so memory stays
+bounded however large the file is. Fields must come before the file; anything
+after it is ignored.
+"""
+import asyncio
+import queue
+from typing import AsyncIterator, Dict, List, Optional, Union
+
+from multipart.multipart import MultipartParser, parse_options_header
+
+# Received chunks (typically 64 KiB each) buffered for the reader
+MAX_CHUNKS = 16
+# Longest plain field value kept, e.g. user_id
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised for a body that isn't multipart/form-data or can't be parsed."""
+
+
+class ChunkReader:
+    """Blocking binary stream of chunks put by the event loop; read() is called from a worker thread."""
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_chunks: int = MAX_CHUNKS):
+        self._loop = loop
+        self._chunks: "queue.Queue[Union[bytes, BaseException, None]]" = queue.Queue()
+        self._space = asyncio.Semaphore(max_chunks)
+        self._buffer = b''
+        self._ended = False
+        self.bytes_read = 0
+
+    async def put(self, data: bytes) -> None:
+        """Queue data for the reader, waiting while max_chunks are already queued."""
+        await self._space.acquire()
+        self._chunks.put(data)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """End the stream; the reader gets b'' once it has read everything queued, or `error` raised."""
+        self._chunks.put(error)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._buffer and not self._ended:
+            item = self._chunks.get()
+            if item is None:
+                self._ended = True
+            elif isinstance(item, BaseException):
+                self._ended = True
+                raise item
+            else:
+                self._loop.call_soon_threadsafe(self._space.release)
+                self._buffer = item
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.bytes_read += len(data)
+        return data
+
+
+class MultipartUpload:
+    """Parses one multipart/form-data body whose single file part is read through `file`."""
+    def __init__(self, content_type: str, file_field: str = 'file', max_chunks: int = MAX_CHUNKS):
+        mime, options = parse_options_header(content_type or '')
+        boundary = options.get(b'boundary')
+        if mime != b'multipart/form-data' or not boundary:
+            raise MultipartError("Expected a multipart/form-data body")
+        self.file_field = file_field
+        self.fields: Dict[str, str] = {}
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.file = ChunkReader(asyncio.get_running_loop(), max_chunks)
+
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._name: Optional[str] = None
+        self._value = bytearray()
+        self._in_file = False
+        self._file_done = False
+        self._pending: List[bytes] = []
+        self._parser = MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    async def read_until_file(self, chunks: AsyncIterator[bytes]) -> bool:
+        """Parse the body up to the start of the file part; False if the body has no file part."""
+        async for chunk in chunks:
+            self._write(chunk)
+            if self.filename is not None:
+                return True
+        return False
+
+    async def feed_file(self, chunks: AsyncIterator[bytes]) -> None:
+        """Pass the rest of the file part to `file` as it arrives, then close it (with the error, on failure).
+        Stop early (cancel) once the reader is done with the file."""
+        error: Optional[BaseException] = None
+        try:
+            await self._flush()
+            async for chunk in chunks:
+                if self._file_done:
+                    break
+                self._write(chunk)
+                await self._flush()
+            if not self._file_done:
+                raise MultipartError("Upload ended before the end of the file")
+        except asyncio.CancelledError:
+            error = MultipartError("Upload cancelled")
+            raise
+        except Exception as e:
+            error = e if isinstance(e, MultipartError) else MultipartError(f"Could not read upload: {str(e)}")
+        finally:
+            self.file.close(error)
+
+    def _write(self, chunk: bytes) -> None:
+        try:
+            self._parser.write(chunk)
+        except MultipartError:
+            raise
+        except Exception as e:
+            raise MultipartError(f"Malformed multipart body: {str(e)}")
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, []
+        for data in pending:
+            await self.file.put(data)
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+        self._name = None
+        self._value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        self._name = options.get(b'name', b'').decode('utf-8', 'replace')
+        if self._name == self.file_field and self.filename is None and b'filename' in options:
+            self._in_file = True
+            self.filename = options[b'filename'].decode('utf-8', 'replace')
+            self.content_type = self._headers.get(b'content-type', b'').decode('latin-1') or None
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending.append(data[start:end])
+        elif self.filename is None:
+            if len(self._value) + end - start > MAX_FIELD_SIZE:
+                raise MultipartError(f"Field {self._name} is too large")
+            self._value += data[start:end]
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+        elif self.filename is None and self._name:
+            self.fields[self._name] = self._value.decode('utf-8', 'replace')
@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extras import execute_batch
+
+from agents.scholar_agent.utils import normalize_arxiv_id
+from backend.db_pool import pooled_connection
+
+logger = logging.getLogger(__name__)
+
+# Must match the expression of papers_title_abstract_idx in schema.sql for the GIN index to be used
+_DOCUMENT = "to_tsvector('english', title || ' ' || COALESCE(abstract, ''))"
+
+
+def get_paper_index() -> Optional['LocalPaperIndex']:
+    """Process-wide LocalPaperIndex configured from the environment, or None if disabled."""
+    global _paper_index
+    if os.getenv('PAPER_INDEX_ENABLED', 'true').lower() != 'true':
+        return None
+    with _paper_index_lock:
+        if _paper_index is None:
+            _paper_index = LocalPaperIndex(
+                batch_size=int(os.getenv('PAPER_INDEX_BATCH_SIZE', '100')),
+                flush_interval=float(os.getenv('PAPER_INDEX_FLUSH_INTERVAL', '2'))
+            )
+    return _paper_index
+
+
+class LocalPaperIndex:
+    """
+    Full-text search over the papers table, filled from upstream search results.
+
+    `add_papers` only queues papers; a background thread writes them through
+    insert_paper in batches of up to `batch_size`, at least every `flush_interval`
+    seconds, so persisting never adds to a search's latency.
+    """
+    def __init__(self, batch_size: int = 100, flush_interval: float = 2.0):
+        self.logger = logging.getLogger(__name__)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, tuple] = {}
+        self._cond = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+
+    def search(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """Papers matching every term of the query, best text match first."""
+        with pooled_connection() as conn:
+            if conn is None:
+                return []
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"""
+                        SELECT id, title, abstract, authors, year, venue, citations, url, updated_at,
+                               ts_rank({_DOCUMENT}, q) AS rank
+                        FROM papers, websearch_to_tsquery('english', %s) q
+                        WHERE {_DOCUMENT} @@ q
+                        ORDER BY rank DESC, citations DESC NULLS LAST, id
+                        LIMIT %s OFFSET %s
+                        """,
+                        (query, limit, offset)
+                    )
+                    rows = cur.fetchall()
+            except psycopg2.Error as e:
+                self.logger.warning(f"Local paper search failed: {str(e)}")
+                return []
+
+        return [
+            {
+                "id": row[0],
+                "title": row[1],
+                "abstract": row[2],
+                "authors": row[3] or [],
+                "year": row[4],
+                "venue": row[5],
+                "citations": row[6],
+                "url": row[7],
+                "doi": None,
+                "arxiv_id": normalize_arxiv_id(row[0]) or normalize_arxiv_id(row[7]),
+                "sources": ['local'],
+                "timestamp": (row[8] or datetime.now()).isoformat()
+            }
+            for row in rows
+        ]
+
+    def add_papers(self, papers: List[Dict[str, Any]]) -> None:
+        """Queue search results to be written to the papers table."""
+        rows = [row for row in (self._paper_row(paper) for paper in papers) if row]
+        if not rows:
+            return
+        with self._cond:
+            for row in rows:
+                queued = self._pending.get(row[0])
+                if queued is not None:
+                    # Same paper twice in one batch: keep the fields either copy has
+                    row = tuple(new if new not in (None, []) else old for new, old in zip(row, queued))
+                self._pending[row[0]] = row
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='paper-index-writer', daemon=True)
+                self._writer.start()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """Write everything queued so far; returns the number of papers written."""
+        with self._cond:
+            rows = list(self._pending.values())
+            self._pending.clear()
+        written = 0
+        for start in range(0, len(rows), self.batch_size):
+            written += self._write_batch(rows[start:start + self.batch_size])
+        return written
+
+    def _write_loop(self) -> None:
+        while True:
+            with self._cond:
+                if len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def _write_batch(self, rows: List[tuple]) -> int:
+        with pooled_connection() as conn:
+            if conn is None:
+                return 0
+            try:
+                with conn.cursor() as cur:
+                    execute_batch(cur, "SELECT insert_paper(%s, %s, %s, %s, %s, %s, %s, %s)", rows, page_size=len(rows))
+                return len(rows)
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not persist {len(rows)} papers to the local index: {str(e)}")
+                return 0
+
+    @staticmethod
+    def _paper_row(paper: Dict[str, Any]) -> Optional[tuple]:
+        paper_id = str(paper.get('id') or '')
+        title = paper.get('title')
+        if not paper_id or not title or len(paper_id) > 255:
+            return None
+        try:
+            year = int(paper['year']) if paper.get('year') else None
+        except (TypeError, ValueError):
+            year = None
+        citations = paper.get('citations')
+        return (
+            paper_id,
+            title,
+            paper.get('abstract') or None,
+            [str(author) for author in paper.get('authors') or []],
+            year,
+            paper.get('venue') or None,
+            int(citations) if isinstance(citations, (int, float)) else None,
+            paper.get('url') or None,
+        )
+
+
+_paper_index: Optional[LocalPaperIndex] = None
+_paper_index_lock = threading.Lock()
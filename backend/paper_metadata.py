@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import asyncpg
+import psycopg2
+from psycopg2.extras import execute_values
+
+from agents.scholar_agent.utils import normalize_arxiv_id
+from backend import async_db
+from backend.db_pool import pooled_connection
+from utils.config import Config
+from utils.http import http_get, http_get_async, http_post, http_post_async
+from utils.metrics import upstream_call
+from utils.rate_limit import get_rate_limiter, RateLimited
+
+logger = logging.getLogger(__name__)
+
+_DOI = re.compile(r'(10\.\d{4,9}/\S+)', re.IGNORECASE)
+_S2_FIELDS = "paperId,externalIds,title,abstract,authors,year,venue,citationCount,url"
+# Semantic Scholar's /paper/batch limit
+S2_BATCH_SIZE = 500
+# DOIs per CrossRef filter request, keeping the URL a sensible length
+CROSSREF_BATCH_SIZE = 20
+# Times a batch answered with 429 is tried again, once the rate limiter allows
+RATE_LIMITED_RETRIES = 1
+
+# Rate limiter / metrics name -> (name in logs, ids per request)
+_SOURCES = {
+    'semantic_scholar': ('Semantic Scholar', S2_BATCH_SIZE),
+    'crossref': ('CrossRef', CROSSREF_BATCH_SIZE),
+}
+
+_LOAD_SQL = """
+SELECT paper_key, metadata FROM paper_metadata
+WHERE paper_key = ANY({keys}) AND fetched_at > NOW() - make_interval(secs => {ttl})
+"""
+_STORE_SQL = """
+INSERT INTO paper_metadata (paper_key, metadata) VALUES {values}
+ON CONFLICT (paper_key) DO UPDATE SET metadata = EXCLUDED.metadata, fetched_at = CURRENT_TIMESTAMP
+"""
+
+
+def paper_key(paper_id: str) -> str:
+    """Semantic Scholar-style id for a DOI, arXiv id/URL or S2 paper id ('DOI:10.1/x', 'ARXIV:2101.00001', '<sha>')."""
+    value = str(paper_id).strip()
+    doi = _DOI.search(value)
+    if doi:
+        return f"DOI:{doi.group(1).lower()}"
+    if value.upper().startswith(('CORPUSID:', 'PMID:', 'ACL:', 'MAG:')):
+        return value
+    arxiv_id = normalize_arxiv_id(value)
+    if arxiv_id:
+        return f"ARXIV:{arxiv_id}"
+    return value
+
+
+def get_metadata_hydrator() -> 'PaperMetadataHydrator':
+    """Process-wide PaperMetadataHydrator configured from the environment."""
+    global _hydrator
+    with _hydrator_lock:
+        if _hydrator is None:
+            _hydrator = PaperMetadataHydrator(
+                ttl_seconds=float(os.getenv('PAPER_METADATA_TTL', '86400')),
+                rate_limit_wait=float(os.getenv('PAPER_METADATA_RATE_LIMIT_WAIT', '5'))
+            )
+    return _hydrator
+
+
+class PaperMetadataHydrator:
+    """
+    Fetches metadata (title, authors, venue, citation count, ...) for many papers at once.
+
+    Papers are looked up in the paper_metadata table first; the rest are fetched
+    from Semantic Scholar's /paper/batch endpoint, up to 500 per request, and DOIs
+    Semantic Scholar doesn't know are tried against CrossRef with `doi:` filters.
+    Fetched metadata is kept in paper_metadata for `ttl_seconds` (citation counts
+    change, so entries do expire).
+    """
+    def __init__(self, ttl_seconds: float = 86400.0, rate_limit_wait: float = 5.0):
+        self.logger = logging.getLogger(__name__)
+        self.ttl_seconds = ttl_seconds
+        self.rate_limit_wait = rate_limit_wait
+        self.semantic_scholar_api = Config.SEMANTIC_SCHOLAR_API_URL
+        self.crossref_api = Config.CROSSREF_API_URL
+
+    def hydrate(self, paper_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Metadata for each requested id (a DOI, arXiv id or URL, or S2 paper id), None where no source has it.
+
+        A batch answered with 429 penalizes the source's rate limiter and is retried
+        once the limiter lets it through. If that (or any later batch) would wait more
+        than `rate_limit_wait` seconds, the source's remaining batches are skipped and
+        their ids come back as None: the result is partial rather than late.
+        """
+        keys, wanted = self._keys(paper_ids)
+        found = self._load(wanted)
+
+        missing = [key for key in wanted if key not in found]
+        if missing:
+            fetched = self._fetch('semantic_scholar', missing)
+            fetched.update(self._fetch('crossref', self._unresolved_dois(missing, fetched)))
+            self._store(fetched)
+            found.update(fetched)
+
+        return {paper_id: found.get(key) for paper_id, key in keys.items()}
+
+    async def hydrate_async(self, paper_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """hydrate() on the event loop, with the async HTTP client and Postgres pool."""
+        keys, wanted = self._keys(paper_ids)
+        found = await self._load_async(wanted)
+
+        missing = [key for key in wanted if key not in found]
+        if missing:
+            fetched = await self._fetch_async('semantic_scholar', missing)
+            fetched.update(await self._fetch_async('crossref', self._unresolved_dois(missing, fetched)))
+            await self._store_async(fetched)
+            found.update(fetched)
+
+        return {paper_id: found.get(key) for paper_id, key in keys.items()}
+
+    @staticmethod
+    def _keys(paper_ids: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+        keys = {paper_id: paper_key(paper_id) for paper_id in dict.fromkeys(paper_ids) if paper_id}
+        return keys, list(dict.fromkeys(keys.values()))
+
+    @staticmethod
+    def _unresolved_dois(keys: List[str], fetched: Dict[str, Dict[str, Any]]) -> List[str]:
+        return [key[4:] for key in keys if key.startswith('DOI:') and key not in fetched]
+
+    # --- Fetching: sync and async differ only in the HTTP call ---
+
+    def _fetch(self, source: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        papers: Dict[str, Dict[str, Any]] = {}
+        limiter = get_rate_limiter(source)
+        for batch in self._batches(source, ids):
+            for _ in range(1 + RATE_LIMITED_RETRIES):
+                try:
+                    limiter.acquire(timeout=self.rate_limit_wait)
+                    method, url, params = self._request(source, batch)
+                    with upstream_call('metadata', source):
+                        response = (http_post if method == 'POST' else http_get)(url, **params)
+                    if not self._rate_limited(source, limiter, response):
+                        papers.update(self._parse(source, batch, response))
+                        break
+                except RateLimited as e:
+                    self.logger.warning(f"Skipping the rest of {_SOURCES[source][0]} batch hydration: {e}")
+                    return papers
+                except Exception as e:
+                    self.logger.error(f"{_SOURCES[source][0]} batch hydration failed: {str(e)}")
+                    break
+        return papers
+
+    async def _fetch_async(self, source: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        papers: Dict[str, Dict[str, Any]] = {}
+        limiter = get_rate_limiter(source)
+        for batch in self._batches(source, ids):
+            for _ in range(1 + RATE_LIMITED_RETRIES):
+                try:
+                    await limiter.acquire_async(timeout=self.rate_limit_wait)
+                    method, url, params = self._request(source, batch)
+                    with upstream_call('metadata', source):
+                        response = await (http_post_async if method == 'POST' else http_get_async)(url, **params)
+                    if not self._rate_limited(source, limiter, response):
+                        papers.update(self._parse(source, batch, response))
+                        break
+                except RateLimited as e:
+                    self.logger.warning(f"Skipping the rest of {_SOURCES[source][0]} batch hydration: {e}")
+                    return papers
+                except Exception as e:
+                    self.logger.error(f"{_SOURCES[source][0]} batch hydration failed: {str(e)}")
+                    break
+        return papers
+
+    @staticmethod
+    def _batches(source: str, ids: List[str]) -> List[List[str]]:
+        size = _SOURCES[source][1]
+        return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+    def _request(self, source: str, batch: List[str]) -> Tuple[str, str, Dict[str, Any]]:
+        """(method, url, keyword arguments) of the request for one batch."""
+        if source == 'semantic_scholar':
+            return 'POST', f"{self.semantic_scholar_api}/paper/batch", {'params': {'fields': _S2_FIELDS}, 'json': {'ids': batch}}
+        return 'GET', self.crossref_api, {'params': {'filter': ','.join(f"doi:{doi}" for doi in batch), 'rows': len(batch)}}
+
+    def _rate_limited(self, source: str, limiter, response) -> bool:
+        """True (after holding off every worker through the limiter) if the upstream answered 429."""
+        if response.status_code != 429:
+            return False
+        retry_after = response.headers.get('Retry-After', '')
+        limiter.penalize(float(retry_after) if retry_after.isdigit() else 5.0)
+        self.logger.warning(f"Rate limited by {_SOURCES[source][0]} during batch hydration")
+        return True
+
+    def _parse(self, source: str, batch: List[str], response) -> Dict[str, Dict[str, Any]]:
+        response.raise_for_status()
+        if source == 'semantic_scholar':
+            # One entry per requested id, in order; null for ids it doesn't know
+            return {key: self._from_semantic_scholar(result) for key, result in zip(batch, response.json()) if result}
+        return {
+            f"DOI:{item['DOI'].lower()}": self._from_crossref(item)
+            for item in response.json().get('message', {}).get('items', []) if item.get('DOI')
+        }
+
+    @staticmethod
+    def _from_semantic_scholar(result: Dict[str, Any]) -> Dict[str, Any]:
+        external_ids = result.get("externalIds") or {}
+        return {
+            "id": result.get("paperId", ""),
+            "title": result.get("title", ""),
+            "abstract": result.get("abstract", ""),
+            "authors": [author.get("name", "") for author in result.get("authors") or []],
+            "year": result.get("year"),
+            "venue": result.get("venue", ""),
+            "citations": result.get("citationCount", 0),
+            "url": result.get("url", ""),
+            "doi": external_ids.get("DOI"),
+            "arxiv_id": external_ids.get("ArXiv"),
+            "sources": ['semantic_scholar'],
+            "timestamp": datetime.now().isoformat()
+        }
+
+    @staticmethod
+    def _from_crossref(item: Dict[str, Any]) -> Dict[str, Any]:
+        date_parts = (item.get('issued') or {}).get('date-parts') or [[None]]
+        return {
+            "id": item['DOI'],
+            "title": (item.get('title') or [''])[0],
+            "abstract": item.get('abstract', ''),
+            "authors": [
+                ' '.join(part for part in (author.get('given'), author.get('family')) if part)
+                for author in item.get('author') or []
+            ],
+            "year": date_parts[0][0] if date_parts[0] else None,
+            "venue": (item.get('container-title') or [''])[0],
+            "citations": item.get('is-referenced-by-count', 0),
+            "url": item.get('URL', ''),
+            "doi": item['DOI'],
+            "arxiv_id": None,
+            "sources": ['crossref'],
+            "timestamp": datetime.now().isoformat()
+        }
+
+    # --- Cache: sync and async share the SQL, with each driver's placeholders ---
+
+    def _load(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not keys:
+            return {}
+        with pooled_connection() as conn:
+            if conn is None:
+                return {}
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(_LOAD_SQL.format(keys='%s', ttl='%s'), (keys, self.ttl_seconds))
+                    return dict(cur.fetchall())
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not read cached paper metadata: {str(e)}")
+                return {}
+
+    def _store(self, papers: Dict[str, Dict[str, Any]]) -> None:
+        if not papers:
+            return
+        with pooled_connection() as conn:
+            if conn is None:
+                return
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, _STORE_SQL.format(values='%s'), [(key, json.dumps(paper)) for key, paper in papers.items()])
+            except psycopg2.Error as e:
+                self.logger.warning(f"Could not cache metadata for {len(papers)} papers: {str(e)}")
+
+    async def _load_async(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not keys:
+            return {}
+        try:
+            rows = await async_db.fetch('metadata', _LOAD_SQL.format(keys='$1::text[]', ttl='$2'), keys, self.ttl_seconds)
+        except asyncpg.PostgresError as e:
+            self.logger.warning(f"Could not read cached paper metadata: {str(e)}")
+            return {}
+        return {row['paper_key']: row['metadata'] for row in rows}
+
+    async def _store_async(self, papers: Dict[str, Dict[str, Any]]) -> None:
+        if not papers:
+            return
+        try:
+            # The pool's JSONB codec serializes the metadata
+            await async_db.executemany('metadata', _STORE_SQL.format(values='($1, $2)'), list(papers.items()))
+        except asyncpg.PostgresError as e:
+            self.logger.warning(f"Could not cache metadata for {len(papers)} papers: {str(e)}")
+
+
+_hydrator: Optional[PaperMetadataHydrator] = None
+_hydrator_lock = threading.Lock()
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    In-process cache for chat answers.
+
+    Entries are keyed on the normalized prompt, model and temperature, expire after
+    `ttl_seconds` and are evicted least-recently-used once `max_entries` is reached.
+    Entries stored with an embedding can also be found by a near-duplicate lookup:
+    the closest cached embedding (cosine similarity) for the same model and
+    temperature is returned if it clears `similarity_threshold`.
+    """
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600.0, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Lowercase, collapse whitespace and drop trailing punctuation."""
+        return re.sub(r'\s+', ' ', str(text)).strip().lower().rstrip('?.! ')
+
+    def make_key(self, prompt: str, model: str, temperature: float, scope: Optional[str] = None) -> str:
+        raw = f"{scope or ''}|{model}|{round(float(temperature), 2)}|{self.normalize(prompt)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for an exact key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def get_similar(self, vector: Optional[Sequence[float]], model: str, temperature: float, scopes: Sequence[Optional[str]] = (None,)) -> Optional[Any]:
+        """Return the value of the most similar cached entry if it clears the threshold."""
+        if vector is None:
+            return None
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        query = query / norm
+        temperature = round(float(temperature), 2)
+
+        with self._lock:
+            self._evict_expired()
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry['vector'] is not None
+                and entry['model'] == model
+                and entry['temperature'] == temperature
+                and entry['scope'] in scopes
+                and entry['vector'].shape == query.shape
+            ]
+            if not candidates:
+                self.misses += 1
+                return None
+
+            matrix = np.stack([entry['vector'] for _, entry in candidates])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            logger.debug(f"Semantic cache hit (similarity {similarities[best]:.3f})")
+            return entry['value']
+
+    def set(self, key: str, value: Any, model: str, temperature: float, vector: Optional[Sequence[float]] = None, scope: Optional[str] = None) -> None:
+        """Store a value, optionally with an embedding for near-duplicate lookups."""
+        normalized = None
+        if vector is not None:
+            normalized = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(normalized)
+            normalized = normalized / norm if norm else None
+
+        with self._lock:
+            self._entries[key] = {
+                'value': value,
+                'vector': normalized,
+                'model': model,
+                'temperature': round(float(temperature), 2),
+                'scope': scope,
+                'created_at': time.monotonic()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses
+            }
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.monotonic() - entry['created_at'] > self.ttl_seconds
+
+    def _evict_expired(self) -> None:
+        expired = [key for key, entry in self._entries.items() if self._expired(entry)]
+        for key in expired:
+            del self._entries[key]
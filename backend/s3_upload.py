@@ -0,0 +1,173 @@
+"""
+Streaming uploads to S3 with bounded memory.
+
+The source is read in chunks into parts of `part_size` bytes; each full part is
+handed to a thread pool as an S3 multipart upload part while the next one is
+read. At most `concurrency` parts are in flight, so an upload holds about
+(concurrency + 1) * part_size bytes however large the file is. Files that fit in
+one part are sent with a single put_object.
+
+The SHA-256 of the content is computed and the type is sniffed from the first
+bytes as they arrive, so neither needs a second pass over the file. A caller can
+also check those first bytes and reject the file before anything is sent to S3,
+and cap the size with LimitedReader, e.g. when piping a download straight to S3.
+"""
+import codecs
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# S3 parts must be at least 5 MiB, except the last
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = max(MIN_PART_SIZE, int(os.getenv('S3_UPLOAD_PART_SIZE', str(8 * 1024 * 1024))))
+CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', '4'))
+READ_SIZE = 256 * 1024
+# Bytes read before the type is sniffed and the caller's check runs
+HEAD_SIZE = 4096
+
+_part_executor = ThreadPoolExecutor(max_workers=int(os.getenv('S3_UPLOAD_THREADS', '8')), thread_name_prefix='s3-upload')
+
+_MAGIC = (
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+)
+
+
+class SizeLimitExceeded(ValueError):
+    """Raised by LimitedReader when the stream goes past its limit."""
+
+
+class LimitedReader:
+    """Wraps a binary stream and raises SizeLimitExceeded once more than max_bytes have been read."""
+    def __init__(self, stream: BinaryIO, max_bytes: int):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            raise SizeLimitExceeded(f"File is larger than the {self.max_bytes // (1024 * 1024)} MB limit")
+        return data
+
+
+@dataclass
+class UploadResult:
+    key: str
+    size: int
+    sha256: str
+    content_type: str
+
+
+def sniff_content_type(head: bytes, declared: Optional[str] = None) -> str:
+    """Content type from the first bytes of a file. A recognised signature wins over the declared
+    type; otherwise the declared type is kept, falling back to text/plain for UTF-8 text."""
+    for magic, content_type in _MAGIC:
+        if head.startswith(magic):
+            # .docx/.pptx are zip files; trust a specific declared type over the container
+            if content_type == 'application/zip' and declared and declared != 'application/octet-stream':
+                return declared
+            return content_type
+    if declared and declared != 'application/octet-stream':
+        return declared
+    try:
+        # Incremental, so a character cut off at the end of the sample doesn't count against it
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'text/plain'
+    except UnicodeDecodeError:
+        return 'application/octet-stream'
+
+
+def upload_stream(s3_client, bucket: str, key: str, stream: BinaryIO, content_type: Optional[str] = None,
+                  metadata: Optional[Dict[str, str]] = None, part_size: int = PART_SIZE,
+                  concurrency: int = CONCURRENCY, validate: Optional[Callable[[bytes], None]] = None) -> UploadResult:
+    """
+    Upload everything readable from `stream` to s3://bucket/key.
+
+    `validate`, if given, is called with the first HEAD_SIZE bytes before anything
+    is sent to S3 and raises to reject the file. Raises ValueError for an empty
+    stream. A failed multipart upload is aborted so no orphaned parts are left
+    behind, and the error is re-raised.
+    """
+    part_size = max(MIN_PART_SIZE, part_size)
+    digest = hashlib.sha256()
+    size = 0
+
+    buffer = bytearray()
+    ended = _read_until(stream, buffer, HEAD_SIZE)
+    if not buffer:
+        raise ValueError("File data is required")
+    head = bytes(buffer)
+    if validate is not None:
+        validate(head)
+    content_type = sniff_content_type(head, content_type)
+    if not ended:
+        ended = _read_until(stream, buffer, part_size)
+    extra = {'ContentType': content_type, 'Metadata': metadata or {}}
+
+    if ended:
+        # Whole file fits in one part
+        digest.update(buffer)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), **extra)
+        return UploadResult(key=key, size=len(buffer), sha256=digest.hexdigest(), content_type=content_type)
+
+    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **extra)['UploadId']
+    in_flight = threading.BoundedSemaphore(concurrency)
+    futures: List[Future] = []
+    try:
+        while buffer:
+            part = bytes(buffer)
+            buffer.clear()
+            digest.update(part)
+            size += len(part)
+            in_flight.acquire()
+            future = _part_executor.submit(_upload_part, s3_client, bucket, key, upload_id, len(futures) + 1, part)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+            # Surface a failed part now rather than after reading the rest of the file
+            for done in futures:
+                if done.done() and done.exception() is not None:
+                    raise done.exception()
+            if not ended:
+                ended = _read_until(stream, buffer, part_size)
+
+        parts = [future.result() for future in futures]
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        # Parts still uploading would otherwise land after the abort and be kept (and billed)
+        wait(futures)
+        try:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logger.warning(f"Could not abort multipart upload of {key}: {str(e)}")
+        raise
+
+    return UploadResult(key=key, size=size, sha256=digest.hexdigest(), content_type=content_type)
+
+
+def _read_until(stream: BinaryIO, buffer: bytearray, part_size: int) -> bool:
+    """Read into buffer until it holds a full part; True if the stream ended first."""
+    while len(buffer) < part_size:
+        chunk = stream.read(min(READ_SIZE, part_size - len(buffer)))
+        if not chunk:
+            return True
+        buffer.extend(chunk)
+    return False
+
+
+def _upload_part(s3_client, bucket: str, key: str, upload_id: str, part_number: int, body: bytes) -> Dict:
+    response = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)
+    return {'PartNumber': part_number, 'ETag': response['ETag']}
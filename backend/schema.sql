@@ -39,6 +39,68 @@ CREATE TABLE IF NOT EXISTS search_history (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Shared cache of search results, keyed on normalized query, source(s) and limit (see backend/search_cache.py)
+CREATE TABLE IF NOT EXISTS search_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    query TEXT NOT NULL,
+    source TEXT NOT NULL,
+    result_limit INTEGER NOT NULL,
+    results JSONB NOT NULL,
+    fetched_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_accessed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    refreshing_until TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_search_cache_last_accessed ON search_cache(last_accessed_at);
+
+-- Abstract embeddings used to re-rank search results, keyed by paper id and model (see backend/embedding_store.py)
+CREATE TABLE IF NOT EXISTS paper_embeddings (
+    paper_id VARCHAR(255) NOT NULL,
+    model TEXT NOT NULL,
+    embedding BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (paper_id, model)
+);
+
+-- Paper metadata fetched by batch hydration, keyed by Semantic Scholar-style id (see backend/paper_metadata.py)
+CREATE TABLE IF NOT EXISTS paper_metadata (
+    paper_key VARCHAR(255) PRIMARY KEY,
+    metadata JSONB NOT NULL,
+    fetched_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Progress of resumable bulk loads, e.g. arXiv metadata snapshots (see backend/arxiv_ingest.py)
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+    source TEXT PRIMARY KEY,
+    records_done BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Background ingestion of uploaded files, claimed by workers with SKIP LOCKED (see backend/ingestion_jobs.py)
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    id VARCHAR(255) PRIMARY KEY,
+    user_id VARCHAR(255) NOT NULL,
+    file_id VARCHAR(255) NOT NULL,
+    file_name TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    s3_key TEXT NOT NULL,
+    content_sha256 CHAR(64),
+    status TEXT NOT NULL DEFAULT 'queued',
+    stage TEXT,
+    stages JSONB NOT NULL DEFAULT '{}',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result JSONB,
+    run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_runnable ON ingestion_jobs(created_at) WHERE status IN ('queued', 'running');
+
 -- Create paper downloads table
 CREATE TABLE IF NOT EXISTS paper_downloads (
     id SERIAL PRIMARY KEY,
@@ -69,6 +131,21 @@ CREATE TABLE IF NOT EXISTS user_files (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Library entries point at shared content by hash; duplicates reuse the first copy's S3 object
+ALTER TABLE user_files ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);
+
+-- One row per distinct stored file, with its extracted text and summary (see backend/content_store.py)
+CREATE TABLE IF NOT EXISTS content_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    s3_key TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    content_type TEXT NOT NULL,
+    extracted_text TEXT,
+    summary TEXT,
+    processing_until TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Create user_uploads table
 CREATE TABLE IF NOT EXISTS user_uploads (
     id SERIAL PRIMARY KEY,
@@ -126,14 +203,15 @@ BEGIN
         p_id, p_title, p_abstract, p_authors, p_year, p_venue,
         p_citations, p_url, p_pdf_path
     ) ON CONFLICT (id) DO UPDATE SET
+        -- Keep what we already know when a source sends a sparser copy of the paper
         title = EXCLUDED.title,
-        abstract = EXCLUDED.abstract,
-        authors = EXCLUDED.authors,
-        year = EXCLUDED.year,
-        venue = EXCLUDED.venue,
-        citations = EXCLUDED.citations,
-        url = EXCLUDED.url,
-        pdf_path = EXCLUDED.pdf_path,
+        abstract = COALESCE(EXCLUDED.abstract, papers.abstract),
+        authors = COALESCE(NULLIF(EXCLUDED.authors, '{}'), papers.authors),
+        year = COALESCE(EXCLUDED.year, papers.year),
+        venue = COALESCE(EXCLUDED.venue, papers.venue),
+        citations = COALESCE(EXCLUDED.citations, papers.citations),
+        url = COALESCE(EXCLUDED.url, papers.url),
+        pdf_path = COALESCE(EXCLUDED.pdf_path, papers.pdf_path),
         updated_at = CURRENT_TIMESTAMP;
 END;
 $$ LANGUAGE plpgsql;
@@ -156,5 +234,8 @@ CREATE INDEX IF NOT EXISTS idx_papers_year ON papers(year);
 CREATE INDEX IF NOT EXISTS idx_user_library_user_id ON user_library(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_library_paper_id ON user_library(paper_id);
 CREATE INDEX IF NOT EXISTS idx_user_files_user_id ON user_files(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_files_s3_key ON user_files(s3_key);
+CREATE INDEX IF NOT EXISTS idx_user_files_content_sha256 ON user_files(content_sha256);
+CREATE INDEX IF NOT EXISTS idx_content_blobs_s3_key ON content_blobs(s3_key);
 CREATE INDEX IF NOT EXISTS idx_user_uploads_user_id ON user_uploads(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_uploads_paper_id ON user_uploads(paper_id); 
\ No newline at end of file
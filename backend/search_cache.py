@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.errors
+
+from backend.db_pool import pooled_connection
+
+logger = logging.getLogger(__name__)
+
+
+def get_search_cache() -> Optional['SearchCache']:
+    """Process-wide SearchCache configured from the environment, or None if disabled."""
+    global _search_cache
+    if os.getenv('SEARCH_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache(
+                ttl_seconds=float(os.getenv('SEARCH_CACHE_TTL', '3600')),
+                stale_seconds=float(os.getenv('SEARCH_CACHE_STALE_TTL', '86400')),
+                max_entries=int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '10000')),
+                refresh_lock_seconds=float(os.getenv('SEARCH_CACHE_REFRESH_LOCK', '60'))
+            )
+    return _search_cache
+
+
+class SearchCache:
+    """
+    Postgres-backed cache of search results, shared by every worker process.
+
+    Entries are keyed on the normalized query, source(s) and result limit. An
+    entry is fresh for `ttl_seconds`; after that it is still served for up to
+    `stale_seconds` more while one worker (whichever claims the row first)
+    refreshes it in the background. At most `max_entries` rows are kept, evicting
+    the least recently accessed.
+    """
+    def __init__(self, ttl_seconds: float = 3600.0, stale_seconds: float = 86400.0, max_entries: int = 10000,
+                 refresh_lock_seconds: float = 60.0):
+        self.logger = logging.getLogger(__name__)
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.refresh_lock_seconds = refresh_lock_seconds
+        self.disabled = False
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return re.sub(r'\s+', ' ', str(query)).strip().lower()
+
+    def make_key(self, query: str, source: str, limit: int, offset: int = 0) -> str:
+        raw = f"{source}|{limit}|{offset}|{self.normalize(query)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[Dict[str, Any]], bool]]:
+        """Return (results, is_stale) for a usable entry, or None on a miss."""
+        row = None
+        with self._cursor() as cur:
+            if cur is None:
+                return None
+            cur.execute(
+                """
+                UPDATE search_cache
+                SET last_accessed_at = CURRENT_TIMESTAMP, hit_count = hit_count + 1
+                WHERE cache_key = %s
+                  AND fetched_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING results, fetched_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                """,
+                (key, self.ttl_seconds + self.stale_seconds, self.ttl_seconds)
+            )
+            row = cur.fetchone()
+        if not row:
+            return None
+        return row[0], bool(row[1])
+
+    def claim_refresh(self, key: str) -> bool:
+        """Claim the right to refresh a stale entry; only one worker gets it per lock period."""
+        with self._cursor() as cur:
+            if cur is None:
+                return False
+            cur.execute(
+                """
+                UPDATE search_cache
+                SET refreshing_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                WHERE cache_key = %s AND (refreshing_until IS NULL OR refreshing_until < CURRENT_TIMESTAMP)
+                RETURNING 1
+                """,
+                (self.refresh_lock_seconds, key)
+            )
+            return cur.fetchone() is not None
+
+    def set(self, key: str, query: str, source: str, limit: int, results: List[Dict[str, Any]]) -> None:
+        with self._cursor() as cur:
+            if cur is None:
+                return
+            cur.execute(
+                """
+                INSERT INTO search_cache (cache_key, query, source, result_limit, results)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    results = EXCLUDED.results,
+                    fetched_at = CURRENT_TIMESTAMP,
+                    last_accessed_at = CURRENT_TIMESTAMP,
+                    refreshing_until = NULL
+                """,
+                (key, self.normalize(query), source, limit, json.dumps(results, default=str))
+            )
+            # Prune now and then rather than on every write
+            if random.random() < 0.05:
+                self._prune(cur)
+
+    def _prune(self, cur) -> None:
+        cur.execute(
+            "DELETE FROM search_cache WHERE fetched_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+            (self.ttl_seconds + self.stale_seconds,)
+        )
+        cur.execute(
+            """
+            DELETE FROM search_cache WHERE cache_key IN (
+                SELECT cache_key FROM search_cache ORDER BY last_accessed_at DESC OFFSET %s
+            )
+            """,
+            (self.max_entries,)
+        )
+
+    @contextmanager
+    def _cursor(self):
+        """Yield a cursor on a pooled connection, or None if the cache is disabled or the database unavailable."""
+        if self.disabled:
+            yield None
+            return
+        with pooled_connection() as conn:
+            if conn is None:
+                yield None
+                return
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+            except psycopg2.errors.UndefinedTable:
+                self.logger.warning("search_cache table is missing (apply backend/schema.sql); disabling the search cache")
+                self.disabled = True
+            except psycopg2.Error as e:
+                self.logger.warning(f"Search cache query failed: {str(e)}")
+
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_lock = threading.Lock()
@@ -1,5 +1,5 @@
 from typing import Dict, Any, Optional
-import requests
+from utils.http import http_get
 
 class AgentDiscoveryService:
     def __init__(self, agentverse_client=None):
@@ -52,7 +52,7 @@ class AgentDiscoveryService:
         
         try:
             capabilities_url = agent.get('capabilities_endpoint')
-            response = requests.get(capabilities_url)
+            response = http_get(capabilities_url)
             return response.json()
         except Exception:
             return {}
@@ -1,7 +1,6 @@
 from typing import List, Dict, Any, Optional
 import numpy as np
-import torch
-from transformers import AutoTokenizer, AutoModel
+from models.embedding_service import get_embedding_service
 
 # 1) Import the new Pinecone client and (optionally) ServerlessSpec
 from pinecone import Pinecone, ServerlessSpec
@@ -15,9 +14,8 @@ class VectorKnowledgeBase:
         pinecone_region: str = 'us-east-1', # e.g. "us-west-2" or "us-east1-gcp"
         index_name: str = 'thesys-knowledge-base'
     ):
-        # Load tokenizer/model
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModel.from_pretrained(model_name)
+        # Shared, micro-batched encoder (same instance the agents use for this model)
+        self.embedding_service = get_embedding_service(model_name)
         
         # 2) Create a Pinecone client object
         self.pc = Pinecone(
@@ -44,12 +42,8 @@ class VectorKnowledgeBase:
         self.index = self.pc.Index(index_name)
 
     def _encode_text(self, text: str) -> np.ndarray:
-        with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors='pt',
-                                    truncation=True, max_length=512, padding=True)
-            outputs = self.model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)  # mean-pooling
-        return embeddings.numpy().astype('float32')
+        embeddings = self.embedding_service.encode([text])  # mean-pooled, shape (1, 384)
+        return embeddings.astype('float32')
 
     def store_document(self, document: str, metadata: Optional[Dict[str, Any]] = None):
         embedding = self._encode_text(document)
@@ -88,8 +82,7 @@ class VectorKnowledgeBase:
             source = connection.get('source')
             target = connection.get('target')
             if source and target:
-                source_embedding = self._encode_text(source)
-                target_embedding = self._encode_text(target)
+                source_embedding, target_embedding = self.embedding_service.encode([source, target])[:, None, :]
                 source_id = str(hash(source))
                 target_id = str(hash(target))
                 self.index.upsert(vectors=[
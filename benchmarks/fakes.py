@@ -0,0 +1,300 @@
+"""
+Local stand-ins for the upstream HTTP services, for benchmarking.
+
+One threaded HTTP server answers for all of them under path prefixes:
+
+    /arxiv/api/query                      arXiv Atom search feed
+    /s2/graph/v1/paper/search             Semantic Scholar search
+    /s2/graph/v1/paper/batch      (POST)  Semantic Scholar batch lookup
+    /s2/graph/v1/paper/<id>               Semantic Scholar paper
+    /news/v2/everything                   NewsAPI
+    /crossref/works[/<doi>]               CrossRef works
+    /openai/v1/chat/completions   (POST)  OpenAI-compatible chat (JSON or SSE stream)
+
+Each service sleeps for a configurable latency before answering, so the app's
+behaviour under slow upstreams can be measured without touching the network.
+
+    python -m benchmarks.fakes --port 9100 --latency openai=1.5 --latency arxiv=0.3
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+DEFAULT_LATENCIES = {
+    'arxiv': 0.2,
+    's2': 0.1,
+    'news': 0.1,
+    'crossref': 0.1,
+    'openai': 1.0,
+}
+
+_WORDS = (
+    'neural network transformer attention graph learning quantum protein climate model '
+    'retrieval language vision dataset benchmark optimization inference causal robust '
+    'sparse federated reinforcement diffusion embedding'
+).split()
+
+
+def _fake_papers(query: str, count: int) -> List[Dict]:
+    """Deterministic papers for a query, so repeated runs see the same data."""
+    seed = int(hashlib.sha256(query.encode('utf-8')).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    published = datetime(2015, 1, 1)
+    papers = []
+    for i in range(count):
+        words = rng.sample(_WORDS, 5)
+        papers.append({
+            'id': f"{2000 + seed % 500}.{10000 + i:05d}",
+            'title': f"{' '.join(words).title()} for {query}",
+            'abstract': ' '.join(rng.choice(_WORDS) for _ in range(120)),
+            'authors': [f"Author {rng.randint(1, 500)}" for _ in range(rng.randint(1, 6))],
+            'year': 2015 + rng.randint(0, 9),
+            'published': published + timedelta(days=rng.randint(0, 3500)),
+            'doi': f"10.5555/bench.{seed % 100000}.{i}",
+        })
+    return papers
+
+
+def _arxiv_feed(query: str, start: int, max_results: int, total: int = 50) -> str:
+    papers = _fake_papers(query, total)[start:start + max_results]
+    entries = []
+    for paper in papers:
+        stamp = paper['published'].strftime('%Y-%m-%dT%H:%M:%SZ')
+        authors = ''.join(f"<author><name>{escape(name)}</name></author>" for name in paper['authors'])
+        entries.append(f"""
+  <entry>
+    <id>http://arxiv.org/abs/{paper['id']}v1</id>
+    <updated>{stamp}</updated>
+    <published>{stamp}</published>
+    <title>{escape(paper['title'])}</title>
+    <summary>{escape(paper['abstract'])}</summary>
+    {authors}
+    <arxiv:doi>{paper['doi']}</arxiv:doi>
+    <link href="http://arxiv.org/abs/{paper['id']}v1" rel="alternate" type="text/html"/>
+    <link title="pdf" href="http://arxiv.org/pdf/{paper['id']}v1" rel="related" type="application/pdf"/>
+    <arxiv:primary_category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>""")
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <title>ArXiv Query: {escape(query)}</title>
+  <id>http://arxiv.org/api/bench</id>
+  <updated>{datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}</updated>
+  <opensearch:totalResults>{total}</opensearch:totalResults>
+  <opensearch:startIndex>{start}</opensearch:startIndex>
+  <opensearch:itemsPerPage>{max_results}</opensearch:itemsPerPage>{''.join(entries)}
+</feed>"""
+
+
+def _s2_paper(paper: Dict) -> Dict:
+    return {
+        'paperId': hashlib.sha1(paper['id'].encode('utf-8')).hexdigest(),
+        'externalIds': {'ArXiv': paper['id'], 'DOI': paper['doi']},
+        'title': paper['title'],
+        'abstract': paper['abstract'],
+        'authors': [{'name': name} for name in paper['authors']],
+        'year': paper['year'],
+        'venue': 'arXiv',
+        'citationCount': len(paper['abstract']) % 300,
+        'url': f"https://www.semanticscholar.org/paper/{paper['id']}",
+    }
+
+
+def _crossref_work(paper: Dict) -> Dict:
+    given_family = [name.split(' ', 1) for name in paper['authors']]
+    return {
+        'DOI': paper['doi'],
+        'title': [paper['title']],
+        'author': [{'given': parts[0], 'family': parts[-1]} for parts in given_family],
+        'issued': {'date-parts': [[paper['year']]]},
+        'container-title': ['Journal of Benchmarks'],
+        'type': 'journal-article',
+    }
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- dispatch ---
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        service = parsed.path.strip('/').split('/', 1)[0]
+        self.server.record(service)
+        time.sleep(self.server.latencies.get(service, 0.0))
+
+        if service == 'arxiv':
+            search = query.get('search_query', '').split(':', 1)[-1]
+            return self._send(200, _arxiv_feed(search, int(query.get('start', 0)), int(query.get('max_results', 10))), 'application/atom+xml')
+        if service == 's2':
+            return self._semantic_scholar(method, parsed.path, query, body)
+        if service == 'news':
+            articles = [{
+                'title': paper['title'],
+                'description': paper['abstract'][:200],
+                'url': f"https://news.example.org/{paper['id']}",
+                'source': {'name': 'Bench News'},
+                'publishedAt': paper['published'].isoformat() + 'Z',
+            } for paper in _fake_papers(query.get('q', ''), int(query.get('pageSize', 5)))]
+            return self._send_json(200, {'status': 'ok', 'totalResults': len(articles), 'articles': articles})
+        if service == 'crossref':
+            return self._crossref(parsed.path, query)
+        if service == 'openai' and parsed.path.endswith('/chat/completions'):
+            return self._chat_completion(body)
+        self._send_json(404, {'error': f"No fake for {parsed.path}"})
+
+    # --- services ---
+
+    def _semantic_scholar(self, method: str, path: str, query: Dict[str, str], body: Dict):
+        if path.endswith('/paper/search'):
+            papers = _fake_papers(query.get('query', ''), 50)
+            offset, limit = int(query.get('offset', 0)), int(query.get('limit', 10))
+            return self._send_json(200, {'total': len(papers), 'offset': offset, 'data': [_s2_paper(p) for p in papers[offset:offset + limit]]})
+        if method == 'POST' and path.endswith('/paper/batch'):
+            return self._send_json(200, [_s2_paper(_fake_papers(paper_id, 1)[0]) for paper_id in body.get('ids', [])])
+        paper_id = path.rsplit('/', 1)[-1]
+        return self._send_json(200, _s2_paper(_fake_papers(paper_id, 1)[0]))
+
+    def _crossref(self, path: str, query: Dict[str, str]):
+        parts = path.strip('/').split('/', 2)
+        if len(parts) == 3:
+            work = _crossref_work(_fake_papers(parts[2], 1)[0])
+            work['DOI'] = parts[2]
+            return self._send_json(200, {'status': 'ok', 'message': work})
+        rows = int(query.get('rows', 20))
+        items = [_crossref_work(p) for p in _fake_papers(query.get('query', query.get('filter', '')), rows)]
+        return self._send_json(200, {'status': 'ok', 'message': {'total-results': len(items), 'items': items}})
+
+    def _chat_completion(self, body: Dict):
+        model = body.get('model', 'gpt-3.5-turbo')
+        words = [random.choice(_WORDS) for _ in range(self.server.completion_words)]
+        created = int(time.time())
+        if not body.get('stream'):
+            return self._send_json(200, {
+                'id': 'chatcmpl-bench',
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(words)}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(words), 'total_tokens': len(words)},
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, word in enumerate(words):
+            chunk = {
+                'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            if self.server.token_interval:
+                time.sleep(self.server.token_interval)
+        self._write_chunk("data: [DONE]\n\n")
+        self._write_chunk('')
+
+    # --- helpers ---
+
+    def _write_chunk(self, text: str):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload):
+        self._send(status, json.dumps(payload), 'application/json')
+
+    def _send(self, status: int, text: str, content_type: str):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 9100, latencies: Optional[Dict[str, float]] = None, completion_words: int = 300, token_interval: float = 0.0):
+        super().__init__(('127.0.0.1', port), FakeUpstreamHandler)
+        self.latencies = {**DEFAULT_LATENCIES, **(latencies or {})}
+        self.completion_words = completion_words
+        self.token_interval = token_interval
+        self.calls: Dict[str, int] = {}
+        self._calls_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record(self, service: str):
+        with self._calls_lock:
+            self.calls[service] = self.calls.get(service, 0) + 1
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the app at this server."""
+        return {
+            'ARXIV_API_URL': f"{self.base_url}/arxiv/api/query",
+            'SEMANTIC_SCHOLAR_API_URL': f"{self.base_url}/s2/graph/v1",
+            'NEWS_API_URL': f"{self.base_url}/news/v2/everything",
+            'NEWS_API_KEY': 'bench',
+            'CROSSREF_API_URL': f"{self.base_url}/crossref/works",
+            'OPENAI_BASE_URL': f"{self.base_url}/openai/v1",
+            'OPENAI_API_KEY': 'bench',
+        }
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name='fake-upstreams', daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_latencies(values: List[str]) -> Dict[str, float]:
+    latencies = {}
+    for value in values or []:
+        service, _, seconds = value.partition('=')
+        latencies[service.strip()] = float(seconds)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake upstream APIs for benchmarking")
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', action='append', metavar='SERVICE=SECONDS', help=f"Per-service latency (services: {', '.join(DEFAULT_LATENCIES)})")
+    parser.add_argument('--completion-words', type=int, default=300, help="Words in each fake chat completion")
+    parser.add_argument('--token-interval', type=float, default=0.0, help="Seconds between streamed completion chunks")
+    args = parser.parse_args()
+
+    server = FakeUpstreamServer(args.port, parse_latencies(args.latency), args.completion_words, args.token_interval)
+    print(f"Fake upstreams on {server.base_url}")
+    for key, value in server.env().items():
+        print(f"  {key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
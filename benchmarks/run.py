@@ -0,0 +1,308 @@
+"""
+End-to-end load test for the API against local stand-ins.
+
+Boots the app (uvicorn api.asgi:app by default) with every upstream pointed at
+benchmarks/fakes.py, Postgres and S3 pointed at benchmarks/docker-compose.yml,
+then drives each scenario at a fixed concurrency and reports throughput and
+latency percentiles, plus the mean of each Server-Timing stage.
+
+    docker compose -f benchmarks/docker-compose.yml up -d --wait
+    python -m benchmarks.run --concurrency 16 --requests 200 --json results.json
+    python -m benchmarks.run --baseline results.json   # exit 1 on regression
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import DEFAULT_LATENCIES, FakeUpstreamServer, parse_latencies
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BENCH_USER = 'bench-user'
+TOPICS = ['graph neural networks', 'protein folding', 'climate model downscaling', 'sparse attention',
+          'causal inference', 'federated learning', 'quantum error correction', 'diffusion models']
+
+# Postgres and S3 from benchmarks/docker-compose.yml
+SERVICE_ENV = {
+    'DB_HOST': '127.0.0.1',
+    'DB_PORT': '55432',
+    'DB_NAME': 'thesys_bench',
+    'DB_USER': 'bench',
+    'DB_PASSWORD': 'bench',
+    'AWS_ENDPOINT_URL': 'http://127.0.0.1:55055',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'AWS_REGION': 'us-east-1',
+    'S3_BUCKET': 'thesys-bench',
+}
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    latency_ms: Dict[str, float]
+    stages_ms: Dict[str, float] = field(default_factory=dict)
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = min(len(sorted_values), max(1, math.ceil(pct / 100.0 * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+
+def _parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    stages = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                stages[name] = float(value)
+    return stages
+
+
+def _sample_pdf(text: str) -> bytes:
+    """A small single-page PDF with extractable text."""
+    content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return pdf
+
+
+# --- Scenarios: each sends request number i and returns the response ---
+
+async def _chat(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    topic = TOPICS[i % len(TOPICS)]
+    return await client.post('/api/chat', json={'message': f"What are recent results on {topic}? (variant {i})", 'temperature': 0.7})
+
+
+async def _search(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.post('/api/papers/search', json={'query': f"{TOPICS[i % len(TOPICS)]} {i}", 'user_id': BENCH_USER})
+
+
+async def _upload(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    pdf = _sample_pdf(f"Benchmark paper {i} about {TOPICS[i % len(TOPICS)]}")
+    return await client.post('/api/papers/upload', data={'user_id': BENCH_USER}, files={'file': (f"bench-{i}.pdf", pdf, 'application/pdf')})
+
+
+async def _library(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.get('/api/library/files', params={'user_id': BENCH_USER})
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]] = {
+    'chat': _chat,
+    'search': _search,
+    'upload': _upload,
+    'library': _library,
+}
+
+
+async def run_scenario(base_url: str, name: str, concurrency: int, total: int, timeout: float) -> ScenarioResult:
+    send = SCENARIOS[name]
+    latencies: List[float] = []
+    stage_totals: Dict[str, float] = {}
+    errors = 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    response = await send(client, i)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    response, ok = None, False
+                elapsed = (time.perf_counter() - started) * 1000
+                if not ok:
+                    errors += 1
+                    continue
+                latencies.append(elapsed)
+                for stage, ms in _parse_server_timing(response.headers.get('server-timing')).items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + ms
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+
+    latencies.sort()
+    return ScenarioResult(
+        name=name,
+        requests=total,
+        errors=errors,
+        seconds=round(seconds, 3),
+        throughput=round(len(latencies) / seconds, 2) if seconds else 0.0,
+        latency_ms={
+            'p50': round(_percentile(latencies, 50), 1),
+            'p90': round(_percentile(latencies, 90), 1),
+            'p95': round(_percentile(latencies, 95), 1),
+            'p99': round(_percentile(latencies, 99), 1),
+            'max': round(latencies[-1], 1) if latencies else 0.0,
+        },
+        stages_ms={stage: round(ms / len(latencies), 1) for stage, ms in stage_totals.items()} if latencies else {},
+    )
+
+
+def _ensure_bucket(env: Dict[str, str]) -> None:
+    import boto3
+
+    s3 = boto3.client(
+        's3',
+        endpoint_url=env['AWS_ENDPOINT_URL'],
+        aws_access_key_id=env['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=env['AWS_SECRET_ACCESS_KEY'],
+        region_name=env['AWS_REGION'],
+    )
+    try:
+        s3.create_bucket(Bucket=env['S3_BUCKET'])
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+
+def _start_app(server: str, port: int, workers: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    if server == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'api.asgi:app', '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', 'api.index:app', '--bind', f"127.0.0.1:{port}", '--workers', str(workers), '--threads', '8', '--timeout', '120']
+    log = open(log_path, 'w')
+    return subprocess.Popen(command, cwd=PROJECT_ROOT, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _wait_until_ready(base_url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/startup", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"App at {base_url} did not become ready within {timeout}s")
+
+
+def _print_results(results: List[ScenarioResult]) -> None:
+    print(f"\n{'scenario':<10}{'reqs':>6}{'errors':>8}{'rps':>9}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (latency in ms)")
+    for r in results:
+        lat = r.latency_ms
+        print(f"{r.name:<10}{r.requests:>6}{r.errors:>8}{r.throughput:>9.2f}{lat['p50']:>9.1f}{lat['p90']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}{lat['max']:>9.1f}")
+        if r.stages_ms:
+            print(f"{'':<10}stages: " + ', '.join(f"{stage}={ms:.1f}" for stage, ms in r.stages_ms.items()))
+
+
+def _regressions(results: List[ScenarioResult], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Compare p95 latency and throughput against a previous --json run."""
+    problems = []
+    for r in results:
+        previous = baseline.get(r.name)
+        if not previous:
+            continue
+        if previous['latency_ms']['p95'] and r.latency_ms['p95'] > previous['latency_ms']['p95'] * (1 + tolerance):
+            problems.append(f"{r.name}: p95 {previous['latency_ms']['p95']:.1f}ms -> {r.latency_ms['p95']:.1f}ms")
+        if previous['throughput'] and r.throughput < previous['throughput'] * (1 - tolerance):
+            problems.append(f"{r.name}: throughput {previous['throughput']:.2f} -> {r.throughput:.2f} req/s")
+        if r.errors > previous.get('errors', 0):
+            problems.append(f"{r.name}: errors {previous.get('errors', 0)} -> {r.errors}")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the API against local fakes")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset of: " + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+    parser.add_argument('--server', choices=['asgi', 'wsgi'], default='asgi', help="uvicorn api.asgi:app or gunicorn api.index:app")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help="Benchmark an already running app instead of starting one")
+    parser.add_argument('--fakes-port', type=int, default=9100)
+    parser.add_argument('--latency', action='append', metavar='SERVICE=SECONDS', help=f"Fake upstream latency (defaults: {DEFAULT_LATENCIES})")
+    parser.add_argument('--cache', action='store_true', help="Leave the chat response cache on (off by default so every request does full work)")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument('--json', dest='json_path', help="Write results to this file")
+    parser.add_argument('--baseline', help="Results file from a previous run; exit 1 if this run regresses")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed regression against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    fakes = FakeUpstreamServer(args.fakes_port, parse_latencies(args.latency))
+    fakes.start()
+    env = {**SERVICE_ENV, **fakes.env(), 'CHAT_CACHE_ENABLED': 'true' if args.cache else 'false', 'CHAT_WARMUP': 'true'}
+
+    app_process = None
+    base_url = args.url
+    try:
+        if not base_url:
+            _ensure_bucket(env)
+            base_url = f"http://127.0.0.1:{args.port}"
+            log_path = os.path.join(PROJECT_ROOT, 'benchmarks', 'app.log')
+            app_process = _start_app(args.server, args.port, args.workers, env, log_path)
+            print(f"Started {args.server} app on {base_url} (log: {log_path})")
+        _wait_until_ready(base_url, timeout=180)
+
+        results = []
+        for name in scenarios:
+            # One untimed request so lazy initialization isn't counted
+            asyncio.run(run_scenario(base_url, name, 1, 1, args.timeout))
+            print(f"Running {name}: {args.requests} requests at concurrency {args.concurrency}")
+            results.append(asyncio.run(run_scenario(base_url, name, args.concurrency, args.requests, args.timeout)))
+    finally:
+        if app_process:
+            app_process.terminate()
+            app_process.wait(timeout=30)
+        fakes.shutdown()
+
+    _print_results(results)
+    print(f"\nUpstream calls: {fakes.calls}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({r.name: asdict(r) for r in results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = _regressions(results, json.load(f), args.tolerance)
+        if problems:
+            print("\nRegressions against baseline:")
+            for problem in problems:
+                print(f"  {problem}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,8 +27,9 @@ const PaperUpload = ({ onUploadSuccess }) => {
 
     try {
       const formData = new FormData();
-      formData.append('file', file);
+      // user_id goes before the file: the server reads the fields while streaming the file to storage
       formData.append('user_id', 'current_user_id'); // Replace with actual user ID from auth context
+      formData.append('file', file);
 
       const response = await axios.post('http://localhost:5000/api/papers/upload', formData, {
         headers: {
@@ -303,8 +303,9 @@ export default function Chat() {
 
     try {
       const formData = new FormData();
-      formData.append('file', file);
+      // user_id goes before the file: the server reads the fields while streaming the file to storage
       formData.append('user_id', currentUser?.uid || 'anonymous');
+      formData.append('file', file);
 
       const uploadRes = await axios.post('http://127.0.0.1:5000/api/papers/upload', formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
@@ -60,8 +60,9 @@ const Library = () => {
       });
       
       const formData = new FormData();
-      formData.append('file', file);
+      // user_id goes before the file: the server reads the fields while streaming the file to storage
       formData.append('user_id', userId);
+      formData.append('file', file);
 
       const response = await axios.post('/api/papers/upload', formData, {
         headers: {
@@ -0,0 +1,58 @@
+"""
+gunicorn settings for the ASGI app, read from the working directory:
+
+    gunicorn api.asgi:app
+
+When MODEL_SERVER_SOCKET is set, the master also starts the shared model server
+(models/model_server.py) before forking the workers and supervises it: it is
+restarted if it exits or stops answering health checks.
+
+PDF extraction (models/pdf_extraction.py) keeps at most PDF_EXTRACT_PROCESSES
+processes busy across all workers; each worker's pool is sized from its share.
+
+Workers write Prometheus metrics to PROMETHEUS_MULTIPROC_DIR so /metrics adds up
+all of them (utils/metrics.py). The directory is emptied when the master starts,
+and a worker's live-only samples are dropped when it exits.
+"""
+import os
+import shutil
+
+# Before any worker imports prometheus_client, which picks its storage at import time
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/thesys-metrics')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Every worker runs ingestion jobs and so has a PDF extraction pool (models/pdf_extraction.py)
+os.environ.setdefault('PDF_EXTRACT_SHARED_BY', str(workers))
+
+_supervisor = None
+
+
+def on_starting(server):
+    global _supervisor
+    # Files from a previous run would be added to this run's counters
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+    socket_path = os.getenv('MODEL_SERVER_SOCKET')
+    if socket_path:
+        from models.model_server import ModelServerSupervisor
+        _supervisor = ModelServerSupervisor(
+            socket_path,
+            check_interval=float(os.getenv('MODEL_SERVER_CHECK_INTERVAL', '10')),
+            max_failures=int(os.getenv('MODEL_SERVER_MAX_FAILURES', '3'))
+        )
+        _supervisor.start()
+
+
+def on_exit(server):
+    if _supervisor is not None:
+        _supervisor.stop()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
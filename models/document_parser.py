@@ -1,10 +1,10 @@
 import json
 import pymupdf  # PyMuPDF
 import os
-import requests
 from bs4 import BeautifulSoup
 import re
 from crossref.restful import Works
+from utils.http import http_get
 
 def clean_text(text):
     # Remove headers/footers
@@ -198,7 +198,7 @@ def extract_pdf(pdf_path):
     return metadata
 
 def extract_site(url):
-    response = requests.get(url)
+    response = http_get(url)
     soup = BeautifulSoup(response.text, 'html.parser')
     
     # Remove non-content elements
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+
+class EmbeddingService:
+    """
+    Process-wide SentenceTransformer wrapper that micro-batches encode requests.
+
+    Callers on any thread (or event loop) submit texts and wait on a future; a
+    single worker thread drains the queue, waiting at most `max_wait_ms` for more
+    requests or until `max_batch_size` texts are collected, and encodes them in one
+    call so concurrent requests share a single forward pass.
+    """
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.model = SentenceTransformer(model_name)
+        logger.info(f"EmbeddingService loaded {model_name} (batch size {max_batch_size}, wait {max_wait_ms}ms)")
+
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=f"embedding-{model_name}", daemon=True)
+        self._worker.start()
+
+    def encode(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """Encode one text (returns a 1-D vector) or a list of texts (returns a 2-D array)."""
+        single = isinstance(texts, str)
+        embeddings = self.submit([texts] if single else list(texts)).result()
+        return embeddings[0] if single else embeddings
+
+    async def encode_async(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """Awaitable variant of encode that doesn't tie up an executor thread."""
+        single = isinstance(texts, str)
+        embeddings = await asyncio.wrap_future(self.submit([texts] if single else list(texts)))
+        return embeddings[0] if single else embeddings
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, self.dimension), dtype=np.float32))
+        else:
+            self._queue.put((texts, future))
+        return future
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _run(self) -> None:
+        while True:
+            # One bad batch (or a bug) must not end the thread: every later encode() would hang
+            try:
+                self._run_batch()
+            except Exception as e:
+                logger.error(f"Embedding worker error: {e}", exc_info=True)
+
+    def _run_batch(self) -> None:
+        batch = self._take_batch()
+        if not batch:
+            return
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        try:
+            embeddings = self.model.encode(texts, batch_size=self.max_batch_size, convert_to_numpy=True)
+        except Exception as e:
+            logger.error(f"Error encoding batch of {len(texts)} texts: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for item_texts, future in batch:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+    def _take_batch(self) -> List[Tuple[List[str], Future]]:
+        """Requests collected for one encode call, without those whose callers already gave up."""
+        batch = []
+        count = 0
+        deadline = None
+        while count < self.max_batch_size:
+            if deadline is None:
+                item = self._queue.get()
+                deadline = time.monotonic() + self.max_wait
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            # Marks the future running so it can no longer be cancelled; False if it already was
+            if item[1].set_running_or_notify_cancel():
+                batch.append(item)
+                count += len(item[0])
+        return batch
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def _canonical_model_name(model_name: str) -> str:
+    # 'sentence-transformers/all-MiniLM-L6-v2' and 'all-MiniLM-L6-v2' are the same model
+    return model_name.split('/', 1)[1] if model_name.startswith('sentence-transformers/') else model_name
+
+
+def get_local_embedding_service(model_name: str = DEFAULT_MODEL_NAME) -> EmbeddingService:
+    """Return the in-process EmbeddingService for a model, loading it on first use."""
+    key = _canonical_model_name(model_name)
+    with _services_lock:
+        if key not in _services:
+            _services[key] = EmbeddingService(
+                key,
+                max_batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', '32')),
+                max_wait_ms=float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5'))
+            )
+        return _services[key]
+
+
+def get_embedding_service(model_name: str = DEFAULT_MODEL_NAME):
+    """
+    Return the embedding service agents should use for a model.
+
+    When MODEL_SERVER_SOCKET is set, this is a client stub for the shared model
+    server (see models/model_server.py) and the model is never loaded in this
+    process; otherwise it is the in-process EmbeddingService.
+    """
+    socket_path = os.getenv('MODEL_SERVER_SOCKET')
+    if socket_path:
+        from models.model_server import RemoteEmbeddingService
+        return RemoteEmbeddingService(socket_path, _canonical_model_name(model_name))
+    return get_local_embedding_service(model_name)
+
+
+def get_tokenizer():
+    """Return the cl100k_base tokenizer, served by the model server when MODEL_SERVER_SOCKET is set."""
+    socket_path = os.getenv('MODEL_SERVER_SOCKET')
+    if socket_path:
+        from models.model_server import RemoteTokenizer
+        return RemoteTokenizer(socket_path)
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
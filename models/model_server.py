@@ -0,0 +1,352 @@
+"""
+Local model server shared by all web workers on a box.
+
+Loads the embedding model(s) and the cl100k_base tokenizer once and serves them
+over a Unix socket, so gunicorn workers only hold the web-app footprint. Set
+MODEL_SERVER_SOCKET in the workers' environment and get_embedding_service() /
+get_tokenizer() hand out the client stubs below instead of loading models.
+
+    python -m models.model_server --socket /tmp/thesys-models.sock
+
+In production the gunicorn master runs it under ModelServerSupervisor (see
+gunicorn.conf.py), which restarts it if it exits or stops answering pings.
+
+Wire format: each message is a 4-byte big-endian length followed by a JSON body.
+Embeddings are returned as base64-encoded float32 bytes with their shape.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+
+
+def _encode_message(payload: Dict[str, Any]) -> bytes:
+    data = json.dumps(payload).encode('utf-8')
+    return _HEADER.pack(len(data)) + data
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Model server connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_message(sock: socket.socket) -> Dict[str, Any]:
+    (length,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return json.loads(_recv_exactly(sock, length))
+
+
+def _pack_array(array: np.ndarray) -> Dict[str, Any]:
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {'shape': list(array.shape), 'data': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def _unpack_array(payload: Dict[str, Any]) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(payload['data']), dtype=np.float32).reshape(payload['shape'])
+
+
+# --- Server ---
+
+class _ModelRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # Clients keep their connection open and send requests one after another
+        while True:
+            try:
+                request = _recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                response = self.server.dispatch(request)
+            except Exception as e:
+                logger.error(f"Model server error handling {request.get('op')}: {e}")
+                response = {'error': str(e)}
+            self.request.sendall(_encode_message(response))
+
+
+class ModelServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, preload: Optional[List[str]] = None):
+        import tiktoken
+        from models.embedding_service import get_local_embedding_service
+
+        self._get_embedding_service = get_local_embedding_service
+        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        for model_name in preload or []:
+            self._get_embedding_service(model_name)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _ModelRequestHandler)
+        os.chmod(socket_path, 0o660)
+        logger.info(f"Model server listening on {socket_path}")
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get('op')
+        if op == 'embed':
+            # Requests from all workers land in the same micro-batching queue
+            embeddings = self._get_embedding_service(request['model']).encode(request['texts'])
+            return _pack_array(embeddings)
+        if op == 'dimension':
+            return {'dimension': self._get_embedding_service(request['model']).dimension}
+        if op == 'encode_tokens':
+            return {'tokens': self.tokenizer.encode(request['text'])}
+        if op == 'decode_tokens':
+            return {'text': self.tokenizer.decode(request['tokens'])}
+        if op == 'count_tokens':
+            return {'counts': [len(self.tokenizer.encode(text)) for text in request['texts']]}
+        if op == 'ping':
+            return {'status': 'ok'}
+        raise ValueError(f"Unknown model server op: {op}")
+
+
+# --- Client stubs ---
+
+class ModelServerClient:
+    """Blocking client with one persistent connection per thread, plus an asyncio variant."""
+    def __init__(self, socket_path: str, connect_timeout: float = 10.0):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        message = _encode_message(payload)
+        for attempt in range(2):
+            sock = self._get_socket()
+            try:
+                sock.sendall(message)
+                response = _recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                # Stale connection (e.g. the server restarted): reconnect once
+                self._local.sock = None
+                sock.close()
+                if attempt:
+                    raise
+        if 'error' in response:
+            raise RuntimeError(f"Model server error: {response['error']}")
+        return response
+
+    async def request_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            writer.write(_encode_message(payload))
+            await writer.drain()
+            (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+            response = json.loads(await reader.readexactly(length))
+        finally:
+            writer.close()
+        if 'error' in response:
+            raise RuntimeError(f"Model server error: {response['error']}")
+        return response
+
+    def _get_socket(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            return sock
+        # The server may still be loading models when workers start, so retry for a while
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                self._local.sock = sock
+                return sock
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+
+class RemoteEmbeddingService:
+    """Drop-in for EmbeddingService that encodes through the model server."""
+    def __init__(self, socket_path: str, model_name: str):
+        self.client = ModelServerClient(socket_path)
+        self.model_name = model_name
+        self._dimension: Optional[int] = None
+
+    def encode(self, texts: Union[str, List[str]]) -> np.ndarray:
+        single = isinstance(texts, str)
+        embeddings = _unpack_array(self.client.request({'op': 'embed', 'model': self.model_name, 'texts': [texts] if single else list(texts)}))
+        return embeddings[0] if single else embeddings
+
+    async def encode_async(self, texts: Union[str, List[str]]) -> np.ndarray:
+        single = isinstance(texts, str)
+        embeddings = _unpack_array(await self.client.request_async({'op': 'embed', 'model': self.model_name, 'texts': [texts] if single else list(texts)}))
+        return embeddings[0] if single else embeddings
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.client.request({'op': 'dimension', 'model': self.model_name})['dimension']
+        return self._dimension
+
+
+class RemoteTokenizer:
+    """Drop-in for the tiktoken cl100k_base Encoding (encode/decode) backed by the model server."""
+    def __init__(self, socket_path: str):
+        self.client = ModelServerClient(socket_path)
+
+    def encode(self, text: str) -> List[int]:
+        return self.client.request({'op': 'encode_tokens', 'text': text})['tokens']
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.client.request({'op': 'decode_tokens', 'tokens': list(tokens)})['text']
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return self.client.request({'op': 'count_tokens', 'texts': list(texts)})['counts']
+
+    # Coroutines must use these: the blocking calls above would stall the event loop
+    # for the round trip (or the reconnect wait while the server is down)
+
+    async def encode_async(self, text: str) -> List[int]:
+        return (await self.client.request_async({'op': 'encode_tokens', 'text': text}))['tokens']
+
+    async def decode_async(self, tokens: List[int]) -> str:
+        return (await self.client.request_async({'op': 'decode_tokens', 'tokens': list(tokens)}))['text']
+
+    async def count_tokens_async(self, texts: List[str]) -> List[int]:
+        return (await self.client.request_async({'op': 'count_tokens', 'texts': list(texts)}))['counts']
+
+
+# --- Supervision ---
+
+def ping(socket_path: str, timeout: float = 2.0) -> bool:
+    """True if a model server answers a ping on socket_path within timeout seconds."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(_encode_message({'op': 'ping'}))
+            return _recv_message(sock).get('status') == 'ok'
+    except (OSError, ValueError):
+        return False
+
+
+class ModelServerSupervisor:
+    """
+    Runs the model server as a child process and restarts it when it fails its health check.
+
+    The server is pinged every `check_interval` seconds. It is restarted if the
+    process has exited, or once it has answered before, after `max_failures`
+    missed pings in a row. Until its first answer it has `startup_timeout`
+    seconds to load its models. A server that keeps failing before it comes up
+    is restarted with exponential backoff, up to `max_backoff` seconds.
+    """
+    def __init__(self, socket_path: str, preload: Optional[List[str]] = None, check_interval: float = 10.0,
+                 ping_timeout: float = 2.0, max_failures: int = 3, startup_timeout: float = 300.0,
+                 max_backoff: float = 60.0):
+        self.socket_path = socket_path
+        self.preload = preload
+        self.check_interval = check_interval
+        self.ping_timeout = ping_timeout
+        self.max_failures = max_failures
+        self.startup_timeout = startup_timeout
+        self.max_backoff = max_backoff
+        self._process: Optional[subprocess.Popen] = None
+        self._started = 0.0
+        self._ready = False
+        self._failures = 0
+        # Restarts since the server last answered a ping
+        self._restarts = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._spawn()
+        self._thread = threading.Thread(target=self._watch, name='model-server-supervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._terminate(timeout)
+
+    def _spawn(self) -> None:
+        command = [sys.executable, '-m', 'models.model_server', '--socket', self.socket_path]
+        if self.preload is not None:
+            command += ['--preload', *self.preload]
+        self._process = subprocess.Popen(command)
+        self._started = time.monotonic()
+        self._ready = False
+        self._failures = 0
+        logger.info(f"Started model server (pid {self._process.pid}) on {self.socket_path}")
+
+    def _terminate(self, timeout: float) -> None:
+        process = self._process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _restart(self, reason: str) -> None:
+        self._terminate(self.ping_timeout)
+        delay = min(self.max_backoff, 2.0 ** self._restarts) if self._restarts else 0.0
+        logger.error(f"Model server {reason}; restarting it in {delay:.0f}s")
+        self._restarts += 1
+        if not self._stop.wait(delay):
+            self._spawn()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            returncode = self._process.poll()
+            if returncode is not None:
+                self._restart(f"exited with code {returncode}")
+            elif ping(self.socket_path, self.ping_timeout):
+                self._ready = True
+                self._failures = 0
+                self._restarts = 0
+            elif not self._ready:
+                if time.monotonic() - self._started > self.startup_timeout:
+                    self._restart(f"did not come up within {self.startup_timeout}s")
+            else:
+                self._failures += 1
+                if self._failures >= self.max_failures:
+                    self._restart(f"missed {self._failures} health checks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve embeddings and token counts over a Unix socket")
+    parser.add_argument('--socket', default=os.getenv('MODEL_SERVER_SOCKET', '/tmp/thesys-models.sock'))
+    parser.add_argument('--preload', nargs='*', default=['all-MiniLM-L6-v2'], help="Embedding models to load at startup")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = ModelServer(args.socket, preload=args.preload)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
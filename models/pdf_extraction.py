@@ -0,0 +1,227 @@
+"""
+Page-level PDF text extraction.
+
+Text is extracted page by page with PyMuPDF when it is installed (it is several
+times faster than PyPDF2, which is the fallback). Documents of at least
+PDF_PARALLEL_MIN_PAGES pages are split into page ranges that are extracted in a
+shared process pool, so a long thesis or textbook uses several cores instead of
+one and doesn't hold the GIL for the threads serving requests. The pool reads
+the PDF from a temporary file, so it is not pickled to each worker.
+
+PDF_EXTRACT_PROCESSES caps the extraction processes busy at once on the whole
+host, however many gunicorn workers run ingestion jobs. Each page range holds
+one of that many slots (a flock'd file under PDF_EXTRACT_DIR) while it runs, and
+a document waits until at least one slot is free. Each worker's pool has its
+share of the budget (gunicorn.conf.py sets PDF_EXTRACT_SHARED_BY to the worker
+count) but at least two processes, so a worker can still spread a document over
+the slots that happen to be free.
+
+The result keeps each page's offsets into the joined text, for callers that
+need to map a passage back to its page.
+"""
+import fcntl
+import io
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+import PyPDF2
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+logger = logging.getLogger(__name__)
+
+# Extraction processes busy at once on the host
+HOST_PROCESSES = int(os.getenv('PDF_EXTRACT_PROCESSES', str(min(os.cpu_count() or 1, 8))))
+# This process's pool: its share of the host budget, but two if the host has them
+PROCESSES = min(HOST_PROCESSES, max(2, HOST_PROCESSES // max(1, int(os.getenv('PDF_EXTRACT_SHARED_BY', '1')))))
+SLOT_DIR = os.getenv('PDF_EXTRACT_DIR', os.path.join(tempfile.gettempdir(), 'thesys-pdf-extract'))
+# How often a document waiting for a free slot checks again
+SLOT_POLL_INTERVAL = 0.05
+# Smaller documents are extracted in the calling thread; the pool's overhead isn't worth it
+PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '24'))
+# Fewest pages handed to one worker
+MIN_RANGE_PAGES = 8
+PAGE_SEPARATOR = '\n'
+
+
+@dataclass
+class PageText:
+    number: int
+    start: int
+    end: int
+
+
+@dataclass
+class ExtractedText:
+    text: str
+    pages: List[PageText]
+    engine: str
+
+    def page_text(self, number: int) -> str:
+        page = self.pages[number]
+        return self.text[page.start:page.end]
+
+
+def extract_pdf_text(pdf_data: bytes, parallel: Optional[bool] = None) -> ExtractedText:
+    """Text of every page of a PDF. `parallel` forces (True) or disables (False) the process
+    pool; by default it is used from PARALLEL_MIN_PAGES pages on. Raises if the PDF can't be
+    opened; a page that fails to extract is logged and left empty."""
+    engine = 'pymupdf' if pymupdf is not None else 'pypdf2'
+    page_count = _page_count(pdf_data)
+    if parallel is None:
+        parallel = PROCESSES > 1 and page_count >= PARALLEL_MIN_PAGES
+
+    pages = None
+    if parallel and page_count > 1:
+        try:
+            pages = _extract_parallel(pdf_data, page_count)
+        except BrokenProcessPool as e:
+            logger.warning(f"PDF extraction pool failed, extracting in process: {str(e)}")
+            _reset_pool()
+    if pages is None:
+        pages = _extract_range(pdf_data, 0, page_count)
+    return _join(pages, engine)
+
+
+def _extract_parallel(pdf_data: bytes, page_count: int) -> List[str]:
+    slots = _host_slots.acquire(len(_page_ranges(page_count, PROCESSES)))
+    try:
+        # As many ranges as this document got slots for
+        ranges = _page_ranges(page_count, len(slots) if slots is not None else PROCESSES)
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(pdf_data)
+            f.flush()
+            futures = [_get_pool().submit(_extract_range, f.name, start, stop) for start, stop in ranges]
+            pages: List[str] = []
+            for future in futures:
+                pages.extend(future.result())
+        return pages
+    finally:
+        _host_slots.release(slots)
+
+
+def _page_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Contiguous [start, stop) ranges splitting the pages evenly over at most `workers`."""
+    size = max(MIN_RANGE_PAGES, math.ceil(page_count / workers))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _page_count(source: Union[bytes, str]) -> int:
+    if pymupdf is not None:
+        with _open_pymupdf(source) as doc:
+            return doc.page_count
+    return len(_open_pypdf2(source).pages)
+
+
+def _extract_range(source: Union[bytes, str], start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) of a PDF given as bytes or a file path. Runs in pool workers."""
+    pages = []
+    if pymupdf is not None:
+        with _open_pymupdf(source) as doc:
+            for number in range(start, stop):
+                pages.append(_page_or_empty(lambda: doc[number].get_text(), number))
+    else:
+        reader = _open_pypdf2(source)
+        for number in range(start, stop):
+            pages.append(_page_or_empty(lambda: reader.pages[number].extract_text(), number))
+    return pages
+
+
+def _page_or_empty(extract, number: int) -> str:
+    try:
+        return extract() or ''
+    except Exception as e:
+        logger.warning(f"Could not extract text from page {number + 1}: {str(e)}")
+        return ''
+
+
+def _open_pymupdf(source: Union[bytes, str]):
+    return pymupdf.open(stream=source, filetype='pdf') if isinstance(source, bytes) else pymupdf.open(source)
+
+
+def _open_pypdf2(source: Union[bytes, str]) -> PyPDF2.PdfReader:
+    return PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def _join(pages: List[str], engine: str) -> ExtractedText:
+    """One string for the whole document (built once, not by repeated concatenation) plus page offsets."""
+    offsets = []
+    position = 0
+    for number, text in enumerate(pages):
+        offsets.append(PageText(number=number, start=position, end=position + len(text)))
+        position += len(text) + len(PAGE_SEPARATOR)
+    return ExtractedText(text=PAGE_SEPARATOR.join(pages), pages=offsets, engine=engine)
+
+
+class _HostSlots:
+    """The host-wide budget of busy extraction processes: `slots` files under `slot_dir`, each
+    held with an exclusive flock by the range running in it. Unlimited if the files can't be opened."""
+    def __init__(self, slots: int, slot_dir: str):
+        self.slots = slots
+        self.slot_dir = slot_dir
+        self._unavailable = False
+
+    def acquire(self, wanted: int) -> Optional[List[int]]:
+        """Hold up to `wanted` free slots, waiting until there is at least one; None if unlimited."""
+        if self._unavailable:
+            return None
+        while True:
+            held: List[int] = []
+            for number in range(self.slots):
+                if len(held) == wanted:
+                    break
+                try:
+                    os.makedirs(self.slot_dir, exist_ok=True)
+                    fd = os.open(os.path.join(self.slot_dir, f"slot-{number}"), os.O_RDWR | os.O_CREAT, 0o666)
+                except OSError as e:
+                    logger.warning(f"PDF extraction slots are not shareable, not limiting per host: {str(e)}")
+                    self._unavailable = True
+                    self.release(held)
+                    return None
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    held.append(fd)
+                except BlockingIOError:
+                    os.close(fd)
+            if held:
+                return held
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    def release(self, held: Optional[List[int]]) -> None:
+        for fd in held or ():
+            # Closing the descriptor drops its flock
+            os.close(fd)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the API and ingestion workers are multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_host_slots = _HostSlots(HOST_PROCESSES, SLOT_DIR)
@@ -0,0 +1,145 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models.embedding_service import get_tokenizer
+
+# Words that carry no signal when scoring relevance against the user's query
+_STOP_WORDS = {
+    'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'any', 'can', 'her', 'was', 'one',
+    'our', 'out', 'has', 'have', 'had', 'how', 'what', 'when', 'where', 'which', 'who', 'why',
+    'this', 'that', 'these', 'those', 'with', 'from', 'into', 'about', 'tell', 'show', 'does',
+    'paper', 'papers', 'research', 'study', 'find', 'their', 'there', 'they', 'them', 'than'
+}
+
+
+def _terms(text: str) -> set:
+    return {t for t in re.findall(r'[a-z0-9]+', str(text).lower()) if len(t) > 2 and t not in _STOP_WORDS}
+
+
+class PromptPacker:
+    """
+    Fits prompt sections into a token budget using the cl100k_base tokenizer.
+
+    Candidate items (searched papers, uploaded-file summaries, document chunks) are
+    ranked by term overlap with the query; the most relevant are taken whole while
+    they fit and the first one that doesn't is trimmed to the remaining budget.
+    Items are returned in their original order so document flow is preserved.
+    """
+    def __init__(self, encoder=None):
+        self.encoder = encoder or get_tokenizer()
+
+    def count_tokens(self, text: str) -> int:
+        return self.count_tokens_batch([text])[0]
+
+    def count_tokens_batch(self, texts: Sequence[str]) -> List[int]:
+        """Token counts of several texts; one round trip when the tokenizer is the model server's."""
+        texts = [text or '' for text in texts]
+        if not texts:
+            return []
+        if hasattr(self.encoder, 'count_tokens'):
+            return self.encoder.count_tokens(texts)
+        return [len(self.encoder.encode(text)) for text in texts]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens tokens, marking the cut with an ellipsis."""
+        tokens = self.encoder.encode(text or '')
+        if len(tokens) <= max_tokens:
+            return text
+        if max_tokens <= 1:
+            return ''
+        return self.encoder.decode(tokens[:max_tokens - 1]).rstrip() + '...'
+
+    def relevance(self, query: str, text: str) -> float:
+        """Share of the query's terms that appear in the text."""
+        query_terms = _terms(query)
+        if not query_terms:
+            return 0.0
+        return len(query_terms & _terms(text)) / len(query_terms)
+
+    def select(self, query: str, items: Sequence[str], budget: int, min_item_tokens: int = 40) -> List[str]:
+        """Pick and trim items by relevance to the query so they fit within budget tokens."""
+        chosen = self._select_indices(query, items, budget, min_item_tokens)
+        return [chosen[i] for i in sorted(chosen)]
+
+    def pack(self, query: str, groups: Dict[str, Sequence[str]], budget: int, max_query_share: float = 0.25) -> Tuple[str, Dict[str, List[str]]]:
+        """
+        Pack the query and several groups of candidate items into one budget.
+
+        The query is trimmed to at most `max_query_share` of the budget; the rest is
+        shared across all groups by relevance. Returns the (possibly trimmed) query
+        and the selected items for each group.
+        """
+        packed_query = self.truncate(query, max(1, int(budget * max_query_share)))
+        remaining = budget - self.count_tokens(packed_query)
+
+        # Select across groups together so the most relevant items win regardless of source
+        flat: List[Tuple[str, str]] = [(name, item) for name, items in groups.items() for item in items]
+        chosen = self._select_indices(packed_query, [item for _, item in flat], remaining)
+
+        packed: Dict[str, List[str]] = {name: [] for name in groups}
+        for i in sorted(chosen):
+            packed[flat[i][0]].append(chosen[i])
+        return packed_query, packed
+
+    def _select_indices(self, query: str, items: Sequence[str], budget: int, min_item_tokens: int = 40) -> Dict[int, str]:
+        if budget <= 0 or not items:
+            return {}
+
+        # Rank by relevance; ties keep document order so the opening of a text wins
+        ranked = sorted(range(len(items)), key=lambda i: (-self.relevance(query, items[i]), i))
+        counts = self.count_tokens_batch(items)
+        chosen: Dict[int, str] = {}
+        remaining = budget
+        for i in ranked:
+            # One extra token per item for the separator it is joined with
+            cost = counts[i] + 1
+            if cost <= remaining:
+                chosen[i] = items[i]
+                remaining -= cost
+            elif remaining - 1 >= min_item_tokens:
+                chosen[i] = self.truncate(items[i], remaining - 1)
+                remaining = 0
+            if remaining < min_item_tokens:
+                break
+        return chosen
+
+    def chunk(self, text: str, chunk_tokens: int = 400) -> List[str]:
+        """Split text on paragraph boundaries into chunks of roughly chunk_tokens tokens."""
+        paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text or '') if p.strip()]
+        chunks: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for paragraph, paragraph_tokens in zip(paragraphs, self.count_tokens_batch(paragraphs)):
+            if paragraph_tokens > chunk_tokens:
+                # Very long paragraphs (common in extracted PDF text) are split by token windows
+                if current:
+                    chunks.append('\n\n'.join(current))
+                    current, current_tokens = [], 0
+                tokens = self.encoder.encode(paragraph)
+                chunks.extend(self.encoder.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens), chunk_tokens))
+                continue
+            if current and current_tokens + paragraph_tokens > chunk_tokens:
+                chunks.append('\n\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(paragraph)
+            current_tokens += paragraph_tokens
+        if current:
+            chunks.append('\n\n'.join(current))
+        return chunks
+
+    def fit_document(self, text: str, query: str, budget: int, chunk_tokens: int = 400) -> str:
+        """Reduce a document to the chunks most relevant to the query that fit in budget tokens."""
+        if self.count_tokens(text) <= budget:
+            return text
+        return '\n\n'.join(self.select(query, self.chunk(text, chunk_tokens), budget))
+
+
+_default_packer: Optional[PromptPacker] = None
+
+
+def get_prompt_packer() -> PromptPacker:
+    """Process-wide packer, so the tokenizer is only loaded once."""
+    global _default_packer
+    if _default_packer is None:
+        _default_packer = PromptPacker()
+    return _default_packer
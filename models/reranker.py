@@ -0,0 +1,58 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from backend.embedding_store import get_embedding_store
+from models.embedding_service import DEFAULT_MODEL_NAME, _canonical_model_name, get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+# Characters of title + abstract embedded per paper; the model truncates at 256 word pieces anyway
+_MAX_TEXT_CHARS = 2000
+
+
+class SearchReranker:
+    """
+    Re-orders search results by embedding similarity to the query.
+
+    The query and every candidate whose abstract embedding isn't stored yet are
+    encoded in a single batch; stored embeddings come from the EmbeddingStore, and
+    new ones are added to it, so a paper is only ever encoded once per model.
+    Scores are cosine similarities over the stacked candidate matrix.
+    """
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, embedding_service=None, store=None):
+        self.logger = logging.getLogger(__name__)
+        self.model_name = _canonical_model_name(model_name)
+        self.embedding_service = embedding_service or get_embedding_service(self.model_name)
+        self.store = store or get_embedding_store(self.model_name)
+
+    @staticmethod
+    def paper_text(paper: Dict[str, Any]) -> str:
+        return f"{paper.get('title') or ''}. {paper.get('abstract') or ''}"[:_MAX_TEXT_CHARS]
+
+    async def rerank(self, query: str, papers: List[Dict[str, Any]], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Papers sorted by similarity to the query (best first), each with a 'relevance' score."""
+        if len(papers) < 2:
+            return papers[:limit] if limit else papers
+        loop = asyncio.get_running_loop()
+        ids = [str(paper.get('id') or self.paper_text(paper)) for paper in papers]
+        stored = await loop.run_in_executor(None, self.store.get_many, ids)
+
+        missing = [i for i, paper_id in enumerate(ids) if paper_id not in stored]
+        encoded = await self.embedding_service.encode_async([query] + [self.paper_text(papers[i]) for i in missing])
+        encoded = np.asarray(encoded, dtype=np.float32)
+        query_vector = encoded[0]
+        new_vectors = {ids[i]: encoded[1 + n] for n, i in enumerate(missing)}
+        if new_vectors:
+            loop.run_in_executor(None, self.store.put_many, new_vectors)
+
+        matrix = np.vstack([new_vectors.get(paper_id, stored.get(paper_id)) for paper_id in ids])
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+        scores = (matrix @ query_vector) / np.where(norms == 0, 1.0, norms)
+
+        order = np.argsort(-scores, kind='stable')
+        if limit:
+            order = order[:limit]
+        return [{**papers[i], 'relevance': round(float(scores[i]), 4)} for i in order]
@@ -1,22 +1,38 @@
 import openai as oa
 import os
-import nltk
 import re
-from typing import Union, List
+import threading
+from typing import Optional, Union, List
 import yake
 from utils.config import Config
-# Load OpenAI API key
-client = oa.Client()
-# Strip any whitespace or newline characters from the API key
-api_key = Config.OPENAI_API_KEY
-if api_key:
-    api_key = api_key.strip()
-client.api_key = api_key
-# Download required NLTK resources
-nltk.download('stopwords')
-nltk.download('punkt')
+from models.prompt_packer import get_prompt_packer
 
-def generate_summary(text: str, prompt, discipline) -> dict:
+_client = None
+_client_lock = threading.Lock()
+
+def _get_client() -> oa.Client:
+    """Create the OpenAI client on first use instead of at import time."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            client = oa.Client()
+            # Strip any whitespace or newline characters from the API key
+            api_key = Config.OPENAI_API_KEY
+            if api_key:
+                api_key = api_key.strip()
+            client.api_key = api_key
+            _client = client
+        return _client
+
+# Input token budget for the document text sent to the summarization model
+SUMMARY_INPUT_TOKENS = int(os.getenv('SUMMARY_INPUT_TOKENS', '12000'))
+# Characters at the start of a document taken as its title and abstract
+OPENING_CHARS = 2000
+
+def generate_summary(text: str, prompt, discipline, title: Optional[str] = None) -> dict:
+    # Long documents are reduced to the passages closest to what the paper is about:
+    # its title if known, otherwise its opening (title and abstract)
+    text = get_prompt_packer().fit_document(text, title or text[:OPENING_CHARS], SUMMARY_INPUT_TOKENS)
     structure = "Title of the Paper:&delete \
                 Research Question (What was the primary focus of research?):&delete \
                 Key Findings (What were the main findings?):&delete \
@@ -24,7 +40,7 @@ def generate_summary(text: str, prompt, discipline) -> dict:
                 Contradictions (Analyze the paper fully. Are there any shortcomings or flaws that need to be addressed?):&delete \
                 Additional Notes (What other information is relevant?):&delete \
                 Gaps in literature (How can the user improve the field through their research based on the subject matter provided?):&delete "
-    response = client.chat.completions.create(model="gpt-4o",
+    response = _get_client().chat.completions.create(model="gpt-4o",
                                               max_tokens=1500,
                                               temperature=0.3,
                                               messages=[{'role': 'assistant', 
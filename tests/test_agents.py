@@ -0,0 +1,535 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import arxiv
+import pytest
+import requests
+
+from agents.scholar_agent import agent as scholar_agent_module
+from agents.scholar_agent.agent import RateLimitedArxivClient, ScholarAgent
+from agents.scholar_agent.utils import decode_cursor, encode_cursor, merge_paper_results, normalize_arxiv_id, paper_keys
+from backend.s3_upload import SizeLimitExceeded, UploadResult
+from backend.search_cache import SearchCache
+from utils.rate_limit import RateLimited, RateLimiter
+
+
+def _paper(title, **fields):
+    return {'title': title, **fields}
+
+
+def test_normalize_arxiv_id_strips_version_and_url():
+    assert normalize_arxiv_id('2101.00001') == '2101.00001'
+    assert normalize_arxiv_id('2101.00001v3') == '2101.00001'
+    assert normalize_arxiv_id('http://arxiv.org/abs/2101.00001v2') == '2101.00001'
+    assert normalize_arxiv_id('https://arxiv.org/pdf/2101.12345v1.pdf') == '2101.12345'
+    assert normalize_arxiv_id('hep-th/9901001v1') == 'hep-th/9901001'
+
+
+def test_normalize_arxiv_id_rejects_other_values():
+    assert normalize_arxiv_id(None) is None
+    assert normalize_arxiv_id('') is None
+    assert normalize_arxiv_id('10.1000/xyz123') is None
+
+
+def test_paper_keys_cover_doi_arxiv_id_and_title():
+    paper = _paper('Attention Is  All You Need!', doi='10.5555/ABC', arxiv_id='http://arxiv.org/abs/1706.03762v5')
+    assert paper_keys(paper) == ['doi:10.5555/abc', 'arxiv:1706.03762', 'title:attention is all you need']
+    assert paper_keys({'title': ''}) == []
+
+
+def test_merge_interleaves_sources_by_rank():
+    merged = merge_paper_results({
+        'arxiv': [_paper('A1'), _paper('A2'), _paper('A3')],
+        'semantic_scholar': [_paper('S1')],
+    })
+    assert [paper['title'] for paper in merged] == ['A1', 'S1', 'A2', 'A3']
+    assert merged[1]['sources'] == ['semantic_scholar']
+
+
+def test_merge_respects_limit():
+    merged = merge_paper_results({'arxiv': [_paper('A1'), _paper('A2')], 'semantic_scholar': [_paper('S1')]}, limit=2)
+    assert [paper['title'] for paper in merged] == ['A1', 'S1']
+
+
+def test_merge_dedupes_by_doi():
+    merged = merge_paper_results({
+        'crossref': [_paper('Deep Learning', doi='10.1038/nature14539')],
+        'semantic_scholar': [_paper('Deep learning (review)', doi='10.1038/NATURE14539', citations=50000)],
+    })
+    assert len(merged) == 1
+    assert merged[0]['title'] == 'Deep Learning'
+    assert merged[0]['citations'] == 50000
+    assert merged[0]['sources'] == ['crossref', 'semantic_scholar']
+
+
+def test_merge_dedupes_by_arxiv_id_across_versions():
+    merged = merge_paper_results({
+        'arxiv': [_paper('BERT', arxiv_id='http://arxiv.org/abs/1810.04805v2')],
+        'semantic_scholar': [_paper('BERT: Pre-training of Deep Bidirectional Transformers', arxiv_id='1810.04805')],
+    })
+    assert len(merged) == 1
+    assert merged[0]['sources'] == ['arxiv', 'semantic_scholar']
+
+
+def test_merge_dedupes_by_normalized_title_and_fills_missing_fields():
+    merged = merge_paper_results({
+        'arxiv': [_paper('Graph Attention Networks', abstract='', year=None)],
+        'semantic_scholar': [_paper('graph attention networks.', abstract='We present GATs.', year=2018)],
+    })
+    assert len(merged) == 1
+    assert merged[0]['abstract'] == 'We present GATs.'
+    assert merged[0]['year'] == 2018
+
+
+def test_merge_keeps_duplicate_at_its_best_rank():
+    merged = merge_paper_results({
+        'arxiv': [_paper('A1'), _paper('Shared')],
+        'semantic_scholar': [_paper('Shared'), _paper('S2')],
+    })
+    assert [paper['title'] for paper in merged] == ['A1', 'Shared', 'S2']
+
+
+def test_merge_links_keys_learned_from_other_copies():
+    # The second copy adds the DOI, so a third copy matching only by DOI joins the same entry
+    merged = merge_paper_results({
+        'arxiv': [_paper('Paper One', arxiv_id='2001.00001')],
+        'semantic_scholar': [_paper('Paper One', doi='10.1/one')],
+        'crossref': [_paper('Paper One (Journal Version)', doi='10.1/one')],
+    })
+    assert len(merged) == 1
+    assert merged[0]['sources'] == ['arxiv', 'semantic_scholar', 'crossref']
+
+
+class _FakeIndex:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def search(self, query, limit=10, offset=0):
+        return [dict(row) for row in self.rows[offset:offset + limit]]
+
+
+def _agent(local_rows, upstream, window=4, min_results=2):
+    """A ScholarAgent over an in-memory local index and upstream result list, without its clients."""
+    agent = ScholarAgent.__new__(ScholarAgent)
+    agent.paper_index = _FakeIndex(local_rows)
+    agent.local_min_results = min_results
+    agent.search_window = window
+
+    async def search_window(query, index):
+        return [dict(paper) for paper in upstream[index * window:(index + 1) * window]]
+
+    agent._search_window = search_window
+    return agent
+
+
+def _titles(page):
+    return [paper['title'] for paper in page['papers']]
+
+
+def test_local_page_merges_copies_of_the_same_paper():
+    rows = [
+        _paper('Paper A', id='http://arxiv.org/abs/2101.00001v1', arxiv_id='2101.00001'),
+        _paper('Paper A', id='0f1e2d3c', abstract='From Semantic Scholar'),
+        _paper('Paper B'),
+        _paper('Paper C'),
+        _paper('Paper D'),
+    ]
+    page = asyncio.run(_agent(rows, []).search_papers_page('q', 3))
+    assert _titles(page) == ['Paper A', 'Paper B', 'Paper C']
+    assert page['papers'][0]['abstract'] == 'From Semantic Scholar'
+    assert _titles(asyncio.run(_agent(rows, []).search_papers_page('q', 3, page['next_cursor']))) == ['Paper D']
+
+
+def test_short_local_page_is_filled_from_upstream():
+    rows = [_paper('Local 1'), _paper('Local 2')]
+    upstream = [_paper('Local 1'), _paper('Up 1'), _paper('Up 2'), _paper('Up 3')]
+    page = asyncio.run(_agent(rows, upstream).search_papers_page('q', 4))
+    assert _titles(page) == ['Local 1', 'Local 2', 'Up 1', 'Up 2']
+
+
+def test_thin_local_page_defers_to_upstream():
+    rows = [_paper('Local 1')]
+    upstream = [_paper('Up 1'), _paper('Up 2')]
+    assert _titles(asyncio.run(_agent(rows, upstream).search_papers_page('q', 4))) == ['Up 1', 'Up 2']
+    assert _titles(asyncio.run(_agent(rows, []).search_papers_page('q', 4))) == ['Local 1']
+
+
+def test_cursor_round_trip():
+    state = {'src': 'upstream', 'window': 2, 'index': 7, 'skip': 12, 'seen': ['0a1b2c3d']}
+    cursor = encode_cursor(state)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == state
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    encode_cursor({'src': 'local', 'offset': 10})[:-3] + '!!!',
+    encode_cursor({'src': 'elsewhere', 'offset': 0}),
+    encode_cursor({'offset': 10}),
+])
+def test_decode_cursor_rejects_tampered_or_unknown_cursors(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor)
+
+
+def test_search_papers_page_rejects_a_bad_cursor():
+    with pytest.raises(ValueError):
+        asyncio.run(_agent([], []).search_papers_page('q', 3, encode_cursor({'src': 'elsewhere'})))
+
+
+def _all_pages(agent, page_size):
+    titles, cursor = [], None
+    while True:
+        page = asyncio.run(agent.search_papers_page('q', page_size, cursor))
+        titles.extend(_titles(page))
+        cursor = page['next_cursor']
+        if cursor is None:
+            return titles
+
+
+@pytest.mark.parametrize('page_size', [1, 2, 3, 5, 8])
+def test_pages_cover_local_then_upstream_without_repeats_or_gaps(page_size):
+    local = [_paper(f'Local {i}') for i in range(7)]
+    # A duplicate local row, and upstream results that repeat some local papers
+    local.insert(3, _paper('Local 1', id='s2-copy'))
+    upstream = [
+        _paper('Up 0'), _paper('Local 2'), _paper('Up 1'), _paper('Up 2'),
+        _paper('Local 6'), _paper('Up 3'), _paper('Up 4'), _paper('Local 0'),
+        _paper('Up 5'),
+    ]
+    titles = _all_pages(_agent(local, upstream, window=4), page_size)
+    assert titles == [f'Local {i}' for i in range(7)] + [f'Up {i}' for i in range(6)]
+
+
+def test_stream_closed_early_cancels_and_awaits_slow_sources():
+    agent = _agent([], [])
+    agent.search_sources = ['arxiv', 'semantic_scholar']
+    agent.search_cache = None
+    agent.source_timeouts = {}
+    finished = []
+
+    async def fast(query, max_results, offset=0):
+        return [_paper('Fast 1'), _paper('Fast 2')]
+
+    async def slow(query, max_results, offset=0):
+        try:
+            await asyncio.sleep(30)
+        finally:
+            finished.append('slow')
+
+    agent._source_searches = lambda: {'arxiv': fast, 'semantic_scholar': slow}
+
+    async def run():
+        stream = agent.search_papers_stream('q', 2)
+        first = await stream.__anext__()
+        await stream.aclose()
+        # Already finished when aclose returns, not only when the loop shuts down
+        assert finished == ['slow']
+        return first
+
+    assert _titles(asyncio.run(run())) == ['Fast 1', 'Fast 2']
+
+
+class _UploadS3:
+    def put_object(self, **params):
+        pass
+
+
+class _FakeContentStore:
+    def __init__(self):
+        self.claimed = []
+
+    def claim_processing(self, sha256):
+        self.claimed.append(sha256)
+        return True
+
+
+class _FakeQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, job_id, user_id, file_id, file_name, file_type, s3_key, content_sha256=None):
+        self.jobs.append({'user_id': user_id, 's3_key': s3_key, 'content_sha256': content_sha256})
+        return True
+
+
+def _upload_agent(stored):
+    """A ScholarAgent whose stored-content lookup returns `stored`, with a fake S3 and job queue."""
+    agent = ScholarAgent.__new__(ScholarAgent)
+    agent.logger = logging.getLogger('test')
+    agent.s3_client = _UploadS3()
+    agent.s3_bucket = 'bucket'
+    agent.content_store = _FakeContentStore()
+    agent.ingestion_queue = _FakeQueue()
+    agent.ingestion_worker = None
+    agent.context_agent = None
+    agent._find_stored_content = lambda uploaded: stored
+
+    def ingest_inline(*args):
+        raise AssertionError('processed within the request')
+
+    agent._ingest_from_s3 = ingest_inline
+    return agent
+
+
+def test_upload_of_stored_text_without_a_summary_queues_a_job():
+    agent = _upload_agent({'s3_key': 'blobs/paper.pdf', 'extracted_text': 'Some text', 'summary': None})
+    result = asyncio.run(agent.upload_paper('user-1', b'%PDF-1.4 paper', 'paper.pdf', 'application/pdf'))
+    assert result['status'] == 'queued'
+    assert result['deduplicated'] is True
+    assert agent.ingestion_queue.jobs[0]['s3_key'] == 'blobs/paper.pdf'
+    # The text is already there, so there is no processing claim to take
+    assert agent.content_store.claimed == []
+
+
+def _url_agent(stored):
+    agent = _upload_agent(stored)
+    agent.headers = {}
+    agent.saved = []
+    agent._download_to_s3 = lambda url, s3_key, metadata: UploadResult(s3_key, 1024, 'ab' * 32, 'application/pdf')
+    agent._save_library_entry = lambda *args: agent.saved.append(args)
+    return agent
+
+
+def test_paper_added_from_a_url_is_claimed_and_queued_for_processing():
+    agent = _url_agent(None)
+    result = asyncio.run(agent.add_paper_from_url('user-1', 'https://arxiv.org/pdf/2101.00001'))
+    assert result['status'] == 'success'
+    assert result['job_id'] is not None
+    assert agent.content_store.claimed == ['ab' * 32]
+    assert agent.ingestion_queue.jobs[0]['content_sha256'] == 'ab' * 32
+    # The library entry is written straight away, before the job fills in its summary
+    assert agent.saved[0][0] == 'user-1'
+
+
+def test_paper_added_from_a_url_reuses_a_processed_copy():
+    agent = _url_agent({'s3_key': 'blobs/paper.pdf', 'extracted_text': 'Text', 'summary': 'Summary'})
+    result = asyncio.run(agent.add_paper_from_url('user-1', 'https://arxiv.org/pdf/2101.00001'))
+    assert result['status'] == 'success'
+    assert result['deduplicated'] is True
+    assert result['job_id'] is None
+    assert agent.ingestion_queue.jobs == [] and agent.content_store.claimed == []
+    assert agent.saved[0][4] == 'blobs/paper.pdf'
+
+
+def _arxiv_agent(tmp_path, timeout):
+    agent = ScholarAgent.__new__(ScholarAgent)
+    agent.logger = logging.getLogger('test')
+    agent.source_timeouts = {'arxiv': timeout}
+    agent.arxiv_client = RateLimitedArxivClient(max_wait=timeout)
+    agent.arxiv_client.limiter = RateLimiter('arxiv', 1, 10.0, state_dir=str(tmp_path))
+    agent.searched = []
+    agent._search_arxiv = lambda *args: agent.searched.append(args) or []
+    return agent
+
+
+def test_abandoned_arxiv_search_hands_back_its_token(tmp_path):
+    agent = _arxiv_agent(tmp_path, timeout=30)
+    limiter = agent.arxiv_client.limiter
+    limiter.acquire()
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(agent._search_arxiv_async('q', 5), timeout=0.05)
+
+    asyncio.run(run())
+    # No thread went on to wait for the token and send the request
+    assert agent.searched == []
+    assert limiter._reserve(None) == pytest.approx(10, abs=0.2)
+
+
+def test_arxiv_search_without_a_token_before_its_deadline_is_skipped(tmp_path):
+    agent = _arxiv_agent(tmp_path, timeout=0.1)
+    agent.arxiv_client.limiter.acquire()
+    assert asyncio.run(agent._search_arxiv_async('q', 5)) == []
+    assert agent.searched == []
+
+
+def test_prepaid_arxiv_requests_use_the_callers_token_then_stop_at_the_deadline(tmp_path, monkeypatch):
+    client = _arxiv_agent(tmp_path, timeout=5).arxiv_client
+    monkeypatch.setattr(arxiv.Client, '_parse_feed', lambda self, url, first_page=True, _try_index=0: 'feed')
+    client.limiter.acquire()
+    with client.prepaid(time.monotonic() + 0.05):
+        assert client._parse_feed('url') == 'feed'
+        time.sleep(0.06)
+        with pytest.raises(RateLimited):
+            client._parse_feed('url')
+
+
+class _FakeSearchCache(SearchCache):
+    """One cached window (or none), an optional claim already held by another worker, and the writes made."""
+    def __init__(self, cached=None, claimed_elsewhere=False):
+        super().__init__()
+        self.cached = cached
+        self.claimed_elsewhere = claimed_elsewhere
+        self.claims = []
+        self.writes = []
+
+    def get(self, key):
+        return self.cached
+
+    def claim_refresh(self, key):
+        self.claims.append(key)
+        return not self.claimed_elsewhere
+
+    def set(self, key, query, source, limit, results):
+        self.writes.append(results)
+
+
+def _cached_agent(cache, upstream):
+    """A ScholarAgent over a fake search cache whose upstream searches return `upstream`."""
+    agent = ScholarAgent.__new__(ScholarAgent)
+    agent.logger = logging.getLogger('test')
+    agent.search_cache = cache
+    agent.search_sources = ['arxiv']
+    agent.search_window = 4
+    agent.paper_index = None
+    agent._unwritten_windows = {}
+    agent._refresh_executor = ThreadPoolExecutor(max_workers=1)
+    agent.upstream_calls = 0
+
+    async def search_uncached(query, max_results=10, offset=0):
+        agent.upstream_calls += 1
+        return [dict(paper) for paper in upstream]
+
+    agent._search_uncached = search_uncached
+    return agent
+
+
+def test_a_fresh_cached_window_is_served_without_a_refresh():
+    cache = _FakeSearchCache(([_paper('Cached')], False))
+    agent = _cached_agent(cache, [_paper('Upstream')])
+    assert [paper['title'] for paper in asyncio.run(agent._search_window('q', 0))] == ['Cached']
+    agent._refresh_executor.shutdown(wait=True)
+    assert cache.claims == [] and agent.upstream_calls == 0
+
+
+def test_a_stale_window_is_served_and_refreshed_in_the_background():
+    cache = _FakeSearchCache(([_paper('Stale')], True))
+    agent = _cached_agent(cache, [_paper('Refreshed')])
+    assert [paper['title'] for paper in asyncio.run(agent._search_window('q', 0))] == ['Stale']
+    agent._refresh_executor.shutdown(wait=True)
+    assert cache.claims == [cache.make_key('q', 'arxiv', 4)]
+    assert cache.writes == [[_paper('Refreshed')]]
+
+
+def test_a_stale_window_claimed_by_another_worker_is_not_refreshed_twice():
+    cache = _FakeSearchCache(([_paper('Stale')], True), claimed_elsewhere=True)
+    agent = _cached_agent(cache, [_paper('Refreshed')])
+    assert [paper['title'] for paper in asyncio.run(agent._search_window('q', 0))] == ['Stale']
+    agent._refresh_executor.shutdown(wait=True)
+    assert len(cache.claims) == 1
+    assert agent.upstream_calls == 0 and cache.writes == []
+
+
+def test_a_missed_window_is_fetched_and_written_back():
+    cache = _FakeSearchCache()
+    agent = _cached_agent(cache, [_paper('Upstream')])
+    assert [paper['title'] for paper in asyncio.run(agent._search_window('q', 1))] == ['Upstream']
+    deadline = time.monotonic() + 5
+    while not cache.writes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.writes == [[_paper('Upstream')]]
+    assert agent._unwritten_windows == {}
+
+
+class _RawBody(io.BytesIO):
+    """urllib3-style raw stream; counts what the caller read."""
+    decode_content = False
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.consumed = getattr(self, 'consumed', 0) + len(data)
+        return data
+
+
+class _Download:
+    def __init__(self, body, headers=None, status_code=200):
+        self.raw = _RawBody(body)
+        self.headers = headers if headers is not None else {'content-type': 'application/pdf', 'content-length': str(len(body))}
+        self.status_code = status_code
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Client Error")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+        return False
+
+
+class _RecordingS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **extra):
+        self.objects[Key] = (Body, extra)
+
+
+def _download_agent(monkeypatch, response, max_bytes=1024 * 1024):
+    agent = ScholarAgent.__new__(ScholarAgent)
+    agent.logger = logging.getLogger('test')
+    agent.headers = {'User-Agent': 'test'}
+    agent.s3_client = _RecordingS3()
+    agent.s3_bucket = 'bucket'
+    agent.max_download_bytes = max_bytes
+    monkeypatch.setattr(scholar_agent_module, 'http_get', lambda url, **kwargs: response)
+    return agent
+
+
+def test_a_pdf_download_is_streamed_to_s3(monkeypatch):
+    body = b'\r\n%PDF-1.7\n' + b'x' * 5000
+    response = _Download(body, {'content-type': 'application/octet-stream'})
+    agent = _download_agent(monkeypatch, response)
+    result = agent._download_to_s3('https://example.org/paper', 'papers/paper.pdf', {'original_url': 'https://example.org/paper'})
+    assert (result.size, result.sha256, result.content_type) == (len(body), hashlib.sha256(body).hexdigest(), 'application/pdf')
+    stored, extra = agent.s3_client.objects['papers/paper.pdf']
+    assert stored == body
+    assert extra['ContentType'] == 'application/pdf'
+    assert extra['Metadata'] == {'original_url': 'https://example.org/paper'}
+    assert response.raw.decode_content and response.closed
+
+
+@pytest.mark.parametrize('body', [
+    b'<!DOCTYPE html><html><body>Sign in to read</body></html>',
+    b' ' * 1024 + b'%PDF-1.7\n',
+])
+def test_a_download_that_is_not_a_pdf_is_rejected_before_anything_is_stored(monkeypatch, body):
+    agent = _download_agent(monkeypatch, _Download(body, {'content-type': 'text/html'}))
+    with pytest.raises(ValueError, match="did not return a PDF \\(Content-Type 'text/html'\\)"):
+        agent._download_to_s3('https://example.org/paper', 'papers/paper.pdf', {})
+    assert agent.s3_client.objects == {}
+
+
+def test_a_declared_length_over_the_cap_is_rejected_without_reading(monkeypatch):
+    response = _Download(b'%PDF-1.7\n', {'content-type': 'application/pdf', 'content-length': str(2 * 1024 * 1024)})
+    agent = _download_agent(monkeypatch, response)
+    with pytest.raises(SizeLimitExceeded, match='1 MB limit'):
+        agent._download_to_s3('https://example.org/paper', 'papers/paper.pdf', {})
+    assert getattr(response.raw, 'consumed', 0) == 0
+    assert agent.s3_client.objects == {}
+
+
+def test_an_undeclared_download_over_the_cap_is_cut_off(monkeypatch):
+    response = _Download(b'%PDF-1.7\n' + b'x' * (2 * 1024 * 1024), {'content-type': 'application/pdf'})
+    agent = _download_agent(monkeypatch, response)
+    with pytest.raises(SizeLimitExceeded):
+        agent._download_to_s3('https://example.org/paper', 'papers/paper.pdf', {})
+    # Stopped shortly after the cap instead of reading the whole body
+    assert response.raw.consumed < 1024 * 1024 + 512 * 1024
+    assert agent.s3_client.objects == {}
+
+
+def test_an_http_error_is_raised(monkeypatch):
+    agent = _download_agent(monkeypatch, _Download(b'Not found', {'content-type': 'text/plain'}, status_code=404))
+    with pytest.raises(requests.HTTPError):
+        agent._download_to_s3('https://example.org/paper', 'papers/paper.pdf', {})
+    assert agent.s3_client.objects == {}
@@ -0,0 +1,527 @@
+import asyncio
+import csv
+import gzip
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import pytest
+
+import api.index
+from agents.scholar_agent.utils import normalize_arxiv_id
+from api.index import ChatManager
+from backend import paper_metadata
+from backend.arxiv_ingest import ArxivSnapshotLoader, _pg_array, iter_records, normalize_record
+from backend import search_cache as search_cache_module
+from backend.paper_metadata import PaperMetadataHydrator, paper_key
+from backend.response_cache import ResponseCache
+from backend.search_cache import SearchCache
+from utils.rate_limit import RateLimited, RateLimiter
+
+
+def test_importing_the_app_builds_no_agents_or_workers():
+    assert 'scholar_agent' not in api.index.chat_manager.__dict__
+    names = [thread.name for thread in threading.enumerate()]
+    assert 'startup-warmup' not in names
+    assert not any(name.startswith('ingestion-worker') for name in names)
+
+
+def test_start_ingestion_workers_builds_the_scholar_agent(monkeypatch):
+    built = []
+    monkeypatch.setenv('INGESTION_QUEUE_ENABLED', 'true')
+    monkeypatch.setenv('INGESTION_WORKERS', '1')
+    monkeypatch.setattr(api.index, 'ScholarAgent', lambda: built.append('scholar') or object())
+    manager = ChatManager()
+    assert built == []
+    manager.start_ingestion_workers().join(5)
+    assert built == ['scholar']
+
+
+def test_start_ingestion_workers_does_nothing_without_in_process_workers(monkeypatch):
+    monkeypatch.setenv('INGESTION_WORKERS', '0')
+    assert ChatManager().start_ingestion_workers() is None
+
+
+class _SlowFactCheckAgent:
+    def __init__(self):
+        time.sleep(0.5)
+
+    async def verify_claim_async(self, claim, context=None):
+        return {'status': 'verified'}
+
+
+def test_a_cold_stage_component_is_built_off_the_loop_within_the_deadline(monkeypatch):
+    monkeypatch.setattr(api.index, 'FactCheckAgent', _SlowFactCheckAgent)
+    monkeypatch.setitem(ChatManager.STAGE_TIMEOUTS, 'factcheck', 0.1)
+    manager = ChatManager()
+    degraded = {}
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        result = await manager._run_stage('factcheck', manager._call_component, 'factcheck_agent', 'verify_claim_async',
+                                          'claim', default={'status': 'unknown'}, degraded=degraded)
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result == {'status': 'unknown'}
+    assert degraded == {'factcheck': 'timeout'}
+    # The deadline fired while the agent was still being built, and the loop kept running
+    assert ticks >= 5
+
+
+def _cache(**kwargs):
+    return ResponseCache(**{'max_entries': 3, 'ttl_seconds': 60, 'similarity_threshold': 0.9, **kwargs})
+
+
+def test_response_cache_exact_key_ignores_case_whitespace_and_trailing_punctuation():
+    cache = _cache()
+    key = cache.make_key('What is  attention?', 'gpt', 0.7, scope='user-1')
+    assert key == cache.make_key('what is attention', 'gpt', 0.70001, scope='user-1')
+    assert key != cache.make_key('what is attention', 'gpt', 0.2, scope='user-1')
+    assert key != cache.make_key('what is attention', 'other-model', 0.7, scope='user-1')
+    cache.set(key, {'text': 'answer'}, 'gpt', 0.7, scope='user-1')
+    assert cache.get(cache.make_key('WHAT IS ATTENTION!', 'gpt', 0.7, scope='user-1')) == {'text': 'answer'}
+
+
+def test_response_cache_keys_are_scoped_per_user():
+    cache = _cache()
+    cache.set(cache.make_key('q', 'gpt', 0.7, scope='user-1'), 'answer', 'gpt', 0.7, scope='user-1')
+    assert cache.get(cache.make_key('q', 'gpt', 0.7, scope='user-2')) is None
+
+
+def test_response_cache_finds_near_duplicates_above_the_threshold():
+    cache = _cache()
+    cache.set('k', 'answer', 'gpt', 0.7, vector=[1.0, 0.0], scope='user-1')
+    assert cache.get_similar([0.99, 0.05], 'gpt', 0.7, scopes=('user-1',)) == 'answer'
+    # Not similar enough, another user, another temperature or model
+    assert cache.get_similar([0.5, 0.5], 'gpt', 0.7, scopes=('user-1',)) is None
+    assert cache.get_similar([1.0, 0.0], 'gpt', 0.7, scopes=('user-2',)) is None
+    assert cache.get_similar([1.0, 0.0], 'gpt', 0.3, scopes=('user-1',)) is None
+    assert cache.get_similar([1.0, 0.0], 'other', 0.7, scopes=('user-1',)) is None
+    assert cache.get_similar(None, 'gpt', 0.7) is None
+    assert cache.get_similar([0.0, 0.0], 'gpt', 0.7, scopes=('user-1',)) is None
+    assert cache.stats()['semantic_hits'] == 1
+
+
+def test_response_cache_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('backend.response_cache.time.monotonic', lambda: now[0])
+    cache = _cache(ttl_seconds=10)
+    cache.set('k', 'answer', 'gpt', 0.7, vector=[1.0, 0.0])
+    now[0] += 11
+    assert cache.get('k') is None
+    assert cache.get_similar([1.0, 0.0], 'gpt', 0.7) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_response_cache_evicts_the_least_recently_used_entry():
+    cache = _cache()
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key, 'gpt', 0.7)
+    assert cache.get('a') == 'a'
+    cache.set('d', 'd', 'gpt', 0.7)
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in ('a', 'c', 'd')] == ['a', 'c', 'd']
+
+
+class _FakeCursor:
+    def __init__(self, row=None, error=None):
+        self.row = row
+        self.error = error
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((' '.join(sql.split()), params))
+        if self.error is not None:
+            raise self.error
+
+    def fetchone(self):
+        return self.row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+def _search_cache(monkeypatch, cursor):
+    """A SearchCache whose pooled connection hands out `cursor` (None: the database is unavailable)."""
+    connections = []
+
+    @contextmanager
+    def pooled_connection():
+        connections.append(cursor)
+        yield _FakeConnection(cursor) if cursor is not None else None
+
+    monkeypatch.setattr(search_cache_module, 'pooled_connection', pooled_connection)
+    cache = SearchCache(ttl_seconds=60, stale_seconds=600)
+    cache.connections = connections
+    return cache
+
+
+def test_search_cache_keys_normalize_the_query_but_not_the_window():
+    cache = SearchCache()
+    key = cache.make_key('  Graph   Neural Networks ', 'arxiv', 10)
+    assert key == cache.make_key('graph neural networks', 'arxiv', 10)
+    assert len({key, cache.make_key('graph neural networks', 'arxiv,crossref', 10),
+                cache.make_key('graph neural networks', 'arxiv', 20),
+                cache.make_key('graph neural networks', 'arxiv', 10, offset=10)}) == 4
+
+
+@pytest.mark.parametrize('row, expected', [
+    (([{'title': 'Fresh'}], False), ([{'title': 'Fresh'}], False)),
+    (([{'title': 'Stale'}], True), ([{'title': 'Stale'}], True)),
+    (None, None),
+])
+def test_search_cache_serves_entries_within_the_stale_window(monkeypatch, row, expected):
+    cursor = _FakeCursor(row)
+    cache = _search_cache(monkeypatch, cursor)
+    assert cache.get('key') == expected
+    # Usable until ttl + stale seconds old, stale after ttl
+    assert cursor.executed[0][1] == ('key', 660, 60)
+
+
+def test_only_one_worker_claims_a_refresh(monkeypatch):
+    cursor = _FakeCursor((1,))
+    cache = _search_cache(monkeypatch, cursor)
+    assert cache.claim_refresh('key') is True
+    cursor.row = None
+    assert cache.claim_refresh('key') is False
+    assert 'refreshing_until IS NULL OR refreshing_until < CURRENT_TIMESTAMP' in cursor.executed[0][0]
+
+
+def test_search_cache_misses_while_the_database_is_unavailable(monkeypatch):
+    cache = _search_cache(monkeypatch, None)
+    assert cache.get('key') is None
+    assert cache.claim_refresh('key') is False
+    cache.set('key', 'q', 'arxiv', 10, [{'title': 'A'}])
+    assert not cache.disabled
+
+
+def test_a_missing_table_disables_the_search_cache(monkeypatch):
+    cursor = _FakeCursor(error=psycopg2.errors.UndefinedTable('relation "search_cache" does not exist'))
+    cache = _search_cache(monkeypatch, cursor)
+    assert cache.get('key') is None
+    assert cache.disabled
+    assert cache.get('key') is None
+    assert len(cache.connections) == 1
+
+
+def test_a_failed_query_is_a_miss_without_disabling_the_cache(monkeypatch):
+    cursor = _FakeCursor(error=psycopg2.OperationalError('server closed the connection'))
+    cache = _search_cache(monkeypatch, cursor)
+    assert cache.get('key') is None
+    assert not cache.disabled
+
+
+@pytest.mark.parametrize('paper_id, key', [
+    ('10.1038/NATURE14539', 'DOI:10.1038/nature14539'),
+    ('https://doi.org/10.1038/nature14539', 'DOI:10.1038/nature14539'),
+    ('http://arxiv.org/abs/2101.00001v2', 'ARXIV:2101.00001'),
+    ('arXiv:2101.00001v2', 'ARXIV:2101.00001'),
+    ('CorpusId:215416146', 'CorpusId:215416146'),
+    ('649def34f8be52c8b66281af98ae884c09aef38b', '649def34f8be52c8b66281af98ae884c09aef38b'),
+])
+def test_paper_keys_use_semantic_scholar_id_forms(paper_id, key):
+    assert paper_key(paper_id) == key
+
+
+class _Response:
+    def __init__(self, status_code=200, payload=None, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+def _s2_result(key):
+    return {'paperId': f's2-{key}', 'title': f'Title of {key}', 'externalIds': {'DOI': key[4:]} if key.startswith('DOI:') else {}}
+
+
+class _MetadataUpstreams:
+    """Semantic Scholar knows the keys in `s2`; CrossRef the DOIs in `crossref`.
+    `s2_statuses` answer Semantic Scholar's first requests ((status, headers), or None for a normal answer)."""
+    def __init__(self, s2=(), crossref=(), s2_statuses=()):
+        self.s2 = set(s2)
+        self.crossref = set(crossref)
+        self.s2_statuses = list(s2_statuses)
+        self.s2_batches = []
+        self.crossref_batches = []
+
+    def post(self, url, params=None, json=None):
+        assert url.endswith('/paper/batch') and params == {'fields': paper_metadata._S2_FIELDS}
+        self.s2_batches.append(json['ids'])
+        answer = self.s2_statuses.pop(0) if self.s2_statuses else None
+        if answer is not None:
+            return _Response(answer[0], headers=answer[1])
+        return _Response(payload=[_s2_result(key) if key in self.s2 else None for key in json['ids']])
+
+    def get(self, url, params=None):
+        dois = [doi[4:] for doi in params['filter'].split(',')]
+        self.crossref_batches.append(dois)
+        items = [{'DOI': doi.upper(), 'title': [f'CrossRef {doi}']} for doi in dois if doi in self.crossref]
+        return _Response(payload={'message': {'items': items}})
+
+    async def post_async(self, url, **kwargs):
+        return self.post(url, **kwargs)
+
+    async def get_async(self, url, **kwargs):
+        return self.get(url, **kwargs)
+
+
+class _FakeAsyncDb:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.stored = []
+
+    async def fetch(self, agent, query, *args):
+        return [{'paper_key': key, 'metadata': metadata} for key, metadata in self.rows if key in args[0]]
+
+    async def executemany(self, agent, query, args):
+        self.stored.extend(args)
+        return True
+
+
+@pytest.fixture
+def metadata_upstreams(monkeypatch, tmp_path):
+    """Fake upstreams behind real (fast) rate limiters, and no database."""
+    upstreams = _MetadataUpstreams()
+    limiters = {}
+    monkeypatch.setattr(paper_metadata, 'http_post', upstreams.post)
+    monkeypatch.setattr(paper_metadata, 'http_get', upstreams.get)
+    monkeypatch.setattr(paper_metadata, 'http_post_async', upstreams.post_async)
+    monkeypatch.setattr(paper_metadata, 'http_get_async', upstreams.get_async)
+    monkeypatch.setattr(paper_metadata, 'get_rate_limiter', lambda name: limiters.setdefault(
+        name, RateLimiter(name, 100, burst=10, state_dir=str(tmp_path))))
+    monkeypatch.setattr(paper_metadata, 'pooled_connection', contextmanager(lambda: (yield None)))
+    monkeypatch.setattr(paper_metadata, 'async_db', _FakeAsyncDb())
+    upstreams.limiters = limiters
+    return upstreams
+
+
+def _hydrator():
+    return PaperMetadataHydrator(rate_limit_wait=0.5)
+
+
+def test_hydrate_batches_semantic_scholar_and_falls_back_to_crossref(metadata_upstreams):
+    metadata_upstreams.s2 = {'ARXIV:2101.00001', 'DOI:10.1234/known'}
+    metadata_upstreams.crossref = {'10.1234/crossref-only'}
+    ids = ['https://arxiv.org/abs/2101.00001v1', '2101.00001', '10.1234/KNOWN', '10.1234/crossref-only', '10.1234/nowhere']
+    papers = _hydrator().hydrate(ids)
+    # Copies of one paper are asked for once
+    assert metadata_upstreams.s2_batches == [['ARXIV:2101.00001', 'DOI:10.1234/known', 'DOI:10.1234/crossref-only', 'DOI:10.1234/nowhere']]
+    assert metadata_upstreams.crossref_batches == [['10.1234/crossref-only', '10.1234/nowhere']]
+    assert papers[ids[0]] is papers[ids[1]]
+    assert papers[ids[0]]['title'] == 'Title of ARXIV:2101.00001'
+    assert papers['10.1234/KNOWN']['sources'] == ['semantic_scholar']
+    assert papers['10.1234/crossref-only']['sources'] == ['crossref']
+    assert papers['10.1234/nowhere'] is None
+
+
+def test_hydrate_async_matches_hydrate_and_uses_the_cache(metadata_upstreams):
+    metadata_upstreams.s2 = {'DOI:10.1234/known'}
+    metadata_upstreams.crossref = {'10.1234/crossref-only'}
+    paper_metadata.async_db.rows = [('DOI:10.1234/cached', {'title': 'Cached'})]
+    papers = asyncio.run(_hydrator().hydrate_async(['10.1234/known', '10.1234/crossref-only', '10.1234/cached']))
+    assert [papers[paper_id]['title'] for paper_id in ('10.1234/known', '10.1234/crossref-only', '10.1234/cached')] == \
+        ['Title of DOI:10.1234/known', 'CrossRef 10.1234/crossref-only', 'Cached']
+    assert metadata_upstreams.s2_batches == [['DOI:10.1234/known', 'DOI:10.1234/crossref-only']]
+    assert [key for key, _ in paper_metadata.async_db.stored] == ['DOI:10.1234/known', 'DOI:10.1234/crossref-only']
+
+
+def test_a_rate_limited_batch_is_retried_after_the_penalty(metadata_upstreams, monkeypatch):
+    monkeypatch.setitem(paper_metadata._SOURCES, 'semantic_scholar', ('Semantic Scholar', 1))
+    metadata_upstreams.s2 = {'ARXIV:2101.00001', 'ARXIV:2101.00002'}
+    metadata_upstreams.s2_statuses = [(429, {'Retry-After': '0'})]
+    penalties = []
+    limiter = paper_metadata.get_rate_limiter('semantic_scholar')
+    monkeypatch.setattr(limiter, 'penalize', penalties.append)
+    papers = _hydrator().hydrate(['2101.00001', '2101.00002'])
+    assert penalties == [0.0]
+    assert metadata_upstreams.s2_batches == [['ARXIV:2101.00001'], ['ARXIV:2101.00001'], ['ARXIV:2101.00002']]
+    assert all(papers.values())
+
+
+def test_a_long_penalty_returns_the_batches_fetched_so_far(metadata_upstreams, monkeypatch):
+    monkeypatch.setitem(paper_metadata._SOURCES, 'semantic_scholar', ('Semantic Scholar', 1))
+    metadata_upstreams.s2 = {'ARXIV:2101.00001', 'ARXIV:2101.00002', 'ARXIV:2101.00003'}
+    metadata_upstreams.s2_statuses = [None, (429, {'Retry-After': '60'})]
+    papers = _hydrator().hydrate(['2101.00001', '2101.00002', '2101.00003'])
+    # The limiter now holds every worker off for a minute, longer than the hydrator waits
+    assert metadata_upstreams.s2_batches == [['ARXIV:2101.00001'], ['ARXIV:2101.00002']]
+    assert papers['2101.00001']['title'] == 'Title of ARXIV:2101.00001'
+    assert papers['2101.00002'] is None and papers['2101.00003'] is None
+    with pytest.raises(RateLimited):
+        metadata_upstreams.limiters['semantic_scholar'].acquire(timeout=0.1)
+
+
+def test_a_failed_batch_does_not_stop_the_next(metadata_upstreams, monkeypatch):
+    monkeypatch.setitem(paper_metadata._SOURCES, 'semantic_scholar', ('Semantic Scholar', 1))
+    metadata_upstreams.s2 = {'ARXIV:2101.00002'}
+    metadata_upstreams.s2_statuses = [(500, {})]
+    papers = _hydrator().hydrate(['2101.00001', '2101.00002'])
+    assert papers['2101.00001'] is None
+    assert papers['2101.00002']['title'] == 'Title of ARXIV:2101.00002'
+
+
+def _snapshot_record(arxiv_id, title='A  title\n spanning lines', **fields):
+    return {'id': arxiv_id, 'title': title, 'versions': [{'version': 'v1', 'created': 'Mon, 2 Apr 2007 19:18:42 GMT'},
+                                                         {'version': 'v2', 'created': 'Tue, 24 Jul 2007 20:10:27 GMT'}], **fields}
+
+
+def _write_snapshot(path, lines):
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write('\n'.join(line if isinstance(line, str) else json.dumps(line) for line in lines) + '\n')
+    return str(path)
+
+
+def test_snapshot_rows_match_live_arxiv_results():
+    row = normalize_record(_snapshot_record(
+        '0704.0001', abstract='  A calculation\n of  cross sections. ',
+        authors_parsed=[['Balázs', 'C.', ''], ['Berger', 'E. L.', 'Jr']]
+    ))
+    row_id, title, abstract, authors, year, venue, url = row
+    # The live client's entry_id / pdf_url for the latest version, so later search results update this row
+    assert (row_id, url) == ('http://arxiv.org/abs/0704.0001v2', 'http://arxiv.org/pdf/0704.0001v2')
+    assert normalize_arxiv_id(row_id) == '0704.0001'
+    assert (title, abstract, year) == ('A title spanning lines', 'A calculation of cross sections.', 2007)
+    assert authors == ['C. Balázs', 'E. L. Berger Jr']
+    assert venue == 'arXiv'
+    assert normalize_record(_snapshot_record('0704.0001', **{'journal-ref': ' Phys.Rev.D76 '}))[5] == 'Phys.Rev.D76'
+
+
+def test_snapshot_rows_fall_back_to_plain_authors_and_update_date():
+    row = normalize_record({'id': 'hep-th/9901001', 'title': 'Old paper', 'authors': 'A. One, B. Two and C. Three',
+                            'update_date': '2008-11-13'})
+    assert row[0] == 'http://arxiv.org/abs/hep-th/9901001v1'
+    assert row[3] == ['A. One', 'B. Two', 'C. Three']
+    assert row[4] == 2008
+    assert normalize_record({'id': '0704.0002', 'title': '  '}) is None
+    assert normalize_record({'title': 'No id'}) is None
+
+
+@pytest.mark.parametrize('name', ['snapshot.json', 'snapshot.json.gz'])
+def test_snapshot_records_stream_with_a_line_per_record(tmp_path, name):
+    path = _write_snapshot(tmp_path / name, [_snapshot_record('0704.0001'), '{not json', '', _snapshot_record('0704.0002')])
+    # Blank and malformed lines still count, so checkpoints stay line numbers
+    assert [record.get('id') for record in iter_records(path)] == ['0704.0001', None, None, '0704.0002']
+    assert [record.get('id') for record in iter_records(path, skip=3)] == ['0704.0002']
+
+
+def test_author_arrays_are_escaped_for_copy():
+    assert _pg_array(['Plain', 'With "quotes"', 'Back\\slash', 'Comma, Jr']) == \
+        '{"Plain","With \\"quotes\\"","Back\\\\slash","Comma, Jr"}'
+
+
+class _IngestConnection:
+    """Enough of a psycopg2 connection for ArxivSnapshotLoader: the checkpoint and papers only change on commit."""
+    def __init__(self, checkpoint=0, fail_on_batch=None):
+        self.checkpoint = checkpoint
+        self.papers = {}
+        self.batches = []
+        self.fail_on_batch = fail_on_batch
+        self.rollbacks = 0
+        self._staged = []
+        self._pending_papers = {}
+        self._pending_checkpoint = None
+
+    def cursor(self):
+        return _IngestCursor(self)
+
+    def commit(self):
+        self.papers.update(self._pending_papers)
+        if self._pending_checkpoint is not None:
+            self.checkpoint = self._pending_checkpoint
+        self._pending_papers, self._pending_checkpoint = {}, None
+
+    def rollback(self):
+        self.rollbacks += 1
+        self._pending_papers, self._pending_checkpoint = {}, None
+
+
+class _IngestCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.row = None
+
+    def execute(self, sql, params=None):
+        if 'SELECT records_done' in sql:
+            self.row = (self.conn.checkpoint,) if self.conn.checkpoint else None
+        elif 'INSERT INTO papers' in sql:
+            if len(self.conn.batches) == self.conn.fail_on_batch:
+                raise psycopg2.errors.UniqueViolation('duplicate key')
+            self.conn.batches.append([row[0] for row in self.conn._staged])
+            self.conn._pending_papers.update({row[0]: row for row in self.conn._staged})
+            self.rowcount = len({row[0] for row in self.conn._staged})
+        elif 'INSERT INTO ingest_checkpoints' in sql:
+            self.conn._pending_checkpoint = params[1]
+
+    def copy_expert(self, sql, buffer):
+        self.conn._staged = list(csv.reader(buffer))
+
+    def fetchone(self):
+        return self.row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_snapshot_load_commits_a_checkpoint_with_each_batch(tmp_path):
+    path = _write_snapshot(tmp_path / 'snapshot.json.gz', [
+        _snapshot_record('0704.0001', authors='A. One and B. "Two"'), _snapshot_record('0704.0002'),
+        '{not json', _snapshot_record('0704.0003'), _snapshot_record('0704.0004'),
+    ])
+    conn = _IngestConnection()
+    assert ArxivSnapshotLoader(conn, 'snapshot', batch_size=2).load(path) == 4
+    assert conn.batches == [['http://arxiv.org/abs/0704.0001v2', 'http://arxiv.org/abs/0704.0002v2'],
+                            ['http://arxiv.org/abs/0704.0003v2'], ['http://arxiv.org/abs/0704.0004v2']]
+    assert conn.checkpoint == 5
+    assert conn.papers['http://arxiv.org/abs/0704.0001v2'][3] == '{"A. One","B. \\"Two\\""}'
+
+
+def test_an_interrupted_snapshot_load_resumes_after_its_checkpoint(tmp_path):
+    path = _write_snapshot(tmp_path / 'snapshot.json', [_snapshot_record(f'0704.000{i}') for i in range(1, 6)])
+    conn = _IngestConnection(fail_on_batch=1)
+    with pytest.raises(psycopg2.Error):
+        ArxivSnapshotLoader(conn, 'snapshot', batch_size=2).load(path)
+    # The failed batch was rolled back; the first one stays loaded
+    assert conn.checkpoint == 2 and conn.rollbacks == 1
+    assert sorted(conn.papers) == ['http://arxiv.org/abs/0704.0001v2', 'http://arxiv.org/abs/0704.0002v2']
+
+    conn.fail_on_batch = None
+    assert ArxivSnapshotLoader(conn, 'snapshot', batch_size=2).load(path) == 3
+    assert conn.batches[-2:] == [['http://arxiv.org/abs/0704.0003v2', 'http://arxiv.org/abs/0704.0004v2'],
+                                 ['http://arxiv.org/abs/0704.0005v2']]
+    assert conn.checkpoint == 5 and len(conn.papers) == 5
@@ -0,0 +1,521 @@
+import asyncio
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+from models import embedding_service as embedding_service_module
+from models import model_server as model_server_module
+from models import pdf_extraction
+from models.embedding_service import EmbeddingService
+from models.model_server import (ModelServerClient, ModelServerSupervisor, RemoteEmbeddingService,
+                                 RemoteTokenizer, ping)
+from models.pdf_extraction import PageText, extract_pdf_text
+from models.prompt_packer import PromptPacker
+from models.reranker import SearchReranker
+
+
+def make_pdf(pages):
+    """A minimal PDF with one line of Helvetica text per page (an empty string gives a blank page)."""
+    count = len(pages)
+    font = 3 + 2 * count
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        ('<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join(f'{3 + 2 * i} 0 R' for i in range(count)), count)).encode(),
+    ]
+    for i, text in enumerate(pages):
+        objects.append((f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R '
+                        f'/Resources << /Font << /F1 {font} 0 R >> >> >>').encode())
+        stream = f'BT /F1 12 Tf 72 712 Td ({text}) Tj ET'.encode() if text else b''
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+    objects.append(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    body = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(body)
+    body += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    body += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    body += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(body)
+
+
+class _FakePage:
+    def __init__(self, text):
+        self.text = text
+
+    def get_text(self):
+        if isinstance(self.text, Exception):
+            raise self.text
+        return self.text
+
+
+class _FakeDoc:
+    def __init__(self, pages):
+        self.pages = pages
+        self.page_count = len(pages)
+
+    def __getitem__(self, number):
+        return _FakePage(self.pages[number])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _fake_pymupdf(pages):
+    return types.SimpleNamespace(open=lambda *args, **kwargs: _FakeDoc(pages))
+
+
+def test_join_records_each_pages_offsets_into_the_text():
+    extracted = pdf_extraction._join(['First page', '', 'Third'], 'pypdf2')
+    assert extracted.text == 'First page\n\nThird'
+    assert extracted.pages == [PageText(0, 0, 10), PageText(1, 11, 11), PageText(2, 12, 17)]
+    assert [extracted.page_text(number) for number in range(3)] == ['First page', '', 'Third']
+
+
+def test_pypdf2_is_used_without_pymupdf(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'pymupdf', None)
+    extracted = extract_pdf_text(make_pdf(['Alpha', 'Beta']), parallel=False)
+    assert extracted.engine == 'pypdf2'
+    assert [extracted.page_text(number).strip() for number in range(2)] == ['Alpha', 'Beta']
+
+
+def test_pymupdf_is_preferred_when_installed(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'pymupdf', _fake_pymupdf(['One', 'Two']))
+    extracted = extract_pdf_text(b'%PDF-', parallel=False)
+    assert extracted.engine == 'pymupdf'
+    assert extracted.text == 'One\nTwo'
+
+
+def test_a_page_that_fails_is_left_empty(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'pymupdf', _fake_pymupdf(['One', ValueError('bad page'), 'Three']))
+    extracted = extract_pdf_text(b'%PDF-', parallel=False)
+    assert [extracted.page_text(number) for number in range(3)] == ['One', '', 'Three']
+
+
+def test_unreadable_pdf_raises(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'pymupdf', None)
+    with pytest.raises(Exception):
+        extract_pdf_text(b'not a pdf')
+
+
+@pytest.mark.parametrize('page_count, workers, expected', [
+    (100, 4, [(0, 25), (25, 50), (50, 75), (75, 100)]),
+    (30, 4, [(0, 8), (8, 16), (16, 24), (24, 30)]),
+    (10, 4, [(0, 8), (8, 10)]),
+    (30, 1, [(0, 30)]),
+])
+def test_page_ranges_split_evenly_with_a_minimum_range(page_count, workers, expected):
+    assert pdf_extraction._page_ranges(page_count, workers) == expected
+
+
+def test_short_documents_are_extracted_inline(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'pymupdf', None)
+    monkeypatch.setattr(pdf_extraction, '_extract_parallel', lambda *args: pytest.fail('used the pool'))
+    extracted = extract_pdf_text(make_pdf(['Page'] * (pdf_extraction.PARALLEL_MIN_PAGES - 1)))
+    assert len(extracted.pages) == pdf_extraction.PARALLEL_MIN_PAGES - 1
+
+
+def test_host_slots_are_shared_and_released(tmp_path):
+    first = pdf_extraction._HostSlots(3, str(tmp_path))
+    second = pdf_extraction._HostSlots(3, str(tmp_path))
+    held = first.acquire(2)
+    assert len(held) == 2
+    # Another process (or thread) only gets what is left
+    other = second.acquire(3)
+    assert len(other) == 1
+    first.release(held)
+    second.release(other)
+    assert len(second.acquire(3)) == 3
+
+
+def test_long_documents_use_the_pool_under_the_gunicorn_defaults(tmp_path):
+    # A fresh process: gunicorn.conf.py's environment, a 4-core host, and its own pool
+    script = textwrap.dedent(f"""
+        import os, runpy, sys
+        os.environ.pop('WEB_CONCURRENCY', None)
+        os.environ.pop('PDF_EXTRACT_PROCESSES', None)
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = {str(tmp_path / 'metrics')!r}
+        os.environ['PDF_EXTRACT_DIR'] = {str(tmp_path / 'slots')!r}
+        os.cpu_count = lambda: 4
+        runpy.run_path('gunicorn.conf.py')
+        sys.path.insert(0, {os.path.dirname(__file__)!r})
+        from test_models import make_pdf
+        from models import pdf_extraction
+        pdf_extraction.pymupdf = None
+        extracted = pdf_extraction.extract_pdf_text(make_pdf([f'Page {{i}}' for i in range(30)]))
+        print(pdf_extraction.PROCESSES, pdf_extraction._pool is not None, extracted.page_text(29).strip())
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True).stdout
+    assert output.split() == ['2', 'True', 'Page', '29']
+
+
+class _WordEncoder:
+    """One token per whitespace-separated word."""
+    def __init__(self):
+        self.words = []
+
+    def encode(self, text):
+        tokens = []
+        for word in text.split():
+            if word not in self.words:
+                self.words.append(word)
+            tokens.append(self.words.index(word))
+        return tokens
+
+    def decode(self, tokens):
+        return ' '.join(self.words[token] for token in tokens)
+
+
+class _ServerEncoder(_WordEncoder):
+    """Counts tokens in one batch, like the model server's tokenizer client."""
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def count_tokens(self, texts):
+        self.batches.append(list(texts))
+        return [len(self.encode(text)) for text in texts]
+
+
+def _words(count, word='filler'):
+    return ' '.join([word] * count)
+
+
+def _packer(encoder=None):
+    return PromptPacker(encoder or _WordEncoder())
+
+
+def test_pack_fits_the_query_and_groups_into_the_budget():
+    packer = _packer()
+    query = 'transformer attention mechanisms'
+    groups = {
+        'papers': [f'unrelated {_words(60)}', f'transformer attention {_words(60)}'],
+        'uploads': [f'attention {_words(60)}'],
+    }
+    packed_query, packed = packer.pack(query, groups, budget=120)
+    assert packed_query == query
+    used = packer.count_tokens(packed_query) + sum(packer.count_tokens(item) + 1 for items in packed.values() for item in items)
+    assert used <= 120
+    # The most relevant paper is kept whole, the next most relevant item trimmed, the unrelated one dropped
+    assert packed['papers'] == [groups['papers'][1]]
+    assert packed['uploads'][0].startswith('attention') and packed['uploads'][0].endswith('...')
+
+
+def test_pack_trims_a_long_query_to_its_share_of_the_budget():
+    packed_query, packed = _packer().pack(_words(100, 'word'), {'papers': []}, budget=40)
+    assert packed_query.endswith('...')
+    assert len(packed_query.split()) <= 10
+    assert packed == {'papers': []}
+
+
+def test_select_keeps_document_order_and_skips_fragments_below_the_minimum():
+    packer = _packer()
+    items = ['graph networks one', 'other text', 'graph networks two']
+    assert packer.select('graph networks', items, budget=8, min_item_tokens=1) == ['graph networks one', 'graph networks two']
+    # Too little room left to be worth a trimmed fragment
+    assert packer.select('graph', [_words(50, 'graph')], budget=20, min_item_tokens=40) == []
+
+
+def test_token_counts_are_batched_through_a_model_server_encoder():
+    encoder = _ServerEncoder()
+    _packer(encoder).select('query', ['one two', 'three', 'four five six'], budget=100)
+    assert encoder.batches == [['one two', 'three', 'four five six']]
+
+
+def test_fit_document_keeps_the_relevant_chunks():
+    packer = _packer()
+    text = '\n\n'.join([f'intro {_words(30)}', f'diffusion models {_words(30)}', f'outro {_words(30)}'])
+    fitted = packer.fit_document(text, 'diffusion models', budget=40, chunk_tokens=35)
+    assert fitted.startswith('diffusion models')
+    assert packer.fit_document('short text', 'query', budget=40) == 'short text'
+
+
+class _FakeSentenceTransformer:
+    """Embeds each text as [len(text), 1]; `gate` holds encode() until it is set."""
+    def __init__(self, gate=None, error=None):
+        self.gate = gate
+        self.error = error
+        self.calls = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        self.calls.append(list(texts))
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return np.array([[len(text), 1] for text in texts], dtype=np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+
+@pytest.fixture
+def embedding_service(monkeypatch):
+    def build(model, **kwargs):
+        monkeypatch.setitem(sys.modules, 'sentence_transformers', types.SimpleNamespace(SentenceTransformer=lambda name: model))
+        return EmbeddingService('fake-model', **kwargs)
+    return build
+
+
+def test_concurrent_requests_share_one_encode_call(embedding_service):
+    model = _FakeSentenceTransformer()
+    service = embedding_service(model, max_wait_ms=200)
+    futures = [service.submit(['a']), service.submit(['bb', 'ccc']), service.submit(['dddd'])]
+    results = [future.result(5) for future in futures]
+    assert model.calls == [['a', 'bb', 'ccc', 'dddd']]
+    assert [result[:, 0].tolist() for result in results] == [[1], [2, 3], [4]]
+
+
+def test_batches_are_capped_at_the_batch_size(embedding_service):
+    model = _FakeSentenceTransformer()
+    service = embedding_service(model, max_batch_size=2, max_wait_ms=200)
+    futures = [service.submit([text]) for text in ('a', 'b', 'c')]
+    for future in futures:
+        future.result(5)
+    assert model.calls == [['a', 'b'], ['c']]
+
+
+def test_cancelled_requests_are_not_encoded(embedding_service):
+    gate = threading.Event()
+    model = _FakeSentenceTransformer(gate=gate)
+    service = embedding_service(model, max_wait_ms=0)
+    first = service.submit(['first'])
+    while not model.calls:
+        time.sleep(0.01)
+    abandoned = service.submit(['abandoned'])
+    kept = service.submit(['kept'])
+    assert abandoned.cancel()
+    gate.set()
+    first.result(5)
+    kept.result(5)
+    assert model.calls == [['first'], ['kept']]
+
+
+def test_a_failed_batch_fails_its_callers_and_the_worker_carries_on(embedding_service):
+    model = _FakeSentenceTransformer(error=RuntimeError('out of memory'))
+    service = embedding_service(model)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        service.encode(['a'])
+    model.error = None
+    assert service.encode('ab').tolist() == [2, 1]
+
+
+def test_encode_shapes_and_the_async_variant(embedding_service):
+    service = embedding_service(_FakeSentenceTransformer())
+    assert service.encode([]).shape == (0, 2)
+    assert service.encode(['a', 'bb']).shape == (2, 2)
+    assert asyncio.run(service.encode_async('abc')).tolist() == [3, 1]
+
+
+def test_local_services_are_shared_per_model(monkeypatch):
+    created = []
+    monkeypatch.setattr(embedding_service_module, '_services', {})
+    monkeypatch.setattr(embedding_service_module, 'EmbeddingService', lambda name, **kwargs: created.append(name) or object())
+    monkeypatch.delenv('MODEL_SERVER_SOCKET', raising=False)
+    first = embedding_service_module.get_embedding_service('sentence-transformers/all-MiniLM-L6-v2')
+    assert embedding_service_module.get_embedding_service('all-MiniLM-L6-v2') is first
+    assert created == ['all-MiniLM-L6-v2']
+
+
+class _FakeEmbeddings:
+    dimension = 2
+
+    def encode(self, texts):
+        if 'boom' in texts:
+            raise ValueError('cannot embed boom')
+        return np.array([[len(text), 0.5] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def model_server(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, 'tiktoken', types.SimpleNamespace(get_encoding=lambda name: _WordEncoder()))
+    monkeypatch.setattr(embedding_service_module, 'get_local_embedding_service', lambda name: _FakeEmbeddings())
+    socket_path = str(tmp_path / 'models.sock')
+    servers = []
+
+    def start():
+        server = model_server_module.ModelServer(socket_path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    start()
+    yield types.SimpleNamespace(socket_path=socket_path, start=start, servers=servers)
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_embeddings_round_trip_through_the_model_server(model_server):
+    service = RemoteEmbeddingService(model_server.socket_path, 'all-MiniLM-L6-v2')
+    embeddings = service.encode(['a', 'bbb'])
+    assert embeddings.dtype == np.float32
+    assert embeddings.tolist() == [[1, 0.5], [3, 0.5]]
+    assert service.encode('ab').tolist() == [2, 0.5]
+    assert asyncio.run(service.encode_async(['abcd'])).tolist() == [[4, 0.5]]
+    assert service.dimension == 2
+
+
+def test_tokens_round_trip_through_the_model_server(model_server):
+    tokenizer = RemoteTokenizer(model_server.socket_path)
+    tokens = tokenizer.encode('the cat sat on the mat')
+    assert tokenizer.decode(tokens) == 'the cat sat on the mat'
+    assert tokenizer.count_tokens(['one two', 'three']) == [2, 1]
+
+    async def run():
+        tokens = await tokenizer.encode_async('a b')
+        return await tokenizer.decode_async(tokens), await tokenizer.count_tokens_async(['a b c'])
+    assert asyncio.run(run()) == ('a b', [3])
+
+
+def test_server_errors_reach_the_caller_and_keep_the_connection(model_server):
+    client = ModelServerClient(model_server.socket_path)
+    with pytest.raises(RuntimeError, match='cannot embed boom'):
+        client.request({'op': 'embed', 'model': 'm', 'texts': ['boom']})
+    with pytest.raises(RuntimeError, match='Unknown model server op'):
+        client.request({'op': 'nope'})
+    assert client.request({'op': 'ping'}) == {'status': 'ok'}
+
+
+def test_clients_reconnect_after_the_server_restarts(model_server):
+    tokenizer = RemoteTokenizer(model_server.socket_path)
+    assert tokenizer.count_tokens(['a b']) == [2]
+    server = model_server.servers[0]
+    server.shutdown()
+    server.server_close()
+    assert not ping(model_server.socket_path, timeout=0.5)
+    model_server.start()
+    assert ping(model_server.socket_path)
+    assert tokenizer.count_tokens(['a b c']) == [3]
+
+
+def test_a_socket_selects_the_model_server_stubs(monkeypatch, tmp_path):
+    monkeypatch.setenv('MODEL_SERVER_SOCKET', str(tmp_path / 'models.sock'))
+    service = embedding_service_module.get_embedding_service('sentence-transformers/all-MiniLM-L6-v2')
+    assert isinstance(service, RemoteEmbeddingService)
+    assert service.model_name == 'all-MiniLM-L6-v2'
+    assert isinstance(embedding_service_module.get_tokenizer(), RemoteTokenizer)
+
+
+class _FakeProcess:
+    """A model server child that has exited (returncode) or keeps running (None)."""
+    def __init__(self, returncode):
+        self.pid = 1234
+        self.returncode = returncode
+        self.terminated = False
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.returncode = -15
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+def test_supervisor_restarts_a_server_that_exits(monkeypatch, tmp_path):
+    processes = [_FakeProcess(1), _FakeProcess(None)]
+    spawned = []
+    monkeypatch.setattr(model_server_module.subprocess, 'Popen', lambda command: spawned.append(command) or processes[len(spawned) - 1])
+    monkeypatch.setattr(model_server_module, 'ping', lambda *args: True)
+    supervisor = ModelServerSupervisor(str(tmp_path / 'models.sock'), preload=[], check_interval=0.01)
+    supervisor.start()
+    deadline = time.monotonic() + 5
+    while not supervisor._ready and time.monotonic() < deadline:
+        time.sleep(0.01)
+    supervisor.stop()
+    assert len(spawned) == 2
+    # An empty preload list still reaches the child, so it loads no models up front
+    assert spawned[0][-3:] == ['--socket', str(tmp_path / 'models.sock'), '--preload']
+    assert supervisor._ready and supervisor._restarts == 0
+    assert processes[1].terminated
+
+
+def test_supervisor_restarts_a_server_that_stops_answering(monkeypatch, tmp_path):
+    processes = [_FakeProcess(None), _FakeProcess(None)]
+    spawned = []
+    monkeypatch.setattr(model_server_module.subprocess, 'Popen', lambda command: spawned.append(command) or processes[len(spawned) - 1])
+    answers = iter([True, False, False])
+    monkeypatch.setattr(model_server_module, 'ping', lambda *args: next(answers, True))
+    supervisor = ModelServerSupervisor(str(tmp_path / 'models.sock'), check_interval=0.01, max_failures=2)
+    supervisor.start()
+    deadline = time.monotonic() + 5
+    while len(spawned) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    supervisor.stop()
+    assert len(spawned) == 2
+    assert processes[0].terminated
+
+
+class _KeywordEmbeddings:
+    """Embeds texts mentioning graphs along x, vision along y, anything else on the diagonal."""
+    def __init__(self):
+        self.encoded = []
+
+    async def encode_async(self, texts):
+        self.encoded.append(list(texts))
+        return np.array([[1, 0] if 'graph' in text.lower() else [0, 1] if 'vision' in text.lower()
+                         else [0, 0] if not text.strip(' .') else [1, 1] for text in texts], dtype=np.float32)
+
+
+class _MemoryEmbeddingStore:
+    def __init__(self, stored=None):
+        self.vectors = dict(stored or {})
+
+    def get_many(self, ids):
+        return {paper_id: self.vectors[paper_id] for paper_id in ids if paper_id in self.vectors}
+
+    def put_many(self, vectors):
+        self.vectors.update(vectors)
+
+
+def _reranker(stored=None):
+    return SearchReranker(embedding_service=_KeywordEmbeddings(), store=_MemoryEmbeddingStore(stored))
+
+
+def test_rerank_orders_papers_by_similarity_to_the_query():
+    papers = [{'id': 'v', 'title': 'Vision transformers'}, {'id': 'm', 'title': 'Mixed'}, {'id': 'g', 'title': 'Graph networks'}]
+    reranked = asyncio.run(_reranker().rerank('graph learning', papers))
+    assert [paper['id'] for paper in reranked] == ['g', 'm', 'v']
+    assert [paper['relevance'] for paper in reranked] == [1.0, 0.7071, 0.0]
+    assert asyncio.run(_reranker().rerank('graph learning', papers, limit=1)) == [{**papers[2], 'relevance': 1.0}]
+
+
+def test_stored_embeddings_are_reused_and_new_ones_stored():
+    reranker = _reranker({'g': np.array([1, 0], dtype=np.float32)})
+    papers = [{'id': 'g', 'title': 'Graph networks'}, {'title': 'Vision transformers', 'abstract': 'Patches'}]
+    asyncio.run(reranker.rerank('graph', papers))
+    # Only the query and the paper without a stored vector are encoded, in one batch
+    assert reranker.embedding_service.encoded == [['graph', 'Vision transformers. Patches']]
+    # A paper without an id is stored under its text
+    assert set(reranker.store.vectors) == {'g', 'Vision transformers. Patches'}
+
+    asyncio.run(reranker.rerank('graph', papers))
+    assert reranker.embedding_service.encoded[-1] == ['graph']
+
+
+def test_rerank_scores_an_empty_paper_as_zero():
+    papers = [{'id': 'empty'}, {'id': 'g', 'title': 'Graph networks'}]
+    reranked = asyncio.run(_reranker().rerank('graph', papers))
+    assert [(paper['id'], paper['relevance']) for paper in reranked] == [('g', 1.0), ('empty', 0.0)]
+
+
+def test_a_single_paper_is_returned_without_encoding():
+    reranker = _reranker()
+    assert asyncio.run(reranker.rerank('graph', [{'id': 'a'}])) == [{'id': 'a'}]
+    assert reranker.embedding_service.encoded == []
@@ -0,0 +1,456 @@
+import asyncio
+import hashlib
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.ingestion_jobs import IngestionWorker
+from backend.multipart_stream import MultipartError, MultipartUpload
+from backend.s3_upload import MIN_PART_SIZE, upload_stream
+from utils import http
+from utils.rate_limit import RateLimited, RateLimiter
+from utils.single_flight import SingleFlight
+
+
+def _limiter(tmp_path, rate=10, per=1.0, burst=1):
+    return RateLimiter('test', rate, per, burst=burst, state_dir=str(tmp_path))
+
+
+def test_limiters_sharing_a_state_file_share_one_bucket(tmp_path):
+    first, second = _limiter(tmp_path), _limiter(tmp_path)
+    assert first.acquire() == 0
+    # The other limiter (another worker) sees the token as taken and queues behind it
+    assert second._reserve(None) == pytest.approx(0.1, abs=0.02)
+    assert first._reserve(None) == pytest.approx(0.2, abs=0.02)
+
+
+def test_acquire_spaces_requests_at_the_rate(tmp_path):
+    limiter = _limiter(tmp_path, rate=20)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    # The first token is in the bucket; the other four arrive 50ms apart
+    assert time.monotonic() - started >= 0.19
+
+
+def test_burst_allows_back_to_back_requests(tmp_path):
+    limiter = _limiter(tmp_path, rate=1, burst=3)
+    assert [limiter._reserve(None) for _ in range(3)] == [0, 0, 0]
+    assert limiter._reserve(None) == pytest.approx(1.0, abs=0.05)
+
+
+def test_timeout_raises_without_taking_a_token(tmp_path):
+    limiter = _limiter(tmp_path, rate=1)
+    limiter.acquire()
+    with pytest.raises(RateLimited):
+        limiter.acquire(timeout=0.1)
+    assert limiter._reserve(None) == pytest.approx(1.0, abs=0.05)
+
+
+def test_cancelled_waiter_refunds_its_token(tmp_path):
+    limiter = _limiter(tmp_path, rate=1)
+
+    async def run():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(run())
+    # Only the first token is still taken, so the next caller waits one interval, not two
+    assert limiter._reserve(None) == pytest.approx(1.0, abs=0.1)
+
+
+def test_wait_for_timeout_refunds_its_token(tmp_path):
+    limiter = _limiter(tmp_path, rate=2)
+
+    async def run():
+        await limiter.acquire_async()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire_async(), timeout=0.05)
+
+    asyncio.run(run())
+    assert limiter._reserve(None) == pytest.approx(0.5, abs=0.1)
+
+
+def test_penalize_holds_off_every_limiter_on_the_file(tmp_path):
+    first, second = _limiter(tmp_path), _limiter(tmp_path)
+    first.penalize(2.0)
+    assert second._reserve(None) == pytest.approx(2.1, abs=0.05)
+    with pytest.raises(RateLimited):
+        first.acquire(timeout=1.0)
+
+
+def test_single_flight_followers_share_the_leaders_call_as_deep_copies():
+    flight = SingleFlight('test')
+    calls = []
+
+    async def search(query):
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        return {'papers': [{'title': 'Shared'}]}
+
+    async def run():
+        return await asyncio.gather(*(flight.do_async('q', search, 'q') for _ in range(3)))
+
+    leader, *followers = asyncio.run(run())
+    assert calls == ['q']
+    for result in followers:
+        assert result == leader
+        assert result is not leader
+        assert result['papers'][0] is not leader['papers'][0]
+    followers[0]['papers'].append({'title': 'Mine'})
+    assert len(leader['papers']) == len(followers[1]['papers']) == 1
+
+
+def test_single_flight_follower_runs_the_call_when_the_leader_is_cancelled():
+    flight = SingleFlight('test')
+    calls = []
+
+    async def search(query):
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        return ['result']
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do_async('q', search, 'q'))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.do_async('q', search, 'q'))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == ['result']
+    assert calls == ['q', 'q']
+
+
+def test_single_flight_followers_get_the_leaders_exception():
+    flight = SingleFlight('test')
+
+    async def search(query):
+        await asyncio.sleep(0.05)
+        raise RuntimeError('upstream down')
+
+    async def run():
+        return await asyncio.gather(*(flight.do_async('q', search, 'q') for _ in range(2)), return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(run())] == ['upstream down', 'upstream down']
+
+
+class _Interrupted(BaseException):
+    pass
+
+
+def test_single_flight_threads_retry_after_the_leader_is_interrupted():
+    flight = SingleFlight('test')
+    leader_running, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def search(query):
+        calls.append(query)
+        if len(calls) == 1:
+            leader_running.set()
+            release.wait(1)
+            raise _Interrupted()
+        return {'papers': []}
+
+    def lead():
+        with pytest.raises(_Interrupted):
+            flight.do('q', search, 'q')
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    leader_running.wait(1)
+    follower = threading.Thread(target=lambda: results.append(flight.do('q', search, 'q')))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(1)
+    follower.join(1)
+    assert results == [{'papers': []}]
+    assert len(calls) == 2
+
+
+class _FakeQueue:
+    def __init__(self):
+        self.sweeps = threading.Semaphore(0)
+
+    def claim(self):
+        return None
+
+    def fail_exhausted(self):
+        self.sweeps.release()
+        return 0
+
+
+def test_ingestion_worker_sweeps_exhausted_jobs_on_a_timer():
+    queue = _FakeQueue()
+    IngestionWorker(queue, lambda job, report: {}, threads=2, poll_interval=0.01, sweep_interval=0.05).start()
+    started = time.monotonic()
+    for _ in range(3):
+        assert queue.sweeps.acquire(timeout=1)
+    # One sweeper on its interval, not one sweep per poll of each worker thread
+    assert time.monotonic() - started >= 0.09
+    assert not queue.sweeps.acquire(timeout=0.02)
+
+
+BOUNDARY = 'test-boundary'
+
+
+class _CountingS3:
+    """Accepts uploads and keeps only their sizes."""
+    def __init__(self):
+        self.part_sizes = []
+
+    def put_object(self, Body, **params):
+        self.part_sizes.append(len(Body))
+
+    def create_multipart_upload(self, **params):
+        return {'UploadId': 'upload'}
+
+    def upload_part(self, Body, PartNumber, **params):
+        self.part_sizes.append(len(Body))
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, **params):
+        pass
+
+    def abort_multipart_upload(self, **params):
+        pass
+
+
+async def _multipart_body(file_chunks, chunk_size=64 * 1024, truncate=False):
+    """A multipart body with a user_id field and then the file, in ASGI-sized chunks."""
+    yield (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="user_id"\r\n\r\nuser-1\r\n'
+           f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="big.pdf"\r\n'
+           f'Content-Type: application/pdf\r\n\r\n').encode()
+    for _ in range(file_chunks):
+        yield b'%PDF-' + b'x' * (chunk_size - 5)
+        await asyncio.sleep(0)
+    if not truncate:
+        yield f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+async def _stream_upload(body, s3):
+    upload = MultipartUpload(f'multipart/form-data; boundary={BOUNDARY}')
+    assert await upload.read_until_file(body)
+    feeding = asyncio.create_task(upload.feed_file(body))
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            None, lambda: upload_stream(s3, 'bucket', 'key', upload.file, part_size=MIN_PART_SIZE, concurrency=1)
+        )
+    finally:
+        feeding.cancel()
+        await asyncio.gather(feeding, return_exceptions=True)
+    return upload, result
+
+
+def test_multipart_upload_streams_the_file_to_s3_in_parts():
+    chunk = b'%PDF-' + b'x' * (64 * 1024 - 5)
+    file_chunks = 192  # 12 MiB: two full parts and a short one
+    s3 = _CountingS3()
+    upload, result = asyncio.run(_stream_upload(_multipart_body(file_chunks), s3))
+    assert upload.fields == {'user_id': 'user-1'}
+    assert (upload.filename, upload.content_type) == ('big.pdf', 'application/pdf')
+    assert s3.part_sizes == [MIN_PART_SIZE, MIN_PART_SIZE, file_chunks * len(chunk) - 2 * MIN_PART_SIZE]
+    assert result.size == file_chunks * len(chunk)
+    assert result.sha256 == hashlib.sha256(chunk * file_chunks).hexdigest()
+    assert result.content_type == 'application/pdf'
+
+
+def test_multipart_upload_memory_stays_bounded_for_a_large_body():
+    # In a fresh process, so the peak RSS is this upload's; tracemalloc slows the parser too much for 256 MiB
+    script = textwrap.dedent(f"""
+        import asyncio, resource, sys
+        sys.path.insert(0, {os.path.dirname(__file__)!r})
+        from test_utils import _CountingS3, _multipart_body, _stream_upload
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        asyncio.run(_stream_upload(_multipart_body(4096), _CountingS3()))
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True).stdout
+    peak_growth = int(output) * 1024  # ru_maxrss is in KiB on Linux
+    # A part being filled, one in flight and its copy, plus the queued chunks; not the 256 MiB body
+    assert peak_growth < 6 * MIN_PART_SIZE
+
+
+def test_multipart_upload_truncated_body_fails_the_reader():
+    with pytest.raises(MultipartError, match='ended before the end of the file'):
+        asyncio.run(_stream_upload(_multipart_body(4, truncate=True), _CountingS3()))
+
+
+def test_multipart_upload_rejects_other_content_types():
+    async def run():
+        MultipartUpload('application/json')
+
+    with pytest.raises(MultipartError):
+        asyncio.run(run())
+
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.requests.append(self.command)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        body = b'ok'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server(monkeypatch):
+    """A keep-alive HTTP server answering with the queued `statuses` (then 200), and a fresh retry budget."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ScriptedHandler)
+    server.daemon_threads = True
+    server.connections, server.requests, server.statuses = set(), [], []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(http, 'RETRY_BACKOFF', 0.0)
+    monkeypatch.setattr(http, '_session', None)
+    monkeypatch.setattr(http, 'retry_budget', http.RetryBudget())
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sync_requests_reuse_one_pooled_connection(http_server):
+    assert http.get_session() is http.get_session()
+    for _ in range(3):
+        assert http.http_get(http_server.url).status_code == 200
+    assert len(http_server.requests) == 3
+    assert len(http_server.connections) == 1
+
+
+def test_a_forked_child_gets_its_own_session(monkeypatch):
+    parent = http.get_session()
+    monkeypatch.setattr(http.os, 'getpid', lambda: -1)
+    assert http.get_session() is not parent
+
+
+def test_async_requests_reuse_the_loops_client(http_server):
+    async def run():
+        client = http.get_async_client()
+        for _ in range(3):
+            assert (await http.http_get_async(http_server.url)).status_code == 200
+        assert http.get_async_client() is client
+        return client
+
+    first = asyncio.run(http.closing_async_client(run()))
+    assert first.is_closed
+    assert len(http_server.connections) == 1
+    # Another loop gets another client
+    assert asyncio.run(http.closing_async_client(run())) is not first
+
+
+def test_closing_async_client_leaves_a_long_lived_client_open():
+    async def run():
+        client = http.get_async_client()
+        await http.closing_async_client(asyncio.sleep(0))
+        assert not client.is_closed
+        await http.close_async_client()
+        return client
+
+    assert asyncio.run(run()).is_closed
+
+
+def test_gets_retry_unavailable_upstreams(http_server):
+    http_server.statuses = [503, 502]
+    assert http.http_get(http_server.url).status_code == 200
+    http_server.statuses = [503]
+
+    async def get():
+        return (await http.http_get_async(http_server.url)).status_code
+    assert asyncio.run(http.closing_async_client(get())) == 200
+    assert http_server.requests == ['GET'] * 5
+
+
+def test_posts_are_not_retried(http_server):
+    http_server.statuses = [503]
+    assert http.http_post(http_server.url, data=b'x').status_code == 503
+    assert http_server.requests == ['POST']
+
+
+def test_an_exhausted_retry_budget_returns_the_error_response(http_server, monkeypatch):
+    monkeypatch.setattr(http, 'retry_budget', http.RetryBudget(ratio=0, min_per_second=0))
+    http_server.statuses = [503, 503]
+    assert http.http_get(http_server.url).status_code == 503
+
+    async def get():
+        return (await http.http_get_async(http_server.url)).status_code
+    assert asyncio.run(http.closing_async_client(get())) == 503
+    assert len(http_server.requests) == 2
+
+
+def test_retry_budget_tracks_recent_requests(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(http.time, 'monotonic', lambda: now[0])
+    budget = http.RetryBudget(ratio=0.5, min_per_second=0, ttl=10)
+    budget.deposit()
+    budget.deposit()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+    # Deposits expire with the window
+    now[0] = 10.0
+    budget.deposit()
+    assert not budget.try_withdraw()
+
+
+def test_each_ingestion_wake_ends_exactly_one_wait():
+    worker = IngestionWorker(_FakeQueue(), lambda job, report: {}, threads=2, poll_interval=0.2)
+    worker.wake()
+    worker.wake()
+    started = time.monotonic()
+    worker._wait_for_work()
+    worker._wait_for_work()
+    # Neither wake was lost to the other
+    assert time.monotonic() - started < 0.1
+    worker._wait_for_work()
+    assert time.monotonic() - started >= 0.2
+
+
+class _JobQueue:
+    def __init__(self):
+        self.jobs = []
+        self.done = threading.Semaphore(0)
+
+    def claim(self):
+        return self.jobs.pop(0) if self.jobs else None
+
+    def complete(self, job_id, result):
+        self.done.release()
+
+    def fail_exhausted(self):
+        return 0
+
+
+def test_an_idle_ingestion_worker_runs_a_woken_job_without_waiting_for_its_poll():
+    queue = _JobQueue()
+    worker = IngestionWorker(queue, lambda job, report: {}, poll_interval=30)
+    worker.start()
+    for number in range(3):
+        # Give the thread time to find the queue empty and go idle
+        time.sleep(0.05)
+        queue.jobs.append({'id': number, 'file_name': 'paper.pdf', 'attempts': 1})
+        worker.wake()
+        assert queue.done.acquire(timeout=2)
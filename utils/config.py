@@ -17,6 +17,12 @@ class Config:
     FACTCHECK_AGENT_ID = "factcheck-agent"
     CITATION_AGENT_ID = "citation-agent"
 
+    # Upstream service endpoints (override to point at mirrors or the benchmark fakes)
+    ARXIV_API_URL = os.getenv('ARXIV_API_URL', 'https://export.arxiv.org/api/query')
+    SEMANTIC_SCHOLAR_API_URL = os.getenv('SEMANTIC_SCHOLAR_API_URL', 'https://api.semanticscholar.org/graph/v1')
+    NEWS_API_URL = os.getenv('NEWS_API_URL', 'https://newsapi.org/v2/everything')
+    CROSSREF_API_URL = os.getenv('CROSSREF_API_URL', 'https://api.crossref.org/works')
+
     # API Settings
     API_HOST = "0.0.0.0"
     API_PORT = 8000
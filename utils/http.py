@@ -0,0 +1,236 @@
+"""
+Shared HTTP clients for the agents' outbound calls.
+
+Every call goes through one requests.Session per process (sync) or one
+httpx.AsyncClient per event loop (async), so connections to the few hosts we talk
+to (arXiv, Semantic Scholar, CrossRef, NewsAPI, publishers) are pooled per host
+and kept alive instead of paying a TCP and TLS handshake on each request. The
+ASGI app's long-lived loop keeps its client until shutdown; code running on a
+short-lived loop wraps its work in closing_async_client().
+
+Both clients apply a default (connect, read) timeout and retry idempotent requests
+on connection errors and 502/503/504 (not on read timeouts), with exponential backoff. Retries draw from a
+process-wide retry budget: at most HTTP_RETRY_RATIO retries per request made
+(plus a small floor per second), so an upstream outage doesn't turn into a retry
+storm that multiplies the load on it.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Optional, Tuple, TypeVar
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '15'))
+DEFAULT_TIMEOUT: Tuple[float, float] = (CONNECT_TIMEOUT, READ_TIMEOUT)
+# Hosts to keep pools for, and connections kept alive per host
+POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '16'))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '32'))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.3'))
+RETRY_STATUSES = frozenset({502, 503, 504})
+RETRY_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+USER_AGENT = os.getenv('HTTP_USER_AGENT', 'thesys-ai/1.0 (+https://github.com/sahusgupta/thesys-ai)')
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of recent requests.
+
+    Each request deposits `ratio` tokens and each retry spends one; on top of that
+    `min_per_second` retries are always allowed. Deposits expire after `ttl`
+    seconds, so the budget tracks recent traffic only.
+    """
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 2.0, ttl: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._deposits = 0.0
+        self._withdrawals = 0.0
+        self._window_started = time.monotonic()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._roll()
+            self._deposits += self.ratio
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            self._roll()
+            if self._withdrawals + 1 > self._deposits + self.min_per_second * self.ttl:
+                return False
+            self._withdrawals += 1
+            return True
+
+    def _roll(self) -> None:
+        now = time.monotonic()
+        if now - self._window_started >= self.ttl:
+            self._deposits = self._withdrawals = 0.0
+            self._window_started = now
+
+
+retry_budget = RetryBudget(
+    ratio=float(os.getenv('HTTP_RETRY_RATIO', '0.1')),
+    min_per_second=float(os.getenv('HTTP_RETRY_MIN_PER_SECOND', '2'))
+)
+
+
+class BudgetedRetry(Retry):
+    """
+    urllib3 Retry that gives up once the shared retry budget is spent.
+
+    A retryable status (502/503/504) is then returned to the caller as the response,
+    as when the attempts run out with raise_on_status=False; a connection error is raised.
+    """
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if not super().is_retry(method, status_code, has_retry_after):
+            return False
+        if self.total is not None and self.total <= 0:
+            # Out of attempts anyway; increment() surfaces the response without spending budget
+            return True
+        if not retry_budget.try_withdraw():
+            logger.warning("HTTP retry budget exhausted, not retrying")
+            return False
+        return True
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new_retry = super().increment(method, url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace)
+        # Status retries were paid for in is_retry
+        if response is None and not retry_budget.try_withdraw():
+            logger.warning("HTTP retry budget exhausted, not retrying")
+            raise MaxRetryError(_pool, url, reason=error or ResponseError("retry budget exhausted"))
+        return new_retry
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that applies the default timeout and counts requests toward the retry budget."""
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = DEFAULT_TIMEOUT
+        retry_budget.deposit()
+        return super().send(request, **kwargs)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    retries = BudgetedRetry(
+        total=MAX_RETRIES,
+        read=0,  # a request that timed out reading would most likely time out again
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = _PooledAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """The process-wide pooled Session (re-created in a forked child, whose sockets it can't share)."""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def http_get(url: str, **kwargs: Any) -> requests.Response:
+    """GET through the shared Session, with the default timeout unless one is given."""
+    return get_session().get(url, **kwargs)
+
+
+def http_post(url: str, **kwargs: Any) -> requests.Response:
+    """POST through the shared Session. POSTs are not retried."""
+    return get_session().post(url, **kwargs)
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """The pooled AsyncClient for the running event loop (httpx clients can't be shared across loops)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_HOSTS * POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+            headers={'User-Agent': USER_AGENT},
+            follow_redirects=True
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def http_get_async(url: str, **kwargs: Any) -> httpx.Response:
+    """GET through the loop's shared AsyncClient, retrying connection errors and 502/503/504
+    with backoff while the retry budget allows."""
+    client = get_async_client()
+    retry_budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            response = await client.get(url, **kwargs)
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            error: Optional[Exception] = None
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+            response, error = None, e
+        if attempt >= MAX_RETRIES or not retry_budget.try_withdraw():
+            if error is not None:
+                raise error
+            return response
+        attempt += 1
+        await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+async def http_post_async(url: str, **kwargs: Any) -> httpx.Response:
+    """POST through the loop's shared AsyncClient. POSTs are not retried."""
+    return await get_async_client().post(url, **kwargs)
+
+
+async def close_async_client() -> None:
+    """Close the running loop's AsyncClient, e.g. on application shutdown."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def closing_async_client(awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable` on a short-lived event loop (asyncio.run, Flask's per-request
+    loops) and then close the AsyncClient it created, whose sockets would otherwise
+    stay open until garbage collection. A client the loop already had, like the
+    ASGI app's long-lived one, is left open for the loop's other requests.
+    """
+    had_client = asyncio.get_running_loop() in _async_clients
+    try:
+        return await awaitable
+    finally:
+        if not had_client:
+            await close_async_client()
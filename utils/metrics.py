@@ -0,0 +1,161 @@
+"""
+Request/stage latency metrics.
+
+Stage timings are collected per request (through a context variable, so stages
+running concurrently on the event loop or in executor threads all land in the
+same request) and sent back in a Server-Timing header. The same measurements
+feed Prometheus histograms served at /metrics, alongside per-agent counters for
+calls to upstream services (arXiv, Semantic Scholar, NewsAPI, OpenAI, S3,
+Postgres).
+
+Set PROMETHEUS_MULTIPROC_DIR when running several worker processes so /metrics
+aggregates all of them; gunicorn.conf.py sets it, empties it at startup and
+marks exited workers dead.
+"""
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+REQUEST_DURATION = Histogram(
+    'thesys_request_duration_seconds', 'HTTP request latency',
+    ['method', 'route', 'status'], buckets=_LATENCY_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    'thesys_stage_duration_seconds', 'Latency of each request stage (factcheck, search, citations, db, openai, vectorize, ...)',
+    ['stage'], buckets=_LATENCY_BUCKETS
+)
+UPSTREAM_CALLS = Counter(
+    'thesys_upstream_calls_total', 'Calls to upstream services by agent',
+    ['agent', 'upstream', 'outcome']
+)
+UPSTREAM_DURATION = Histogram(
+    'thesys_upstream_duration_seconds', 'Latency of upstream service calls by agent',
+    ['agent', 'upstream'], buckets=_LATENCY_BUCKETS
+)
+RATE_LIMIT_WAIT = Histogram(
+    'thesys_rate_limit_wait_seconds', 'Time spent waiting for an upstream rate-limit slot',
+    ['upstream'], buckets=(0.0, 0.1, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+)
+SEARCH_LOOKUPS = Counter(
+    'thesys_search_lookups_total', 'Search lookups by where they were answered (local index, cache hit, stale hit, miss)',
+    ['outcome']
+)
+SINGLE_FLIGHT_SHARED = Counter(
+    'thesys_single_flight_shared_total', 'Calls answered by an identical call already in flight instead of their own upstream request',
+    ['operation']
+)
+
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Begin collecting stage timings for the current request."""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def get_request_timings() -> Dict[str, float]:
+    return _request_timings.get() or {}
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_DURATION.labels(stage=stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        # A stage can run more than once per request (e.g. several DB queries)
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def upstream_call(agent: str, upstream: str):
+    """Count and time one call from an agent to an upstream service; exceptions count as errors."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_CALLS.labels(agent=agent, upstream=upstream, outcome='error').inc()
+        raise
+    else:
+        UPSTREAM_CALLS.labels(agent=agent, upstream=upstream, outcome='ok').inc()
+    finally:
+        UPSTREAM_DURATION.labels(agent=agent, upstream=upstream).observe(time.perf_counter() - started)
+
+
+def instrument_boto3_client(client, agent: str) -> None:
+    """Count and time every call a boto3 client makes, via botocore's event hooks."""
+    service = client.meta.service_model.service_name
+
+    def before_call(context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    def after_call(http_response, context, **kwargs):
+        outcome = 'ok' if http_response.status_code < 400 else 'error'
+        _finish_boto3_call(context, outcome)
+
+    def after_call_error(context, **kwargs):
+        _finish_boto3_call(context, 'error')
+
+    def _finish_boto3_call(context, outcome):
+        UPSTREAM_CALLS.labels(agent=agent, upstream=service, outcome=outcome).inc()
+        started = context.pop('metrics_started', None)
+        if started is not None:
+            UPSTREAM_DURATION.labels(agent=agent, upstream=service).observe(time.perf_counter() - started)
+
+    client.meta.events.register(f'before-call.{service}', before_call)
+    client.meta.events.register(f'after-call.{service}', after_call)
+    client.meta.events.register(f'after-call-error.{service}', after_call_error)
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Format stage timings (seconds) as a Server-Timing header value (milliseconds)."""
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    REQUEST_DURATION.labels(method=method, route=route, status=str(status)).observe(seconds)
+
+
+def metrics_payload() -> Tuple[bytes, str]:
+    """Prometheus exposition for this process, or for all workers in multiprocess mode."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+@functools.lru_cache(maxsize=None)
+def instrumented_cursor_factory(agent: str):
+    """psycopg2 cursor class that counts and times every execute as a Postgres upstream call."""
+    import psycopg2.extensions
+
+    class InstrumentedCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            with upstream_call(agent, 'postgres'):
+                return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            with upstream_call(agent, 'postgres'):
+                return super().executemany(query, vars_list)
+
+    return InstrumentedCursor
@@ -0,0 +1,194 @@
+"""
+Token-bucket rate limits for upstream APIs, shared by every worker process on the host.
+
+Each upstream has one bucket whose state (tokens, last refill time) lives in a
+small file under RATE_LIMIT_DIR, updated under an exclusive flock. Callers reserve
+a token and are told how long to wait for it, so `acquire()` sleeps in a worker
+thread and `acquire_async()` awaits without holding up the event loop. A caller
+that stops waiting (cancelled, or timed out by wait_for) hands its token back.
+
+Limits default to what each upstream documents and can be overridden with
+RATE_LIMIT_<UPSTREAM>=<requests>/<seconds>, e.g. RATE_LIMIT_ARXIV=1/3.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from utils.metrics import RATE_LIMIT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# (requests, per seconds)
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    'arxiv': (1, 3.0),              # arXiv API terms: one request every three seconds
+    'semantic_scholar': (1, 1.0),   # S2 API key default: one request per second
+    'crossref': (5, 1.0),           # CrossRef public pool
+    'newsapi': (1, 1.0),
+}
+
+_STATE = struct.Struct('dd')  # tokens, updated_at (wall clock, comparable across processes)
+
+
+class RateLimited(Exception):
+    """Raised when a token would not be available within the caller's timeout."""
+
+
+class RateLimiter:
+    """
+    Token bucket refilled at `rate` tokens per `per` seconds, holding at most `burst`.
+
+    Reservations may take the bucket below zero; the deficit is the queue of callers
+    already waiting, so later callers are told to wait correspondingly longer.
+    Falls back to a process-local bucket if the state file cannot be opened.
+    """
+    def __init__(self, name: str, rate: float, per: float = 1.0, burst: Optional[float] = None, state_dir: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.rate = float(rate) / float(per)
+        self.burst = float(burst if burst is not None else rate)
+        self.state_dir = state_dir or os.getenv('RATE_LIMIT_DIR', os.path.join(tempfile.gettempdir(), 'thesys-ratelimits'))
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._fd_pid: Optional[int] = None
+        self._local_state: Optional[Tuple[float, float]] = None
+
+    def acquire(self, timeout: Optional[float] = None) -> float:
+        """Block until a token is available; returns the seconds waited."""
+        wait = self._reserve(timeout)
+        if wait > 0:
+            acquired = False
+            try:
+                time.sleep(wait)
+                acquired = True
+            finally:
+                if not acquired:
+                    self._refund()
+        return wait
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> float:
+        """Wait for a token without blocking the event loop; returns the seconds waited."""
+        wait = self._reserve(timeout)
+        if wait > 0:
+            acquired = False
+            try:
+                await asyncio.sleep(wait)
+                acquired = True
+            finally:
+                if not acquired:
+                    self._refund()
+        return wait
+
+    def penalize(self, seconds: float) -> None:
+        """Hold off every caller for `seconds`, e.g. after the upstream answered 429."""
+        with self._locked_state() as state:
+            tokens, updated = self._refill(*state)
+            state[:] = [min(tokens, 0.0) - seconds * self.rate, updated]
+
+    def _reserve(self, timeout: Optional[float]) -> float:
+        with self._locked_state() as state:
+            tokens, updated = self._refill(*state)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                state[:] = [tokens, updated]
+                raise RateLimited(f"{self.name}: no request slot within {timeout}s (next in {wait:.1f}s)")
+            state[:] = [tokens - 1, updated]
+        RATE_LIMIT_WAIT.labels(upstream=self.name).observe(wait)
+        return wait
+
+    def _refund(self) -> None:
+        """Give back a reserved token whose caller stopped waiting for it."""
+        with self._locked_state() as state:
+            tokens, updated = self._refill(*state)
+            state[:] = [min(self.burst, tokens + 1), updated]
+
+    def _refill(self, tokens: float, updated: float) -> Tuple[float, float]:
+        now = time.time()
+        if updated <= 0:
+            return self.burst, now
+        return min(self.burst, tokens + max(0.0, now - updated) * self.rate), now
+
+    def _locked_state(self):
+        return _LockedState(self)
+
+    def _open(self) -> Optional[int]:
+        # A descriptor inherited across fork would share its flock with the parent
+        if self._fd is not None and self._fd_pid == os.getpid():
+            return self._fd
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            self._fd = os.open(os.path.join(self.state_dir, f"{self.name}.bucket"), os.O_RDWR | os.O_CREAT, 0o666)
+            self._fd_pid = os.getpid()
+        except OSError as e:
+            if self._local_state is None:
+                self.logger.warning(f"Rate limit state for '{self.name}' is not shareable, limiting per process: {str(e)}")
+                self._local_state = (self.burst, time.time())
+            self._fd = None
+        return self._fd
+
+
+class _LockedState:
+    """Context manager yielding [tokens, updated_at] for a limiter, written back on exit."""
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+        self.fd: Optional[int] = None
+        self.state = [0.0, 0.0]
+
+    def __enter__(self):
+        self.limiter._lock.acquire()
+        try:
+            self.fd = self.limiter._open()
+            if self.fd is None:
+                self.state = list(self.limiter._local_state)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                raw = os.pread(self.fd, _STATE.size, 0)
+                if len(raw) == _STATE.size:
+                    self.state = list(_STATE.unpack(raw))
+        except BaseException:
+            self.limiter._lock.release()
+            raise
+        return self.state
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.fd is None:
+                self.limiter._local_state = tuple(self.state)
+            else:
+                try:
+                    os.pwrite(self.fd, _STATE.pack(*self.state), 0)
+                finally:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.limiter._lock.release()
+        return False
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _configured_limit(upstream: str) -> Tuple[float, float]:
+    override = os.getenv(f"RATE_LIMIT_{upstream.upper()}")
+    if override:
+        try:
+            requests, _, seconds = override.partition('/')
+            return float(requests), float(seconds or 1)
+        except ValueError:
+            logger.warning(f"Ignoring malformed RATE_LIMIT_{upstream.upper()}={override!r}, expected <requests>/<seconds>")
+    return DEFAULT_LIMITS.get(upstream, (1, 1.0))
+
+
+def get_rate_limiter(upstream: str) -> RateLimiter:
+    """The shared limiter for an upstream ('arxiv', 'semantic_scholar', 'crossref', 'newsapi')."""
+    with _limiters_lock:
+        limiter = _limiters.get(upstream)
+        if limiter is None:
+            rate, per = _configured_limit(upstream)
+            limiter = _limiters[upstream] = RateLimiter(upstream, rate, per)
+        return limiter
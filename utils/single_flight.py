@@ -0,0 +1,100 @@
+"""
+Single-flight de-duplication of identical concurrent calls.
+
+When the same search or lookup arrives several times at once (a class or lab
+all asking the same question), only the first caller runs it; the others wait
+on its future and get a copy of its result, or its exception. A key is only in
+flight while its call runs, so nothing is cached beyond that: later calls run
+again (and go through whatever caching the caller has).
+
+Futures are concurrent.futures.Future, so calls are shared between threads and
+between event loops (asgiref runs each Flask view on its own loop).
+"""
+import asyncio
+import copy
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from utils.metrics import SINGLE_FLIGHT_SHARED
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaderCancelled(Exception):
+    """Set on a shared future whose leading call was cancelled; followers run the call themselves."""
+
+
+class SingleFlight:
+    """In-flight calls of one operation, keyed by a normalized request."""
+    def __init__(self, operation: str):
+        self.operation = operation
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        """The in-flight future for key and whether the caller has to run the call itself."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs), or wait for the identical call already running under key."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                result = future.result()
+            except _LeaderCancelled:
+                continue
+            SINGLE_FLIGHT_SHARED.labels(self.operation).inc()
+            # Each caller gets its own copy to modify
+            return copy.deepcopy(result)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else _LeaderCancelled())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """Await fn(*args, **kwargs), or the identical call already running under key (on any loop)."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield: a follower giving up must not cancel the shared future under the leader
+                result = await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                continue
+            SINGLE_FLIGHT_SHARED.labels(self.operation).inc()
+            return copy.deepcopy(result)
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            # A cancelled leader (e.g. past its deadline) hands the call to the next follower
+            future.set_exception(e if isinstance(e, Exception) else _LeaderCancelled())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, future)
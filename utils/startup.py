@@ -0,0 +1,131 @@
+"""
+Lazy initialization helpers and the per-component startup timing report.
+
+Expensive resources (agents, model clients, DB connections) are built on first
+use through `lazy_component`, and every build is timed and recorded so the
+report served at /api/startup shows where cold-start time goes.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+_report: Dict[str, Dict[str, Any]] = {}
+_report_lock = threading.Lock()
+_process_started = time.monotonic()
+
+
+def record_startup(component: str, seconds: float, error: Exception = None) -> None:
+    with _report_lock:
+        _report[component] = {
+            'seconds': round(seconds, 3),
+            'status': 'error' if error else 'ok',
+            'error': str(error) if error else None
+        }
+    if error:
+        logger.warning(f"Initializing {component} failed after {seconds:.2f}s: {error}")
+    else:
+        logger.info(f"Initialized {component} in {seconds:.2f}s")
+
+
+def timed_init(component: str, factory: Callable[[], Any]) -> Any:
+    """Call factory, recording how long it took (and whether it failed) under component."""
+    started = time.monotonic()
+    try:
+        value = factory()
+    except Exception as e:
+        record_startup(component, time.monotonic() - started, e)
+        raise
+    record_startup(component, time.monotonic() - started)
+    return value
+
+
+def get_startup_report() -> Dict[str, Any]:
+    with _report_lock:
+        components = {name: dict(entry) for name, entry in _report.items()}
+    return {
+        'uptime_seconds': round(time.monotonic() - _process_started, 3),
+        'components': components
+    }
+
+
+class lazy_component:
+    """
+    Thread-safe cached property that builds a component on first access.
+
+    The build is timed into the startup report. A failed build is not cached, so
+    the next access tries again (e.g. once the network is back).
+    """
+    def __init__(self, func: Callable[[Any], Any]):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self._lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            pass
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = timed_init(self.name, lambda: self.func(instance))
+            return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    @staticmethod
+    def is_loaded(instance: Any, name: str) -> bool:
+        return name in instance.__dict__
+
+
+def start_warmup(instance: Any, components: Iterable[str]) -> threading.Thread:
+    """Touch each lazy component on a background thread so the first request doesn't pay for it."""
+    def warm():
+        for name in components:
+            try:
+                getattr(instance, name)
+            except Exception:
+                # Already recorded in the startup report; the request path will retry
+                pass
+        logger.info("Background warm-up finished")
+
+    thread = threading.Thread(target=warm, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+_nltk_checked = set()
+_nltk_lock = threading.Lock()
+
+
+def ensure_nltk_data(*resources: str) -> None:
+    """
+    Make sure NLTK data packages are available, downloading only the missing ones.
+
+    Takes package paths as nltk.data.find expects them, e.g. 'corpora/stopwords'.
+    Checked once per process; a failed download is logged, not raised, so callers
+    can still start without network access.
+    """
+    import nltk
+
+    with _nltk_lock:
+        for resource in resources:
+            if resource in _nltk_checked:
+                continue
+            try:
+                nltk.data.find(resource)
+            except LookupError:
+                try:
+                    nltk.download(resource.rsplit('/', 1)[-1], quiet=True)
+                except Exception as e:
+                    logger.warning(f"Could not download NLTK resource {resource}: {e}")
+            _nltk_checked.add(resource)